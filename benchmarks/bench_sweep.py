@@ -0,0 +1,72 @@
+"""
+Sweep throughput (param sets per second) by number of workers, on a year of
+synthetic 30m candles and dollar bars. No database needed:
+
+    python -m benchmarks.bench_sweep --workers 1 2 4 8
+
+Each run is a fresh sweep over the same grid, so worker start-up (memory-mapping
+the history and building the 4h/2h bars once) is included.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from strategy_clients.sweep import DEFAULT_GRID, export_history, param_grid, sweep
+
+DAYS = 365
+START = pd.Timestamp("2023-01-01", tz="UTC")
+
+
+def synthetic_history(rng: np.random.Generator):
+    n = DAYS * 48
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    open_ = np.concatenate([[30000.0], close[:-1]])
+    candles = pd.DataFrame(
+        {
+            "close_datetime": pd.date_range(START + pd.Timedelta(minutes=30), periods=n, freq="30min"),
+            "open": open_,
+            "high": np.maximum(open_, close) * 1.001,
+            "low": np.minimum(open_, close) * 0.999,
+            "close": close,
+        }
+    )
+    durations = rng.exponential(rng.choice([1200, 6000], DAYS * 40)).astype(np.int64) + 1
+    close_time = START.timestamp() + np.cumsum(durations)
+    keep = close_time <= (START + pd.Timedelta(days=DAYS)).timestamp()
+    dollar_bars = pd.DataFrame(
+        {
+            "open_time": (close_time - durations)[keep].astype(np.int64),
+            "close_time": close_time[keep].astype(np.int64),
+            "duration": durations[keep].astype(np.float64),
+        }
+    )
+    return candles, dollar_bars
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep throughput by number of workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    candles, dollar_bars = synthetic_history(np.random.default_rng(0))
+    grid = param_grid(**DEFAULT_GRID)
+    directory = tempfile.mkdtemp(prefix="bench_sweep_")
+    export_history(directory, candles, {DEFAULT_GRID["db_threshold"][0]: dollar_bars})
+    start = START + pd.Timedelta(days=60)
+
+    print(f"{len(grid)} param sets over {DAYS} days, {os.cpu_count()} cores")
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        started = time.perf_counter()
+        sweep(directory, grid, start=start, max_workers=workers)
+        rate = len(grid) / (time.perf_counter() - started)
+        baseline = baseline or rate
+        print(f"{workers:>3} workers {rate:8.1f} param sets/s  {rate / baseline:5.2f}x of 1 worker")
+
+
+if __name__ == "__main__":
+    main()
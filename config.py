@@ -1,3 +1,4 @@
+import json
 import os
 
 from dotenv import load_dotenv
@@ -11,6 +12,55 @@ RESEARCH_DB_HOST = os.getenv("RESEARCH_DB_HOST")
 RESEARCH_DB_PORT = os.getenv("RESEARCH_DB_PORT")
 RESEARCH_DB_NAME = os.getenv("RESEARCH_DB_NAME")
 
+# Connection pool per DB engine, raise for deployments running many symbols
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+
+# Wake generators on candle/dollar bar inserts (LISTEN/NOTIFY), polling stays on as a fallback
+DATA_NOTIFICATIONS = os.getenv("DATA_NOTIFICATIONS", "false").lower() == "true"
+
+# Run generators on one asyncio event loop (AsyncScheduler) instead of the sync loop.
+# Not with SUPERVISOR_WORKERS or MARKET_DATA_BUS, main.py refuses to start
+ASYNC_MODE = os.getenv("ASYNC_MODE", "false").lower() == "true"
+
+# Source kline table per symbol on top of the defaults in data_client.SOURCE_TABLES, e.g.
+# {"SOLUSDT": "solusdt_usdm"}. Dollar bar staleness is checked against it, symbols without one are always stale
+SOURCE_TABLES = json.loads(os.getenv("SOURCE_TABLES", "{}"))
+
+# Per source staleness limits in seconds, e.g. {"source": 300, "candle_30m": 1920}, see freshness.py
+FRESHNESS_MAX_AGE_SECONDS = json.loads(os.getenv("FRESHNESS_MAX_AGE_SECONDS", "{}"))
+
+# Serve Prometheus metrics on this port (http://host:port/metrics), 0 turns it off
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# Aggregate 30m/1m candles into higher timeframe bars in Postgres (date_bin/GROUP BY, needs
+# PostgreSQL 14+) instead of fetching every candle and aggregating in pandas
+SERVER_SIDE_BARS = os.getenv("SERVER_SIDE_BARS", "false").lower() == "true"
+
+# Threads loading the history of every generator at startup, keep it within DB_POOL_SIZE + DB_MAX_OVERFLOW
+BOOTSTRAP_WORKERS = int(os.getenv("BOOTSTRAP_WORKERS", 8))
+
+# Shard the generators across this many worker processes (Supervisor), 0 runs them all in this one
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", 0))
+
+# Read candles and dollar bars from the shared memory market data bus instead of the DB,
+# needs the ingest running on the same box (python -m strategy_clients.market_data_bus)
+MARKET_DATA_BUS = os.getenv("MARKET_DATA_BUS", "false").lower() == "true"
+
+# Prefix of the bus' shared memory segments (/dev/shm/<prefix><symbol>_<kind>)
+MARKET_DATA_BUS_PREFIX = os.getenv("MARKET_DATA_BUS_PREFIX", "mdbus_")
+
+# Generators to run, StrategySpec fields as JSON, e.g.
+# [{"strategy": "big_bend", "symbol": "BTCUSDT", "name": "Big Bend BTC", "params": {...}}].
+# main.py and the market data bus ingest both read it
+STRATEGIES = json.loads(
+    os.getenv("STRATEGIES", '[{"strategy": "big_bend", "symbol": "BTCUSDT", "name": "Big Bend BTC"}]')
+)
+
+# Bars are cached here between restarts, set to an empty string to always load from the DB
+BAR_CACHE_DIR = os.getenv("BAR_CACHE_DIR", "bar_cache")
+
 SLACK_CHANNEL = os.getenv("SLACK_CHANNEL")
 SLACK_TOKEN = os.getenv("SLACK_CHANNEL")
 
@@ -0,0 +1 @@
+# Lets tests import config and strategy_clients from the repo root, same as main.py
@@ -1,12 +1,22 @@
 import logging
-import time
-import traceback
 
-from config import RESEARCH_PG_URI, SLACK_CHANNEL
-from strategy_clients.big_bend_client import SignalGeneratorBigBend
+from config import (
+    ASYNC_MODE,
+    DATA_NOTIFICATIONS,
+    MARKET_DATA_BUS,
+    METRICS_PORT,
+    RESEARCH_PG_URI,
+    STRATEGIES,
+    SUPERVISOR_WORKERS,
+)
 from strategy_clients.data_client import DataClient
+from strategy_clients.market_data_bus import BusDataClient, BusListener, channels_for
+from strategy_clients.metrics import start_http_server
+from strategy_clients.notify_listener import DataNotificationListener
+from strategy_clients.scheduler import AsyncScheduler, Scheduler
 from strategy_clients.strategy_client import StrategyClient
-from strategy_clients.models import System
+from strategy_clients.supervisor import Supervisor
+from strategy_clients.models import StrategySpec, System
 
 
 def setup_logging():
@@ -39,36 +49,60 @@ research = System(name="research", db_url=RESEARCH_PG_URI)
 
 
 
+# (strategy, symbol, params) for every generator this process runs, see STRATEGIES in config.py
+strategies = [StrategySpec(**spec) for spec in STRATEGIES]
+
+
 def main():
 
     systems = [
         research,
     ]
 
-    dc = DataClient(systems=systems)
+    if ASYNC_MODE and (SUPERVISOR_WORKERS or MARKET_DATA_BUS):
+        # Supervisor workers and the bus only run the sync Scheduler
+        raise ValueError("ASYNC_MODE can't be combined with SUPERVISOR_WORKERS or MARKET_DATA_BUS")
+
+    if MARKET_DATA_BUS:
+        # Raises for generators that need data the bus doesn't carry, before anything starts
+        channels_for(strategies)
+
+    if SUPERVISOR_WORKERS:
+        # Each worker serves its own metrics on METRICS_PORT + 1 + worker
+        Supervisor(
+            systems=systems,
+            specs=strategies,
+            workers=SUPERVISOR_WORKERS,
+            metrics_port=METRICS_PORT,
+            notifications_url=research.db_url if DATA_NOTIFICATIONS and not MARKET_DATA_BUS else None,
+        ).run_forever()
+        return
+
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+
+    if ASYNC_MODE:
+        AsyncScheduler(systems=systems, specs=strategies).run_forever()
+        return
+
     sc = StrategyClient(systems=systems)
-    
-    strategy_name = "Big Bend BTC"
-    big_bend_signal_generator_btc = SignalGeneratorBigBend(
-        systems=systems, strategy_name=strategy_name, data_client=dc, symbol="BTCUSDT"
+    if MARKET_DATA_BUS:
+        # The bus ingest does the DB reads, updates wake the generators like notifications
+        dc = BusDataClient(systems=systems)
+        listener = BusListener(dc)
+    else:
+        dc = DataClient(systems=systems)
+        listener = DataNotificationListener(research.db_url) if DATA_NOTIFICATIONS else None
+
+    scheduler = Scheduler(
+        systems=systems,
+        specs=strategies,
+        data_client=dc,
+        strategy_client=sc,
+        listener=listener,
     )
-
-    while True:
-        try:
-            big_bend_signal_generator_btc.generate_signal()
-            time.sleep(10)
-        except KeyboardInterrupt:
-            print("Exiting loop due to user interruption.")
-            break
-        except Exception as e:
-            logger.error(traceback.format_exc())
-            sc.send_message(
-                "General Error", 
-                f"Error in main loop: {e}", 
-                SLACK_CHANNEL,
-            )
+    scheduler.run_forever()
 
 if __name__ == "__main__":
 
     main()
-
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import threading
+import traceback
+import typing
+
+import pandas as pd
+from pandas import DataFrame
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config import DB_MAX_OVERFLOW, DB_POOL_SIZE, DB_POOL_TIMEOUT
+from strategy_clients.bar_store import last_value
+from strategy_clients.data_client import (
+    CANDLE_COLUMNS,
+    CANDLE_DTYPES,
+    SOURCE,
+    SOURCE_COLUMNS,
+    SOURCE_DTYPES,
+    DataClient,
+    bars_db_query,
+    read_bars_db,
+    read_typed,
+    source_table,
+)
+from strategy_clients.metrics import timed
+from strategy_clients.models import System
+from strategy_clients.signal_dispatcher import get_dispatcher
+from strategy_clients.slack_notifier import get_notifier
+from strategy_clients.strategy_client import signal_payload
+
+logger = logging.getLogger(__name__)
+
+
+def async_db_url(db_url: str) -> str:
+    """postgresql://... -> postgresql+asyncpg://..."""
+    scheme, _, rest = db_url.partition("://")
+    return f"{scheme.split('+')[0]}+asyncpg://{rest}"
+
+
+_async_engines = {}
+_async_engines_lock = threading.Lock()
+
+
+def get_async_engine(db_url: str):
+    """
+    Same as db_pool.get_engine, one async engine per db_url for the process
+    """
+    with _async_engines_lock:
+        engine = _async_engines.get(db_url)
+        if engine is None:
+            engine = create_async_engine(
+                async_db_url(db_url),
+                pool_pre_ping=True,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+            )
+            _async_engines[db_url] = engine
+        return engine
+
+
+def async_engine_count() -> int:
+    return len(_async_engines)
+
+
+class AsyncDataClient(DataClient):
+    """
+    DataClient with async versions of the per tick fetches, over asyncpg.
+
+    History is still loaded with the sync methods when a generator is built, only
+    the update path is async. The bar formatting and staleness logic is shared
+    with DataClient.
+    """
+
+    def _init_db_connections(self):
+        super()._init_db_connections()
+        self.async_engines = {}
+        for x in self.systems:
+            self.async_engines[x.name] = get_async_engine(x.db_url)
+
+    async def aread(
+        self, query: str, params: dict = None, dtypes: dict = None, session_name: str = "research"
+    ) -> DataFrame:
+        async with self.async_engines[session_name].connect() as connection:
+            return await connection.run_sync(read_typed, query, params, dtypes)
+
+    @timed("fetch_candles_since")
+    async def afetch_candles_since(self, symbol: str, kind: str, after) -> DataFrame:
+        cached = self.candle_cache.get((symbol, kind))
+        if cached is not None:
+            return cached[cached["close_datetime"] > after].copy()
+
+        query = f"SELECT symbol, {CANDLE_COLUMNS} FROM candle WHERE symbol = :symbol AND kind = :kind AND candle.close_datetime > :after ORDER BY candle.close_datetime ASC"
+        params = {"symbol": symbol, "kind": kind, "after": pd.Timestamp(after).to_pydatetime()}
+        return await self.aread(query, params, CANDLE_DTYPES)
+
+    @timed("fetch_new_bars_db")
+    async def afetch_new_bars_db(self, symbol: str, db_value: int, last_open_time) -> DataFrame:
+        cached = self.bars_db_cache.get((symbol, db_value))
+        if cached is not None:
+            return cached[cached["open_time"] > last_open_time].copy()
+
+        query = bars_db_query([symbol], db_value, last_open_time)
+        async with self.async_engines["research"].connect() as connection:
+            df, sources = await connection.run_sync(read_bars_db, query)
+        self.observe_sources(sources)
+        return df.drop(columns="symbol")
+
+    @timed("fetch_source_rows")
+    async def afetch_source_rows(self, symbol: str, after) -> DataFrame:
+        query = f"SELECT {SOURCE_COLUMNS} FROM {source_table(symbol)} WHERE close_time > :after ORDER BY close_time ASC"
+        df = await self.aread(query, {"after": after}, SOURCE_DTYPES)
+        if not df.empty:
+            self.freshness.observe(symbol, SOURCE, df["close_time"].iloc[-1])
+        return df
+
+    async def aupdate_bars_db(
+        self, df: DataFrame, symbol: str, db_value: int, number_of_bars: int
+    ) -> typing.Tuple[DataFrame, bool, bool]:
+        try:
+            last_open_time = last_value(df, "open_time")
+            query_df = await self.afetch_new_bars_db(symbol, db_value, last_open_time)
+            stale_data = self.check_data_staleness_db(symbol=symbol)
+
+            df, updated_data = self.apply_bars_db(df, query_df, number_of_bars)
+            return df, stale_data, updated_data
+
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            return df, True, False
+
+    async def aclose(self):
+        for engine in self.async_engines.values():
+            await engine.dispose()
+
+
+class AsyncStrategyClient:
+    """
+    Async counterpart of StrategyClient's send_signal/send_message, so a slow
+    trading endpoint only holds up the generator that is waiting on it. Signals go
+    through the process' SignalDispatcher on a thread, same pooled session, retry
+    rules and endpoint latency as the sync path. Slack messages go through the
+    SlackNotifier thread and never block the loop
+    """
+
+    def __init__(self, systems: typing.List[System]):
+        self.systems = systems
+        self.notifier = get_notifier()
+        self.dispatcher = get_dispatcher()
+
+    @timed()
+    async def send_signal(
+        self,
+        system: System,
+        strategy_name: str,
+        trade_type: str,
+        perc_equity: float = None,
+    ):
+        """
+        trade_type will be Entry Long, Entry Short, Exit Position
+        """
+        try:
+            signal_dict = signal_payload(strategy_name, trade_type, perc_equity)
+            return await asyncio.to_thread(self.dispatcher.send, system, signal_dict)
+        except:
+            logger.error(traceback.format_exc())
+
+    @timed()
+    async def send_signals(
+        self,
+        systems: typing.List[System],
+        strategy_name: str,
+        trade_type: str,
+        perc_equity: float = None,
+    ):
+        """
+        send_signal to every system in parallel, on the dispatcher's threads
+        """
+        try:
+            payloads = [
+                signal_payload(strategy_name, trade_type, perc_equity) for _ in systems
+            ]
+            return await asyncio.to_thread(self.dispatcher.send_all, systems, payloads)
+        except:
+            logger.error(traceback.format_exc())
+
+    @timed()
+    async def send_message(
+        self,
+        strategy: str,
+        msg: str,
+        channel: str,
+    ):
+        """
+        Queued on the SlackNotifier's thread, same as StrategyClient.send_message
+        """
+        msg = strategy + ": " + msg
+        try:
+            self.notifier.post(channel, msg)
+        except Exception as e:
+            logger.error(traceback.format_exc())
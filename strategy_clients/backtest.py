@@ -0,0 +1,279 @@
+"""
+Vectorized replay of the Big Bend rules over a span of history.
+
+    python -m strategy_clients.backtest BTCUSDT 2022-01-01 2024-01-01
+
+Bars, indicators and rules are computed for the whole span at once, the result is
+the sequence of events SignalGeneratorBigBend.evaluate would have produced, one
+row per event, in the same order.
+"""
+import argparse
+import datetime
+import logging
+import typing
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from config import RESEARCH_PG_URI
+from strategy_clients.data_client import (
+    CANDLE_COLUMNS,
+    CANDLE_DTYPES,
+    DOLLAR_BAR_COLUMNS,
+    DOLLAR_BAR_DTYPES,
+    INFER,
+)
+from strategy_clients.models import BigBendParams, System
+
+logger = logging.getLogger(__name__)
+
+
+def as_utc(values, unit: str = "s") -> pd.DatetimeIndex:
+    """Timestamps or epoch numbers (gt_dollarbar times are epoch seconds when numeric) as UTC"""
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.DatetimeIndex(pd.to_datetime(values, unit=unit, utc=True))
+    return pd.DatetimeIndex(pd.to_datetime(values, utc=True))
+
+
+def utc_timestamp(value) -> pd.Timestamp:
+    value = pd.Timestamp(value)
+    return value.tz_localize("UTC") if value.tzinfo is None else value.tz_convert("UTC")
+
+
+def load_candles(data_client, symbol: str, start, end, kind: str = "30m") -> DataFrame:
+    """
+    Candles of kind closed between start and end, oldest first
+    """
+    start = utc_timestamp(start).to_pydatetime()
+    end = utc_timestamp(end).to_pydatetime()
+    query = f"SELECT {CANDLE_COLUMNS} FROM candle WHERE symbol = :symbol AND kind = :kind AND candle.close_datetime > :start AND candle.close_datetime <= :end ORDER BY candle.close_datetime ASC"
+    return data_client.read(
+        query, {"symbol": symbol, "kind": kind, "start": start, "end": end}, CANDLE_DTYPES
+    )
+
+
+def load_dollar_bars(data_client, symbol: str, start, end, db_value: int = 90_000_000) -> DataFrame:
+    """
+    Dollar bars of threshold db_value closed between start and end, oldest first
+    """
+    start = utc_timestamp(start).to_pydatetime()
+    end = utc_timestamp(end).to_pydatetime()
+
+    # gt_dollarbar times are timestamps or epoch seconds, one row tells which to compare against
+    query = f"SELECT close_time FROM gt_dollarbar WHERE symbol = :symbol AND threshold = '{db_value}' LIMIT 1"
+    probe = data_client.read(query, {"symbol": symbol}, {"close_time": INFER})
+    if probe.empty:
+        return DataFrame(columns=["open_time", "close_time", "duration"])
+    if pd.api.types.is_numeric_dtype(probe["close_time"]):
+        start, end = start.timestamp(), end.timestamp()
+    query = f"SELECT {DOLLAR_BAR_COLUMNS} FROM gt_dollarbar WHERE symbol = :symbol AND threshold = '{db_value}' AND close_time > :start AND close_time <= :end ORDER BY open_time ASC"
+    return data_client.read(
+        query, {"symbol": symbol, "start": start, "end": end}, DOLLAR_BAR_DTYPES
+    )
+
+
+def load_history(
+    data_client, symbol: str, start, end, db_value: int = 90_000_000, kind: str = "30m"
+) -> typing.Tuple[DataFrame, DataFrame]:
+    """
+    30m candles and dollar bars closed between start and end, oldest first.
+    Fetch some history before the span you care about, the indicators need
+    200 dollar bars and 50 4h bars before the first event
+    """
+    return (
+        load_candles(data_client, symbol, start, end, kind),
+        load_dollar_bars(data_client, symbol, start, end, db_value),
+    )
+
+
+def complete_bars(candles: DataFrame, minutes: int, base_minutes: int = 30) -> DataFrame:
+    """
+    The bars MultiTimeframeBarBuilder would build: every `minutes` bucket whose
+    first and last base candle are both there, indexed by "Open Time"
+    """
+    close_datetime = pd.DatetimeIndex(pd.to_datetime(candles["close_datetime"], utc=True))
+    open_time = close_datetime - datetime.timedelta(minutes=base_minutes)
+    df = DataFrame(
+        {
+            "open_time": open_time,
+            "open": candles["open"].to_numpy(),
+            "high": candles["high"].to_numpy(),
+            "low": candles["low"].to_numpy(),
+            "close": candles["close"].to_numpy(),
+        }
+    ).sort_values("open_time")
+
+    bucket = df["open_time"].dt.floor(f"{minutes}min")
+    bars = df.groupby(bucket).agg(
+        open=("open", "first"),
+        high=("high", "max"),
+        low=("low", "min"),
+        close=("close", "last"),
+        first_open=("open_time", "min"),
+        last_open=("open_time", "max"),
+    )
+    last_slot = datetime.timedelta(minutes=minutes - base_minutes)
+    complete = (bars["first_open"] == bars.index) & (bars["last_open"] == bars.index + last_slot)
+    bars = bars.loc[complete, ["open", "high", "low", "close"]]
+    bars.index.rename("Open Time", inplace=True)
+    return bars
+
+
+def latest(values: np.ndarray, i: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    (values[i], values[i - 1]) for every i, NaN where there is no such bar. Same as
+    an indicator's value/previous after bar i was added
+    """
+    padded = np.concatenate([[np.nan, np.nan], np.asarray(values, dtype=np.float64)])
+    return padded[i + 2], padded[i + 1]
+
+
+def backtest(
+    candles: DataFrame,
+    dollar_bars: DataFrame,
+    params: BigBendParams = None,
+    start=None,
+    base_minutes: int = 30,
+) -> DataFrame:
+    """
+    Big Bend over candles (close_datetime, open, high, low, close) and dollar bars
+    (open_time, close_time, duration) of params.db_threshold. See backtest_bars
+    """
+    bars_4h = complete_bars(candles, 4 * 60, base_minutes)
+    bars_2h = complete_bars(candles, 2 * 60, base_minutes)
+    return backtest_bars(bars_4h, bars_2h, dollar_bars, params, start)
+
+
+def backtest_bars(
+    bars_4h: DataFrame,
+    bars_2h: DataFrame,
+    dollar_bars: DataFrame,
+    params: BigBendParams = None,
+    start=None,
+) -> DataFrame:
+    """
+    backtest() from bars already built with complete_bars, so a sweep only
+    builds them once.
+
+    The live generator evaluates whenever a new 4h bar or dollar bar shows up, so
+    that is what is replayed: one evaluation per distinct close time of either,
+    with every bar closed by then. Bars that close within the same scheduler tick
+    live are evaluated once there and once per close time here.
+
+    Evaluation starts after `start`, by default the first moment there is as much
+    history as initialize_data loads (params.bars_4h, bars_2h and bars_db).
+    The EMA is seeded at the first dollar bar passed in rather than 201 bars back,
+    see ExponentialMovingAverage for how little that moves it.
+
+    Returns columns time, event, detail. event is one of "Entering Low Vol Period",
+    "Entering High Vol Period", "Exit Position", "Entry Long", "Entry Short" (or
+    None when the SMAs are equal, as the live path would send). Every signal event
+    is sent to each trading system, the messages are sent once.
+    """
+    params = params or BigBendParams()
+    dollar_bars = dollar_bars.sort_values("open_time")
+
+    # A bar can be used from its close time
+    close_4h = (bars_4h.index + datetime.timedelta(hours=4)).asi8
+    close_2h = (bars_2h.index + datetime.timedelta(hours=2)).asi8
+    close_db = as_utc(dollar_bars["close_time"]).asi8
+
+    close = bars_4h["close"]
+    sma_fast_4h = close.rolling(params.fast_sma_window).mean().to_numpy()
+    sma_slow_4h = close.rolling(params.slow_sma_window).mean().to_numpy()
+    ranges = (bars_2h["high"] - bars_2h["low"]) / bars_2h["open"]
+    atr_avg_2h = ranges.rolling(params.atr_window).mean().to_numpy()
+    duration = dollar_bars["duration"].astype(np.float64)
+    db_ema = duration.ewm(span=params.db_ema_window, adjust=False).mean().to_numpy()
+    db_sma = duration.rolling(params.db_sma_window).mean().to_numpy()
+
+    times = np.unique(np.concatenate([close_4h, close_db]))
+    i4 = np.searchsorted(close_4h, times, side="right") - 1
+    i2 = np.searchsorted(close_2h, times, side="right") - 1
+    idb = np.searchsorted(close_db, times, side="right") - 1
+
+    if start is None:
+        ready = np.flatnonzero(
+            (i4 >= params.bars_4h - 1) & (i2 >= params.bars_2h - 1) & (idb >= params.bars_db - 1)
+        )
+        if len(ready) == 0:
+            logger.error("Not enough history to run the backtest")
+            return DataFrame(columns=["time", "event", "detail"])
+        start = times[ready[0]]
+    else:
+        start = utc_timestamp(start).value
+    evaluate = times > start
+    times, i4, i2, idb = times[evaluate], i4[evaluate], i2[evaluate], idb[evaluate]
+
+    ema, prev_ema = latest(db_ema, idb)
+    sma, prev_sma = latest(db_sma, idb)
+    fast, prev_fast = latest(sma_fast_4h, i4)
+    slow, prev_slow = latest(sma_slow_4h, i4)
+    atr, _ = latest(atr_avg_2h, i2)
+
+    low_vol = ema > sma
+    entering_low = low_vol & (prev_ema <= prev_sma)
+    entering_high = (ema <= sma) & (prev_ema > prev_sma)
+
+    long = fast > slow
+    short = fast < slow
+    cross_long = long & (prev_fast <= prev_slow)
+    cross_short = short & (prev_fast >= prev_slow)
+    crossover = cross_long | cross_short
+    direction = np.where(short, "Entry Short", np.where(long, "Entry Long", None))
+    crossover_detail = np.where(
+        cross_short, "Exit Long and Enter Short", "Exit Short and Enter Long"
+    )
+
+    exit_crossover = low_vol & crossover
+    entry = low_vol & ~crossover & (atr < params.atr_gate)
+
+    # (mask, order within an evaluation, event, detail), same order as evaluate()
+    parts = [
+        (entering_low, 0, "Entering Low Vol Period", None),
+        (entering_high, 0, "Exit Position", "Entering High Vol Period"),
+        (entering_high, 1, "Entering High Vol Period", None),
+        (exit_crossover, 2, "Exit Position", crossover_detail),
+        (entry, 2, direction, np.round(atr, 4)),
+    ]
+    frames = []
+    for mask, order, event, detail in parts:
+        idx = np.flatnonzero(mask)
+        frames.append(
+            DataFrame(
+                {
+                    "step": idx,
+                    "order": order,
+                    "time": times[idx],
+                    "event": event[idx] if isinstance(event, np.ndarray) else event,
+                    "detail": detail[idx] if isinstance(detail, np.ndarray) else detail,
+                }
+            )
+        )
+    events = pd.concat(frames).sort_values(["step", "order"], kind="stable")
+    events["time"] = pd.to_datetime(events["time"], utc=True)
+    return events[["time", "event", "detail"]].reset_index(drop=True)
+
+
+def main():
+    from strategy_clients.data_client import DataClient
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("symbol")
+    parser.add_argument("start")
+    parser.add_argument("end")
+    args = parser.parse_args()
+
+    # Not from main.py, importing it sets up the app's logging and log file
+    research = System(name="research", db_url=RESEARCH_PG_URI)
+    data_client = DataClient(systems=[research])
+    candles, dollar_bars = load_history(data_client, args.symbol, args.start, args.end)
+    events = backtest(candles, dollar_bars)
+    print(events.to_string())
+    print(events["event"].value_counts(dropna=False).to_string())
+
+
+if __name__ == "__main__":
+    main()
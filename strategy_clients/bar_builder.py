@@ -0,0 +1,226 @@
+import datetime
+import logging
+import typing
+
+import pandas as pd
+from pandas import DataFrame
+
+from strategy_clients.bar_store import BarStore
+from strategy_clients.metrics import timed
+
+OHLC_COLUMNS = ["open", "high", "low", "close"]
+
+logger = logging.getLogger(__name__)
+
+
+class MultiTimeframeBarBuilder:
+    """
+    Keeps several higher timeframe bars (2h, 4h, 1d, ...) for one symbol up to date
+    from a single stream of base candles (30m by default).
+
+    Each tick pulls only the base candles newer than the last one seen (a high-water
+    mark on close_datetime), and a higher timeframe bar is only built when the base
+    candle that closes its bucket arrives, so there is no resample per timeframe per
+    tick and an empty tick is a single index probe. Buckets and the completeness rules are the same as
+    DataClient.format_hour_bars: a bar needs its first and last base candle.
+
+    timeframes maps bar length in minutes to the number of bars to keep, e.g.
+    {240: 51, 120: 7}. Bars live in fixed capacity BarStores (frames), as do the
+    base candles, so memory per symbol doesn't grow and nothing is copied per tick.
+    """
+
+    def __init__(
+        self, symbol: str, timeframes: typing.Dict[int, int], base_minutes: int = 30
+    ):
+        for minutes in timeframes:
+            if minutes % base_minutes != 0 or 1440 % minutes != 0:
+                # resample buckets only line up with epoch buckets when they divide a day
+                raise ValueError(
+                    f"{minutes}min bars can't be built from {base_minutes}min candles"
+                )
+
+        self.symbol = symbol
+        self.timeframes = dict(timeframes)
+        self.base_minutes = base_minutes
+        self.kind = f"{base_minutes}m"
+        self.frames: typing.Dict[int, BarStore] = {}
+        self.base: BarStore = None
+
+    @property
+    def update_limit(self) -> int:
+        """Base candles kept between ticks, enough to rebuild the longest bar"""
+        return max(self.timeframes) // self.base_minutes
+
+    def history_limit(self, minutes: int) -> int:
+        # Same as DataClient.get_historical_data, one spare bar for the partial first bucket
+        return (minutes // self.base_minutes) * (self.timeframes[minutes] + 1)
+
+    def initialize(self, data_client) -> bool:
+        """
+        One history query for every timeframe (one per timeframe with server side
+        bars), returns False if any of them doesn't have enough complete bars or the
+        data is stale
+        """
+        # With server side bars only the base candles kept between ticks are fetched raw
+        server_side = getattr(data_client, "server_side_bars", False)
+        if server_side:
+            limit = self.update_limit
+        else:
+            limit = max(self.history_limit(m) for m in self.timeframes)
+        rows = data_client.fetch_latest_candles(self.symbol, self.kind, limit)
+
+        if data_client.check_data_staleness(rows.copy(), self.base_minutes):
+            logger.error("Data is stale")
+            return False
+
+        for minutes, number_of_bars in self.timeframes.items():
+            if server_side:
+                formatted_df, _ = data_client.fetch_bars(
+                    self.symbol, self.kind, minutes, self.history_limit(minutes)
+                )
+            else:
+                formatted_df = data_client.format_hour_bars(
+                    rows.head(self.history_limit(minutes)).copy(),
+                    input_data_duration=self.base_minutes,
+                    requested_data_duration=minutes,
+                )
+            if len(formatted_df) < number_of_bars:
+                logger.error(
+                    f"Failed to fetch enough Historical Data for {minutes}min bars"
+                )
+                return False
+            self.frames[minutes] = BarStore.from_frame(
+                formatted_df[OHLC_COLUMNS], number_of_bars, index="Open Time"
+            )
+
+        self.base = BarStore.from_frame(
+            self.to_base(rows.head(self.update_limit)), self.update_limit, index="Open Time"
+        )
+        logger.info("Successfully Fetched Historical Data")
+        return True
+
+    def restore(self, cache) -> bool:
+        """
+        Load the base candles and bars saved by save(). Returns False if anything is
+        missing, was saved with different limits, or is older than the history
+        initialize() would fetch anyway. update() then fetches the gap
+        """
+        base = cache.load((self.symbol, self.kind))
+        frames = {
+            minutes: cache.load((self.symbol, self.kind, minutes))
+            for minutes in self.timeframes
+        }
+        if base is None or len(base) == 0 or base.capacity != self.update_limit:
+            return False
+        for minutes, frame in frames.items():
+            if frame is None or frame.capacity != self.timeframes[minutes]:
+                return False
+
+        history_minutes = max(
+            self.history_limit(m) * self.base_minutes for m in self.timeframes
+        )
+        hwm = base.last("Open Time") + datetime.timedelta(minutes=self.base_minutes)
+        if pd.Timestamp.now(tz="UTC") - hwm > datetime.timedelta(minutes=history_minutes):
+            logger.info(f"Cached {self.kind} candles for {self.symbol} are too old, not used")
+            return False
+
+        self.base = base
+        self.frames = frames
+        return True
+
+    def save(self, cache):
+        cache.save((self.symbol, self.kind), self.base)
+        for minutes, frame in self.frames.items():
+            cache.save((self.symbol, self.kind, minutes), frame)
+
+    def to_base(self, rows: DataFrame) -> DataFrame:
+        df = rows[["close_datetime", "open", "high", "low", "close"]].copy()
+        df["close_datetime"] = pd.to_datetime(df["close_datetime"])
+        df = df.sort_values(by="close_datetime")
+        df["Open Time"] = df["close_datetime"] - datetime.timedelta(
+            minutes=self.base_minutes
+        )
+        return df.set_index("Open Time")[OHLC_COLUMNS]
+
+    def update(self, data_client) -> typing.Tuple[bool, typing.Dict[int, bool]]:
+        """
+        Pull the base candles that closed since the last one we have and roll every
+        timeframe forward. Returns (stale, {minutes: updated})
+        """
+        rows = data_client.fetch_candles_since(
+            self.symbol, self.kind, self.high_water_mark
+        )
+        return self.ingest(rows, data_client)
+
+    @property
+    def high_water_mark(self) -> pd.Timestamp:
+        """Close time of the newest base candle seen"""
+        return self.base.last("Open Time") + datetime.timedelta(minutes=self.base_minutes)
+
+    @timed("build_bars")
+    def ingest(
+        self, rows: DataFrame, data_client
+    ) -> typing.Tuple[bool, typing.Dict[int, bool]]:
+        """
+        update() without the fetch, for callers that already have the new base candles
+        """
+        updated = {minutes: False for minutes in self.timeframes}
+
+        new_base = self.to_base(rows)
+        new_base = new_base[new_base.index > self.base.last("Open Time")]
+
+        newest = new_base.index[-1] if not new_base.empty else self.base.last("Open Time")
+        stale = data_client.is_candle_stale(
+            self.symbol, newest + datetime.timedelta(minutes=self.base_minutes), self.base_minutes
+        )
+        if stale:
+            # Same as update_hour_bars: no bars from stale candles, they are fetched again next tick
+            return stale, updated
+
+        # One candle at a time, base holds a whole bucket of the longest timeframe so
+        # every bucket can be built the moment its last candle arrives, even after a gap
+        for open_time, row in zip(new_base.index, new_base.itertuples(index=False)):
+            self.base.append(
+                **{"Open Time": open_time},
+                **{name: getattr(row, name) for name in OHLC_COLUMNS},
+            )
+            for minutes in self.timeframes:
+                if self.close_bucket(open_time, minutes):
+                    updated[minutes] = True
+
+        return stale, updated
+
+    def close_bucket(self, open_time: pd.Timestamp, minutes: int) -> bool:
+        """
+        If the base candle at open_time is the last one of its `minutes` bucket,
+        build that bar and append it
+        """
+        bucket_start = open_time.floor(f"{minutes}min")
+        step = datetime.timedelta(minutes=self.base_minutes)
+        if open_time + step != bucket_start + datetime.timedelta(minutes=minutes):
+            return False
+
+        frame = self.frames[minutes]
+        last = frame.last("Open Time")
+        if last is not None and bucket_start <= last:
+            return False
+
+        # base candles from bucket_start up to open_time, the first one has to be there
+        first = self.base.search(bucket_start, side="left")
+        if self.base.search(bucket_start) == first:
+            logger.warning(
+                f"Incomplete {minutes}min bar at {bucket_start} for {self.symbol}, skipping"
+            )
+            return False
+
+        frame.append(
+            **{
+                "Open Time": bucket_start,
+                "open": self.base.view("open", start=first)[0],
+                "high": self.base.view("high", start=first).max(),
+                "low": self.base.view("low", start=first).min(),
+                "close": self.base.view("close", start=first)[-1],
+            }
+        )
+        logger.info(f"Added {minutes}min datapoint")
+        return True
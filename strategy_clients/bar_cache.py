@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+import typing
+
+import numpy as np
+
+from config import BAR_CACHE_DIR
+from strategy_clients.bar_store import BarStore
+
+logger = logging.getLogger(__name__)
+
+
+def cache_namespace(strategy_name: str, params) -> str:
+    """
+    Namespace for one generator's files: its name plus a digest of its params, so
+    generators on the same symbol with different windows don't share files
+    """
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:10]
+    return f"{strategy_name}_{digest}"
+
+
+class CacheWriter:
+    """
+    Writes BarCache files from a background thread, so a tick never waits on the
+    disk. Only the latest copy queued for a file is written
+    """
+
+    def __init__(self):
+        self.pending: typing.Dict[str, typing.Tuple[dict, typing.Dict[str, np.ndarray]]] = {}
+        self.writing = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def submit(self, path: str, meta: dict, arrays: typing.Dict[str, np.ndarray]):
+        with self.lock:
+            self.pending[path] = (meta, arrays)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="bar-cache-writer", daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def flush(self, timeout: float = 10):
+        """
+        Wait for everything queued so far to be written, e.g. before exiting
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if not self.pending and not self.writing:
+                    return
+            time.sleep(0.01)
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            with self.lock:
+                self.wake.clear()
+                pending, self.pending = self.pending, {}
+                self.writing = len(pending)
+            for path, (meta, arrays) in pending.items():
+                try:
+                    write_npz(path, meta, arrays)
+                except Exception as e:
+                    logger.error(traceback.format_exc())
+                finally:
+                    with self.lock:
+                        self.writing -= 1
+
+
+def write_npz(path: str, meta: dict, arrays: typing.Dict[str, np.ndarray]):
+    """
+    Write through a temp file of our own in the same directory and rename it over
+    path, so neither a crash nor another thread or process saving the same file
+    leaves a partial one
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_cache_writer() -> CacheWriter:
+    """
+    One writer thread per process, shared by every generator's BarCache
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = CacheWriter()
+        return _writer
+
+
+class BarCache:
+    """
+    The last N bars per (symbol, kind/threshold) on local disk, one .npz file per
+    BarStore, so a restart only has to fetch what closed while it was down.
+
+    Files are prefixed with namespace (see cache_namespace). save() copies the bars
+    and leaves the writing to the CacheWriter thread. Anything that can't be read
+    is treated as missing.
+    """
+
+    def __init__(self, directory: str = BAR_CACHE_DIR, namespace: str = None):
+        self.directory = directory
+        self.namespace = namespace
+        self.writer = get_cache_writer()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: typing.Tuple) -> str:
+        parts = ([self.namespace] if self.namespace else []) + [str(k) for k in key]
+        name = re.sub(r"[^A-Za-z0-9_.-]", "-", "_".join(parts))
+        return os.path.join(self.directory, name + ".npz")
+
+    def save(self, key: typing.Tuple, store: BarStore):
+        meta = {
+            "capacity": store.capacity,
+            "index": store.index,
+            "columns": list(store.arrays),
+            "tz": {name: str(tz) for name, tz in store.tz.items()},
+        }
+        arrays = {f"column_{i}": store.view(name).copy() for i, name in enumerate(store.arrays)}
+        self.writer.submit(self.path(key), meta, arrays)
+
+    def flush(self, timeout: float = 10):
+        self.writer.flush(timeout)
+
+    def load(self, key: typing.Tuple) -> typing.Optional[BarStore]:
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                columns = {
+                    name: data[f"column_{i}"] for i, name in enumerate(meta["columns"])
+                }
+            store = BarStore(
+                meta["capacity"],
+                {name: values.dtype for name, values in columns.items()},
+                index=meta["index"],
+                tz=meta["tz"],
+            )
+            store.write(columns)
+            logger.info(f"Loaded {len(store)} cached bars for {key}")
+            return store
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            return None
@@ -0,0 +1,185 @@
+import typing
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+class BarStore:
+    """
+    Fixed capacity rolling store of bars, one NumPy array per column.
+
+    Every value is written twice, at i and i + capacity, so the last `len` bars are
+    always one contiguous slice of each array. append is O(1), the oldest bar drops
+    off once the store is full, and view() hands out read-only slices without
+    copying. Memory is 2 * capacity * itemsize per column whatever happens.
+
+    The index column (bar open time) must be increasing. Timezone aware datetime
+    columns are stored as UTC datetime64[ns] and get their timezone back in to_frame.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        columns: typing.Dict[str, typing.Any],
+        index: str = None,
+        tz: typing.Dict[str, typing.Any] = None,
+    ):
+        self.capacity = capacity
+        self.index = index
+        self.tz = dict(tz or {})
+        self.arrays = {
+            name: np.zeros(2 * capacity, dtype=dtype) for name, dtype in columns.items()
+        }
+        self.next = 0
+        self.count = 0
+
+    @classmethod
+    def from_frame(cls, df: DataFrame, capacity: int, index: str = None) -> "BarStore":
+        """
+        Store with the same columns (and dtypes) as df, filled with its last `capacity` rows.
+        If index is given and isn't a column, df's index is stored under that name
+        """
+        df = cls.flatten(df, index)
+        columns = {}
+        tz = {}
+        for name in df.columns:
+            dtype = df[name].dtype
+            if isinstance(dtype, pd.DatetimeTZDtype):
+                tz[name] = dtype.tz
+                dtype = np.dtype("datetime64[ns]")
+            columns[name] = dtype
+        store = cls(capacity, columns, index=index, tz=tz)
+        store.extend(df)
+        return store
+
+    @staticmethod
+    def flatten(df: DataFrame, index: str = None) -> DataFrame:
+        if index is not None and index not in df.columns:
+            df = df.rename_axis(index).reset_index()
+        return df
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def start(self) -> int:
+        return (self.next - self.count) % self.capacity
+
+    def append(self, **values):
+        """One bar, values keyed by column"""
+        for name in self.tz:
+            value = pd.Timestamp(values[name]).tz_convert("UTC").tz_localize(None)
+            values[name] = value.to_datetime64()
+        i = self.next
+        for name, array in self.arrays.items():
+            array[i] = values[name]
+            array[i + self.capacity] = values[name]
+        self.next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, df: DataFrame):
+        """
+        Append every row of df in order. Only the last `capacity` rows can survive
+        so anything before them isn't written
+        """
+        df = self.flatten(df, self.index)
+        if df.empty:
+            return
+        columns = {}
+        for name in self.arrays:
+            values = df[name]
+            if name in self.tz:
+                values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+            columns[name] = values.to_numpy()
+        self.write(columns)
+
+    def write(self, columns: typing.Dict[str, np.ndarray]):
+        """
+        extend() for equal length arrays already in storage form (timezone aware
+        columns as UTC datetime64), e.g. views of another BarStore
+        """
+        k = len(next(iter(columns.values())))
+        if k == 0:
+            return
+        skip = max(0, k - self.capacity)
+        k -= skip
+        positions = (self.next + np.arange(k)) % self.capacity
+        for name, array in self.arrays.items():
+            values = np.asarray(columns[name][skip:], dtype=array.dtype)
+            array[positions] = values
+            array[positions + self.capacity] = values
+        self.next = (self.next + k) % self.capacity
+        self.count = min(self.count + k, self.capacity)
+
+    def view(self, column: str, start: int = 0) -> np.ndarray:
+        """
+        Read-only, zero copy, oldest first. start skips that many of the oldest bars
+        """
+        first = self.start
+        view = self.arrays[column][first + start : first + self.count]
+        view.flags.writeable = False
+        return view
+
+    def last(self, column: str, n: int = 1):
+        if self.count < n:
+            return None
+        value = self.arrays[column][self.start + self.count - n]
+        if column in self.tz:
+            return pd.Timestamp(value).tz_localize("UTC").tz_convert(self.tz[column])
+        return value
+
+    def search(self, value, side: str = "right") -> int:
+        """
+        np.searchsorted on the index column. With side="right" it is the number of
+        bars at or before value, so view(column, start=...) returns the bars after it.
+        value None means the start
+        """
+        if value is None or self.count == 0:
+            return 0
+        index = self.view(self.index)
+        if index.dtype.kind == "M":
+            value = pd.Timestamp(value)
+            if value.tzinfo is not None:
+                value = value.tz_convert("UTC").tz_localize(None)
+            value = value.to_datetime64()
+        return int(np.searchsorted(index, value, side=side))
+
+    def to_frame(self, start: int = 0) -> DataFrame:
+        """
+        A DataFrame copy of the stored bars, indexed by the index column if there is
+        one. start skips that many of the oldest bars, like view
+        """
+        data = {}
+        for name in self.arrays:
+            values = self.view(name, start).copy()
+            if name in self.tz:
+                values = pd.to_datetime(values).tz_localize("UTC").tz_convert(self.tz[name])
+            data[name] = values
+        df = DataFrame(data)
+        if self.index is not None:
+            df = df.set_index(self.index)
+        return df
+
+
+def append_bars(bars, new_bars: DataFrame, number_of_bars: int):
+    """
+    Append new_bars and keep the last number_of_bars. A BarStore is extended in
+    place (its capacity is the limit), a DataFrame is concatenated and trimmed
+    """
+    if isinstance(bars, BarStore):
+        bars.extend(new_bars)
+        return bars
+    bars = pd.concat([bars, new_bars])
+    return bars.iloc[-number_of_bars:]
+
+
+def last_value(bars, column: str = None):
+    """
+    Newest value of column (the index if None) of a BarStore or DataFrame, None if empty
+    """
+    if isinstance(bars, BarStore):
+        return bars.last(column or bars.index)
+    if bars.empty:
+        return None
+    return bars.index[-1] if column is None else bars[column].iloc[-1]
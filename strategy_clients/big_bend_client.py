@@ -1,202 +1,512 @@
 import logging
+import traceback
+import dataclasses
+import typing
 
 import pandas as pd
 from pandas import DataFrame
-from config import SLACK_CHANNEL
+from config import BAR_CACHE_DIR, SLACK_CHANNEL
+from strategy_clients.bar_builder import MultiTimeframeBarBuilder
+from strategy_clients.bar_cache import BarCache, cache_namespace
+from strategy_clients.bar_store import BarStore
 from strategy_clients.data_client import DataClient
+from strategy_clients.dollar_bar_builder import DollarBarBuilder
+from strategy_clients.metrics import count_tick, timed
+from strategy_clients.models import BigBendParams, Notification, TradeSignal
+from strategy_clients.notify_listener import CANDLE_CHANNEL, DOLLAR_BAR_CHANNEL
+from strategy_clients.indicators import (
+    AverageTrueRange,
+    ExponentialMovingAverage,
+    SimpleMovingAverage,
+)
 from strategy_clients.strategy_client import StrategyClient
 
 logger = logging.getLogger(__name__)
 
 
+def group_signals(actions: typing.List[typing.Union[TradeSignal, Notification]]):
+    """
+    Merge runs of consecutive signals with the same trade type into one
+    (trade_type, systems) fan-out, keeping the order against the messages
+    """
+    batches = []
+    for action in actions:
+        if (
+            isinstance(action, TradeSignal)
+            and batches
+            and isinstance(batches[-1], tuple)
+            and batches[-1][0] == action.trade_type
+        ):
+            batches[-1][1].append(action.system)
+        elif isinstance(action, TradeSignal):
+            batches.append((action.trade_type, [action.system]))
+        else:
+            batches.append(action)
+    return batches
+
+
 class SignalGeneratorBigBend(StrategyClient):
     """
     This class should generate the signals for the low vol martingale strategy (big bend)
 
-    What we need:
+    What we need (with the default BigBendParams):
 
     50 4 hour candles
     200 90 mill dollar bars
     6 2 hour candles
+
+    params can be given as a BigBendParams or as keyword overrides of the
+    defaults, e.g. StrategySpec(..., params={"atr_gate": 0.006})
+
+    The history is loaded when the generator is built unless initialize=False,
+    if it can't be loaded a RuntimeError is raised
     """
 
     def __init__(
-        self, systems: dict, strategy_name: str, data_client: DataClient, symbol: str
+        self,
+        systems: dict,
+        strategy_name: str,
+        data_client: DataClient,
+        symbol: str,
+        params: BigBendParams = None,
+        initialize: bool = True,
+        **overrides,
     ):
         super().__init__(systems=systems)
         self.strategy_name = strategy_name
         self.data_client = data_client
         self.symbol = symbol
+        self.params = dataclasses.replace(params or BigBendParams(), **overrides)
         self.accounts = systems
-        self.df_4h = None
-        self.df_db = None
+        # Fixed capacity stores, see df_4h/df_2h/df_db for DataFrame copies
+        self.bars_4h: BarStore = None
+        self.bars_2h: BarStore = None
+        self.bars_db: BarStore = None
         self.stale_data = False
 
-        self.initialize_data()
-
-    def initialize_data(self):
-        self.df_4h = self.data_client.get_historical_data(
-            symbol=self.symbol, candle_length_minutes=4*60, number_of_candles=51
+        # 4h and 2h bars are both built from one stream of 30m candles
+        self.hour_bars = MultiTimeframeBarBuilder(
+            symbol, {4*60: self.params.bars_4h, 2*60: self.params.bars_2h}
         )
-        self.df_2h = self.data_client.get_historical_data(
-            symbol=self.symbol, candle_length_minutes=2*60, number_of_candles=7
+        self.bar_cache = (
+            BarCache(BAR_CACHE_DIR, namespace=cache_namespace(strategy_name, dataclasses.asdict(self.params)))
+            if BAR_CACHE_DIR
+            else None
         )
-        self.df_db = self.data_client.get_historical_data_db(
-            symbol=self.symbol, db_value=90_000_000, number_of_bars=201
+        self.dollar_bars = (
+            DollarBarBuilder(symbol, self.params.db_threshold, self.params.bars_db)
+            if self.params.local_dollar_bars
+            else None
         )
 
-        data = [self.df_4h, self.df_2h, self.df_db]
+        # Indicators are seeded from the history and then rolled forward one bar at a time
+        self.db_ema = ExponentialMovingAverage(self.params.db_ema_window)
+        self.db_sma = SimpleMovingAverage(self.params.db_sma_window)
+        self.sma_fast_4h = SimpleMovingAverage(self.params.fast_sma_window)
+        self.sma_slow_4h = SimpleMovingAverage(self.params.slow_sma_window)
+        self.atr_avg_2h = AverageTrueRange(self.params.atr_window)
+        self.last_4h = None
+        self.last_2h = None
+        self.last_db = None
+
+        # initialize=False leaves loading the history to the caller, see history_tasks
+        if initialize:
+            self.initialize_data()
+
+    def initialize_data(self):
+        """
+        Load the history and seed the indicators. Raises RuntimeError if some of it
+        couldn't be loaded
+        """
+        stale_cache = [task() for task in self.history_tasks()]
+        self.finish_initialize(any(stale_cache))
+
+    def history_tasks(self) -> typing.List[typing.Callable[[], bool]]:
+        """
+        The independent parts of initialize_data, one per data source, so a
+        bootstrap can run them concurrently (see Scheduler.build_generators) and then
+        call finish_initialize. Each returns True if it started from cached bars that
+        couldn't be brought up to date
+        """
+        return [self.load_hour_bars, self.load_bars_db]
+
+    def load_hour_bars(self) -> bool:
+        """
+        From the bars cached by the last run when they are recent enough, fetching
+        only what closed since, otherwise from the DB. Cached bars that can't be
+        brought up to date (e.g. the DB is unreachable) are kept and flagged stale
+        """
+        if self.bar_cache is not None and self.hour_bars.restore(self.bar_cache):
+            self.bars_4h = self.hour_bars.frames[4*60]
+            self.bars_2h = self.hour_bars.frames[2*60]
+            try:
+                stale, _ = self.hour_bars.update(self.data_client)
+                return stale
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                return True
+
+        try:
+            if self.hour_bars.initialize(self.data_client):
+                self.bars_4h = self.hour_bars.frames[4*60]
+                self.bars_2h = self.hour_bars.frames[2*60]
+        except Exception as e:
+            logger.error(traceback.format_exc())
+        return False
+
+    def load_bars_db(self) -> bool:
+        """
+        load_hour_bars for the dollar bars. Locally built bars also need the partial
+        bar, so they are always rebuilt from the klines
+        """
+        if self.dollar_bars is not None:
+            try:
+                if self.dollar_bars.initialize(self.data_client, self.params.bars_db):
+                    self.bars_db = self.dollar_bars.bars
+            except Exception as e:
+                logger.error(traceback.format_exc())
+            return False
+
+        bars = self.params.bars_db
+        if self.bar_cache is not None:
+            bars_db = self.bar_cache.load((self.symbol, "db", self.params.db_threshold))
+            if bars_db is not None and bars_db.capacity == bars and len(bars_db) == bars:
+                self.bars_db = bars_db
+                try:
+                    query_df = self.data_client.fetch_new_bars_db(
+                        self.symbol, self.params.db_threshold, bars_db.last("open_time")
+                    )
+                    bars_db.extend(query_df)
+                    return False
+                except Exception as e:
+                    logger.error(traceback.format_exc())
+                    return True
+
+        df_db = self.data_client.get_historical_data_db(
+            symbol=self.symbol,
+            db_value=self.params.db_threshold,
+            number_of_bars=bars,
+        )
+        if df_db is not None:
+            self.bars_db = BarStore.from_frame(df_db, bars, index="open_time")
+        return False
+
+    def finish_initialize(self, stale_cache: bool):
+        """
+        After every history_tasks task has run: check nothing is missing, cache the
+        bars and seed the indicators
+        """
+        data = [self.bars_4h, self.bars_2h, self.bars_db]
         if any(item is None for item in data):
-            # Not sure what to do here, probably need some mechanism to wait and then try again
-            msg = "Historical data fetching failed - Exiting App"
+            logger.error(f"Historical Data Fetch Failed for {self.strategy_name}")
+            # Only this generator fails, the scheduler reports it and retries later
+            raise RuntimeError("Historical data fetching failed")
+
+        if stale_cache:
+            self.stale_data = True
+            msg = "Started from cached bars that couldn't be brought up to date, data is stale"
             self.send_message(self.strategy_name, msg, SLACK_CHANNEL)
-            logger.error("Historical Data Fetch Failed")
-            exit()
+            logger.error(msg)
+        self.save_cache()
+        self.roll_indicators()
+
+    def save_cache(self):
+        if self.bar_cache is None:
+            return
+        try:
+            self.hour_bars.save(self.bar_cache)
+            if self.dollar_bars is None:
+                self.bar_cache.save((self.symbol, "db", self.params.db_threshold), self.bars_db)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+
+    @property
+    def df_4h(self) -> DataFrame:
+        return self.bars_4h.to_frame()
+
+    @property
+    def df_2h(self) -> DataFrame:
+        return self.bars_2h.to_frame()
+
+    @property
+    def df_db(self) -> DataFrame:
+        return self.bars_db.to_frame().reset_index()
+
+    def data_requirements(self) -> dict:
+        """
+        What update_data is about to fetch, so the scheduler can fetch it for many
+        generators at once with DataClient.prefetch_candles/prefetch_bars_db
+        """
+        requirements = {
+            "candles": [
+                (self.symbol, self.hour_bars.kind, self.hour_bars.high_water_mark),
+            ],
+        }
+        if self.dollar_bars is None:
+            requirements["bars_db"] = [
+                (self.symbol, self.params.db_threshold, self.bars_db.last("open_time"))
+            ]
+        return requirements
+
+    def data_subscriptions(self) -> typing.Set[typing.Tuple[str, str, str]]:
+        """
+        The insert notifications (see notify_listener) that mean update_data has something new.
+        Locally built dollar bars come from the source klines, which have no trigger, so
+        those are still polled every interval
+        """
+        subscriptions = {(CANDLE_CHANNEL, self.symbol, self.hour_bars.kind)}
+        if self.dollar_bars is None:
+            subscriptions.add((DOLLAR_BAR_CHANNEL, self.symbol, str(self.params.db_threshold)))
+        return subscriptions
 
     def update_data(self) -> bool:
-        self.df_4h, stale_4h, updated_4h = self.data_client.update_hour_bars(
-            self.symbol, self.df_4h, 4*60, 51
-        )
-        self.df_2h, stale_2h, updated_2h = self.data_client.update_hour_bars(
-            self.symbol, self.df_2h, 2*60, 7
-        )
-        self.df_db, stale_db, updated_db = self.data_client.update_bars_db(
-            self.df_db, self.symbol, 90_000_000, 201
+        stale_hour, updated_hour = self.hour_bars.update(self.data_client)
+        if self.dollar_bars is not None:
+            stale_db, updated_db = self.update_local_bars_db()
+        else:
+            self.bars_db, stale_db, updated_db = self.data_client.update_bars_db(
+                self.bars_db, self.symbol, self.params.db_threshold, self.params.bars_db
+            )
+
+        go, actions = self.apply_updates(stale_hour, updated_hour, stale_db, updated_db)
+        self.dispatch(actions)
+        return go
+
+    async def aupdate_data(self, data_client, strategy_client) -> bool:
+        """
+        update_data over an AsyncDataClient, stale messages go out through an AsyncStrategyClient
+        """
+        rows = await data_client.afetch_candles_since(
+            self.symbol, self.hour_bars.kind, self.hour_bars.high_water_mark
         )
+        stale_hour, updated_hour = self.hour_bars.ingest(rows, data_client)
+        if self.dollar_bars is not None:
+            rows = await data_client.afetch_source_rows(
+                self.symbol, self.dollar_bars.high_water_mark
+            )
+            stale_db, updated_db = self.update_local_bars_db(rows)
+        else:
+            self.bars_db, stale_db, updated_db = await data_client.aupdate_bars_db(
+                self.bars_db, self.symbol, self.params.db_threshold, self.params.bars_db
+            )
+
+        go, actions = self.apply_updates(stale_hour, updated_hour, stale_db, updated_db)
+        await self.adispatch(actions, strategy_client)
+        return go
+
+    def update_local_bars_db(self, rows: DataFrame = None) -> typing.Tuple[bool, bool]:
+        """
+        Roll the locally built dollar bars forward with the klines in rows (fetched
+        if None), returns (stale, updated). Stale is judged on the close time of the
+        last kline consumed
+        """
+        try:
+            if rows is None:
+                rows = self.data_client.fetch_source_rows(
+                    self.symbol, self.dollar_bars.high_water_mark
+                )
+            new_bars = self.dollar_bars.ingest(rows)
+            # fetch_source_rows already recorded the newest kline with the freshness tracker
+            stale = self.data_client.check_data_staleness_db(self.symbol)
+            return stale, not new_bars.empty
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            return True, False
+
+    def apply_updates(
+        self,
+        stale_hour: bool,
+        updated_hour: typing.Dict[int, bool],
+        stale_db: bool,
+        updated_db: bool,
+    ) -> typing.Tuple[bool, typing.List[Notification]]:
+        stale_4h = stale_2h = stale_hour
+        updated_4h = updated_hour[4*60]
 
         go = False
+        actions = []
 
         if stale_4h or stale_db or stale_2h:
             self.stale_data = True
             msg = f"Stale Data in Update Data | 4h Bar {stale_4h} 2h Bar {stale_2h} DB Bar {stale_db}"
-            self.send_message(self.strategy_name, msg, SLACK_CHANNEL)
+            actions.append(Notification(msg))
             logger.error(msg)
         else:
             self.stale_data = False
 
+        if any(updated_hour.values()) or updated_db:
+            self.save_cache()
+
         if updated_4h or updated_db:
             logger.info(
                 f"Updated Dollar Bar: {updated_db} | Updated 4h Bar {updated_4h}"
             )
             go = True
 
-        return go
-
-    def calculate_simple_moving_average(self, df: DataFrame, col: str, window: int):
-        return df[col].rolling(window=window).mean()
-
-    def calculate_exponential_moving_average(
-        self, df: DataFrame, col: str, window: int
-    ):
-        return df[col].ewm(span=window, adjust=False).mean()
+        return go, actions
+
+    @timed("indicators")
+    def roll_indicators(self):
+        """
+        Feed every bar we haven't seen yet into the indicators. On the first call
+        this seeds them with the whole history, after that it is only the bars
+        update_data just appended
+        """
+        start = self.bars_4h.search(self.last_4h)
+        for close in self.bars_4h.view("close", start=start):
+            self.sma_fast_4h.update(close)
+            self.sma_slow_4h.update(close)
+        self.last_4h = self.bars_4h.last("Open Time")
+
+        start = self.bars_2h.search(self.last_2h)
+        self.atr_avg_2h.seed(
+            self.bars_2h.view("open", start=start),
+            self.bars_2h.view("high", start=start),
+            self.bars_2h.view("low", start=start),
+        )
+        self.last_2h = self.bars_2h.last("Open Time")
 
-    def calculate_atr(self, df: DataFrame):
-        return (df["high"] - df["low"]) / df["open"]
+        start = self.bars_db.search(self.last_db)
+        for duration in self.bars_db.view("duration", start=start):
+            self.db_ema.update(duration)
+            self.db_sma.update(duration)
+        self.last_db = self.bars_db.last("open_time")
 
     def generate_signal(self):
         go = self.update_data()
+        self.roll_indicators()
+        self.count_tick(go)
 
         if not go:
             return
 
-        df_db = self.df_db.copy()
-        df_db["EMA50"] = self.calculate_exponential_moving_average(
-            self.df_db, "duration", 50
-        )
-        df_db["SMA200"] = self.calculate_simple_moving_average(
-            self.df_db, "duration", 200
-        )
+        self.dispatch(self.evaluate())
 
-        latest_db = df_db.iloc[-1]
-        second_latest_db = df_db.iloc[-2]
+    async def agenerate_signal(self, data_client, strategy_client):
+        """
+        generate_signal on an event loop, data_client is an AsyncDataClient and
+        strategy_client an AsyncStrategyClient
+        """
+        go = await self.aupdate_data(data_client, strategy_client)
+        self.roll_indicators()
+        self.count_tick(go)
 
-        df_4h = self.df_4h.copy()
-        df_4h["SMA20"] = self.calculate_simple_moving_average(self.df_4h, "close", 20)
-        df_4h["SMA50"] = self.calculate_simple_moving_average(self.df_4h, "close", 50)
+        if not go:
+            return
+
+        await self.adispatch(self.evaluate(), strategy_client)
+
+    def count_tick(self, go: bool):
+        if self.stale_data:
+            count_tick("stale")
+        elif go:
+            count_tick("updated")
+        else:
+            count_tick("noop")
+
+    async def adispatch(
+        self, actions: typing.List[typing.Union[TradeSignal, Notification]], strategy_client
+    ):
+        for batch in group_signals(actions):
+            if isinstance(batch, Notification):
+                await strategy_client.send_message(
+                    self.strategy_name, batch.msg, SLACK_CHANNEL
+                )
+                continue
+            trade_type, systems = batch
+            await strategy_client.send_signals(
+                systems=systems, strategy_name=self.strategy_name, trade_type=trade_type
+            )
 
-        latest_4h = df_4h.iloc[-1]
-        second_latest_4h = df_4h.iloc[-2]
+    def dispatch(self, actions: typing.List[typing.Union[TradeSignal, Notification]]):
+        for batch in group_signals(actions):
+            if isinstance(batch, Notification):
+                self.send_message(self.strategy_name, batch.msg, SLACK_CHANNEL)
+                continue
+            trade_type, systems = batch
+            self.send_signals(
+                systems=systems, strategy_name=self.strategy_name, trade_type=trade_type
+            )
 
-        df_2h = self.df_2h.copy()
-        df_2h["ATR"] = self.calculate_atr(df_2h)
-        df_2h["ATR_AVG"] = self.calculate_simple_moving_average(df_2h, "ATR", 6)
-        latest_2h = df_2h.iloc[-1]
+    @timed()
+    def evaluate(self) -> typing.List[typing.Union[TradeSignal, Notification]]:
+        """
+        The strategy rules. Works off the indicators only and returns the signals
+        and messages to send, in order, so the sync and async paths share it
+        """
+        actions = []
+        params = self.params
+
+        latest_db = {"EMA": self.db_ema.value, "SMA": self.db_sma.value}
+        second_latest_db = {
+            "EMA": self.db_ema.previous,
+            "SMA": self.db_sma.previous,
+        }
+
+        latest_4h = {"FAST": self.sma_fast_4h.value, "SLOW": self.sma_slow_4h.value}
+        second_latest_4h = {
+            "FAST": self.sma_fast_4h.previous,
+            "SLOW": self.sma_slow_4h.previous,
+        }
+
+        latest_2h = {"ATR_AVG": self.atr_avg_2h.value}
         logger.info(f"{round(latest_2h['ATR_AVG'], 4)}")
 
+        systems_to_check = [x for x in self.systems if x.name != "research"]
+
         vol = "High Vol"
-        if latest_db["EMA50"] > latest_db["SMA200"]:
+        if latest_db["EMA"] > latest_db["SMA"]:
             vol = "Low Vol"
-            if second_latest_db["EMA50"] <= second_latest_db["SMA200"]:
+            if second_latest_db["EMA"] <= second_latest_db["SMA"]:
                 # Just moved to low vol
-                self.send_message(
-                    self.strategy_name, "Entering Low Vol Period", SLACK_CHANNEL
-                )
+                actions.append(Notification("Entering Low Vol Period"))
         elif (
-            latest_db["EMA50"] <= latest_db["SMA200"]
-            and second_latest_db["EMA50"] > second_latest_db["SMA200"]
+            latest_db["EMA"] <= latest_db["SMA"]
+            and second_latest_db["EMA"] > second_latest_db["SMA"]
         ):
             # Just moved to high vol
-            systems_to_check = [x for x in self.systems if x.name != "research"]
             for system in systems_to_check:
-                self.send_signal(
-                    system=system,
-                    strategy_name=self.strategy_name,
-                    trade_type="Exit Position",
-                )
-            self.send_message(
-                self.strategy_name, "Entering High Vol Period", SLACK_CHANNEL
-            )
+                actions.append(TradeSignal(system, "Exit Position"))
+            actions.append(Notification("Entering High Vol Period"))
 
         direction = None
         crossover = None
-        if latest_4h["SMA20"] > latest_4h["SMA50"]:
+        if latest_4h["FAST"] > latest_4h["SLOW"]:
             direction = "Entry Long"
-            if second_latest_4h["SMA20"] <= second_latest_4h["SMA50"]:
+            if second_latest_4h["FAST"] <= second_latest_4h["SLOW"]:
                 crossover = "Exit Short and Enter Long"
 
-        if latest_4h["SMA20"] < latest_4h["SMA50"]:
+        if latest_4h["FAST"] < latest_4h["SLOW"]:
             direction = "Entry Short"
-            if second_latest_4h["SMA20"] >= second_latest_4h["SMA50"]:
+            if second_latest_4h["FAST"] >= second_latest_4h["SLOW"]:
                 crossover = "Exit Long and Enter Short"
 
         if vol == "Low Vol":
-            systems_to_check = [x for x in self.systems if x.name != "research"]
-
-
             if crossover is not None:
                 # if any account in a system has a position, exit
+                # exits go out together before any of the messages
                 for system in systems_to_check:
-                    self.send_signal(
-                        system=system,
-                        strategy_name=self.strategy_name,
-                        trade_type="Exit Position",
-                    )
-                    self.send_message(
-                        self.strategy_name,
-                        f"{system}: Sending Exit Position SMA Crossover {crossover}",
-                        SLACK_CHANNEL
+                    actions.append(TradeSignal(system, "Exit Position"))
+                for system in systems_to_check:
+                    actions.append(
+                        Notification(
+                            f"{system}: Sending Exit Position SMA Crossover {crossover}"
+                        )
                     )
-            
+
             if crossover is None:
-                if latest_2h["ATR_AVG"] < 0.008:
-                    self.send_message(
-                        self.strategy_name,
-                        f"ATR Lower than 80bps {round(latest_2h['ATR_AVG'], 4)}",
-                        SLACK_CHANNEL
-                    )
-                    self.send_message(
-                        self.strategy_name,
-                        f"{system}: Sending {direction}",
-                        SLACK_CHANNEL
+                if latest_2h["ATR_AVG"] < params.atr_gate:
+                    actions.append(
+                        Notification(
+                            f"ATR Lower than {params.atr_gate * 10_000:g}bps {round(latest_2h['ATR_AVG'], 4)}"
+                        )
                     )
-
                     for system in systems_to_check:
-                        self.send_signal(
-                            system=system,
-                            strategy_name=self.strategy_name,
-                            trade_type=direction,
-                        )
+                        actions.append(Notification(f"{system}: Sending {direction}"))
+                    for system in systems_to_check:
+                        actions.append(TradeSignal(system, direction))
 
         logger.info(
-            f"{vol}: {direction} | 4h SMA20 {round(latest_4h['SMA20'], 2)} SMA50 {round(latest_4h['SMA50'], 2)} | DB EMA50 {latest_db['EMA50']} SMA200 {latest_db['SMA200']}"
+            f"{vol}: {direction} | 4h SMA{params.fast_sma_window} {round(latest_4h['FAST'], 2)} SMA{params.slow_sma_window} {round(latest_4h['SLOW'], 2)} | DB EMA{params.db_ema_window} {latest_db['EMA']} SMA{params.db_sma_window} {latest_db['SMA']}"
         )
+        return actions
@@ -4,16 +4,231 @@ import time
 import traceback
 import typing
 
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
-from sqlalchemy import create_engine, text
+from pandas.api.types import is_datetime64_any_dtype
+from sqlalchemy import text
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
+from config import (
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    FRESHNESS_MAX_AGE_SECONDS,
+    SERVER_SIDE_BARS,
+)
+from config import SOURCE_TABLES as SOURCE_TABLES_CONFIG
+from strategy_clients.bar_store import append_bars, last_value
+from strategy_clients.db_pool import get_engine
+from strategy_clients.freshness import FreshnessTracker, candle_source
+from strategy_clients.metrics import timed
 from strategy_clients.models import System
+from strategy_clients.ohlc import OHLC_COLUMNS, resample_ohlc
 
 logger = logging.getLogger(__name__)
 
 
+# Only the columns the bar code reads, cast in the DB so they decode straight into
+# float64/int64 arrays. close_datetime comes back as epoch microseconds, so queries
+# have to ORDER BY candle.close_datetime (the column, not the alias) to keep using the index.
+CANDLE_COLUMNS = (
+    "(EXTRACT(EPOCH FROM close_datetime) * 1000000)::bigint AS close_datetime, "
+    "open::float8 AS open, high::float8 AS high, low::float8 AS low, close::float8 AS close"
+)
+DOLLAR_BAR_COLUMNS = "open_time, close_time, duration::float8 AS duration"
+
+# Exchange klines each symbol's dollar bars are built from, close_time is epoch seconds.
+# Every traded symbol needs one, more come from the SOURCE_TABLES env var, see check_source_tables
+SOURCE_TABLES = {
+    "BTCUSDT": "btcusdt_usdm",
+    "ETHUSDT": "ethusdt_usdm",
+    **SOURCE_TABLES_CONFIG,
+}
+# FreshnessTracker source name for those klines
+SOURCE = "source"
+SOURCE_COLUMNS = (
+    "open_time, close_time, open::float8 AS open, high::float8 AS high, "
+    "low::float8 AS low, close::float8 AS close, quote_volume::float8 AS quote_volume"
+)
+
+EPOCH_US = "epoch_us"
+INFER = "infer"
+
+CANDLE_DTYPES = {
+    "close_datetime": EPOCH_US,
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+}
+DOLLAR_BAR_DTYPES = {
+    "open_time": INFER,
+    "close_time": INFER,
+    "duration": np.float64,
+}
+SERVER_BAR_DTYPES = {
+    "open_time": EPOCH_US,
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "complete": np.bool_,
+    "last_close": EPOCH_US,
+}
+SOURCE_DTYPES = {
+    "open_time": np.float64,
+    "close_time": np.float64,
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "quote_volume": np.float64,
+}
+
+
+def source_table(symbol: str) -> str:
+    table = SOURCE_TABLES.get(symbol)
+    if table is None:
+        raise KeyError(f"No source table for {symbol}, add it to SOURCE_TABLES")
+    return table
+
+
+def bars_db_query(symbols: typing.List[str], db_value: int, after) -> str:
+    """
+    New dollar bars for symbols plus, on every symbol's first row, the newest
+    close_time of its source klines, so the staleness check rides on the fetch.
+    Symbols without new bars still get one row, with NULL bar columns. Symbols
+    without a source table get a NULL close_time (so they stay stale) instead of
+    failing the query for every symbol
+    """
+    sources = " UNION ALL ".join(
+        f"SELECT '{symbol}'::text AS symbol, "
+        + (
+            f"(SELECT close_time FROM {SOURCE_TABLES[symbol]} ORDER BY close_time DESC LIMIT 1)"
+            if symbol in SOURCE_TABLES
+            else "NULL"
+        )
+        + " AS source_close_time"
+        for symbol in symbols
+    )
+    return (
+        f"WITH sources AS ({sources}) "
+        f"SELECT sources.symbol, sources.source_close_time, {DOLLAR_BAR_COLUMNS} FROM sources "
+        f"LEFT JOIN gt_dollarbar ON gt_dollarbar.symbol = sources.symbol AND gt_dollarbar.threshold = '{db_value}' AND gt_dollarbar.open_time > '{after}' "
+        f"ORDER BY gt_dollarbar.open_time ASC"
+    )
+
+
+def server_bars_query(input_data_duration: int, requested_data_duration: int, limit: int) -> str:
+    """
+    format_hour_bars done in Postgres over the latest `limit` candles of :symbol/:kind.
+    One row per bucket from the first candle's to the last one's, empty buckets are
+    NaN, bucketed from midnight UTC of the first candle like resample. complete is
+    False for a first bar that doesn't start with a candle or a last bar that doesn't
+    end with one. Every row also has the close time of the newest candle (last_close)
+    for the staleness check. first/last skip NULLs like pandas.
+    """
+    step = f"interval '{requested_data_duration} minutes'"
+    last_slot = f"interval '{requested_data_duration - input_data_duration} minutes'"
+    return f"""
+WITH raw AS (
+    SELECT candle.close_datetime - interval '{input_data_duration} minutes' AS open_time,
+        open::float8 AS open, high::float8 AS high, low::float8 AS low, close::float8 AS close
+    FROM candle
+    WHERE symbol = :symbol AND kind = :kind
+    ORDER BY candle.close_datetime DESC
+    LIMIT {limit}
+),
+bounds AS (
+    SELECT first_open, last_open, origin,
+        date_bin({step}, first_open, origin) AS first_bucket,
+        date_bin({step}, last_open, origin) AS last_bucket
+    FROM (
+        SELECT min(open_time) AS first_open, max(open_time) AS last_open,
+            date_trunc('day', min(open_time), 'UTC') AS origin
+        FROM raw
+    ) AS b
+    WHERE first_open IS NOT NULL
+),
+bars AS (
+    SELECT date_bin({step}, raw.open_time, bounds.origin) AS bucket,
+        (array_agg(raw.open ORDER BY raw.open_time) FILTER (WHERE raw.open IS NOT NULL))[1] AS open,
+        max(raw.high) AS high,
+        min(raw.low) AS low,
+        (array_agg(raw.close ORDER BY raw.open_time DESC) FILTER (WHERE raw.close IS NOT NULL))[1] AS close
+    FROM raw CROSS JOIN bounds
+    GROUP BY 1
+)
+SELECT
+    (EXTRACT(EPOCH FROM s.bucket) * 1000000)::bigint AS open_time,
+    COALESCE(bars.open, 'NaN') AS open,
+    COALESCE(bars.high, 'NaN') AS high,
+    COALESCE(bars.low, 'NaN') AS low,
+    COALESCE(bars.close, 'NaN') AS close,
+    (s.bucket > bounds.first_bucket OR bounds.first_bucket = bounds.first_open)
+        AND (s.bucket < bounds.last_bucket OR bounds.last_bucket + {last_slot} = bounds.last_open) AS complete,
+    (EXTRACT(EPOCH FROM bounds.last_open + interval '{input_data_duration} minutes') * 1000000)::bigint AS last_close
+FROM bounds
+CROSS JOIN generate_series(bounds.first_bucket, bounds.last_bucket, {step}) AS s(bucket)
+LEFT JOIN bars ON bars.bucket = s.bucket
+ORDER BY s.bucket ASC
+"""
+
+
+def read_bars_db(connection, query: str) -> typing.Tuple[DataFrame, typing.Dict[str, typing.Any]]:
+    """
+    Run a bars_db_query, returns the bars and {symbol: source close_time}
+    """
+    result = connection.execute(text(query))
+    columns = list(result.keys())
+    rows = result.fetchall()
+    symbol, source_close_time, open_time = (
+        columns.index(name) for name in ("symbol", "source_close_time", "open_time")
+    )
+
+    sources = {row[symbol]: row[source_close_time] for row in rows}
+    bar_columns = [name for name in columns if name != "source_close_time"]
+    bar_rows = [
+        tuple(value for i, value in enumerate(row) if i != source_close_time)
+        for row in rows
+        if row[open_time] is not None
+    ]
+    return decode_rows(bar_rows, bar_columns, DOLLAR_BAR_DTYPES), sources
+
+
+def decode_rows(rows: typing.List[tuple], columns: typing.List[str], dtypes: dict) -> DataFrame:
+    """
+    Build a DataFrame column by column straight from the driver rows into typed arrays.
+    EPOCH_US columns become datetime64[ns, UTC]. INFER columns are left to numpy
+    (int64/float64 epochs) and only parsed as datetimes if the driver returned
+    datetime objects. Columns not in dtypes stay as objects (symbol, kind)
+    """
+    n = len(rows)
+    data = {}
+    for i, name in enumerate(columns):
+        dtype = dtypes.get(name)
+        if dtype == EPOCH_US:
+            values = np.fromiter((r[i] for r in rows), dtype=np.int64, count=n)
+            data[name] = pd.to_datetime(values, unit="us", utc=True)
+        elif dtype == INFER:
+            values = np.array([r[i] for r in rows])
+            if values.dtype == object and n:
+                values = pd.to_datetime(values, utc=True)
+            data[name] = values
+        elif dtype is not None:
+            data[name] = np.fromiter((r[i] for r in rows), dtype=dtype, count=n)
+        else:
+            data[name] = np.array([r[i] for r in rows], dtype=object)
+    return DataFrame(data, columns=columns)
+
+
+def read_typed(connection, query: str, params: dict = None, dtypes: dict = None) -> DataFrame:
+    result = connection.execute(text(query), params or {})
+    columns = list(result.keys())
+    return decode_rows(result.fetchall(), columns, dtypes or {})
+
+
 class DataBaseClient:
     def __init__(self, systems: typing.List[System]):
         self.systems = systems
@@ -23,21 +238,58 @@ class DataBaseClient:
         self.db_handler = {}
         
         for x in self.systems:
-            engine = create_engine(x.db_url, pool_pre_ping=True)
+            # Shared with every other client on the same db_url
+            engine = get_engine(
+                x.db_url,
+                pool_pre_ping=True,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+            )
             session_maker = sessionmaker(bind=engine)
-            self.db_handler[x.name] = {"session_maker": session_maker, "session": None}
+            self.db_handler[x.name] = {
+                "session_maker": session_maker,
+                "session": None,
+                "engine": engine,
+            }
 
         logger.info("Initialized DB Connections")
 
     def get_session(self, session_name: str):
+        # No liveness check here, pool_pre_ping already tests each connection as it
+        # is checked out of the pool and replaces it if it is dead
         session = self.db_handler[session_name]["session"]
-        if session is None or not self.is_session_alive(session_name):
+        if session is None:
             self.db_handler[session_name]["session"] = self.db_handler[session_name][
                 "session_maker"
             ]()
 
         return self.db_handler[session_name]["session"]
 
+    def pool_stats(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        """
+        Checkouts, wait time, invalidations and current size of each system's pool
+        """
+        stats = {}
+        for name, handler in self.db_handler.items():
+            pool = handler["engine"].pool
+            stats[name] = pool.stats.snapshot(pool)
+        return stats
+
+    def read(self, query: str, params: dict = None, dtypes: dict = None, session_name: str = "research") -> DataFrame:
+        """
+        Run a query on the pooled engine and decode it with read_typed
+        """
+        with self.db_handler[session_name]["engine"].connect() as connection:
+            return read_typed(connection, query, params, dtypes)
+
+    def read_with(self, reader, *args, session_name: str = "research"):
+        """
+        Run reader(connection, *args) on the pooled engine, e.g. read_bars_db
+        """
+        with self.db_handler[session_name]["engine"].connect() as connection:
+            return reader(connection, *args)
+
     def is_session_alive(self, session_name: str):
         session = self.db_handler[session_name]["session"]
         try:
@@ -53,6 +305,157 @@ class DataClient(DataBaseClient):
         super().__init__(systems)
         self.last_update_time = None
         self.stale_threshold_seconds = 120  # two minute late data is stale
+        # Newest timestamp seen per (symbol, source), updated by the fetches
+        self.freshness = FreshnessTracker(FRESHNESS_MAX_AGE_SECONDS)
+        # Rows fetched in bulk for a batch of generators, see prefetch_candles/prefetch_bars_db
+        self.candle_cache = {}
+        self.bars_db_cache = {}
+        # Higher timeframe bars are aggregated by the DB, see fetch_bars
+        self.server_side_bars = SERVER_SIDE_BARS
+
+    ###### Batched Fetches #######
+
+    def candle_update_request(self, candle_length_minutes: int) -> typing.Tuple[str, int]:
+        """
+        The candle kind and number of rows update_hour_bars needs for a given bar length
+        """
+        if candle_length_minutes % 30 == 0:
+            return "30m", candle_length_minutes // 30
+        return "1m", candle_length_minutes
+
+    @timed()
+    def prefetch_candles(self, requests: typing.Iterable[typing.Tuple[str, str, typing.Any]]):
+        """
+        Fetch the candles newer than `after` for every (symbol, kind, after) in one round trip.
+        fetch_candles_since will use these rows instead of querying until clear_prefetch
+        is called. Each pair is a LATERAL index range scan past its high-water mark, so an
+        empty tick is one index probe per pair whatever the size of the table
+        """
+        afters = {}
+        for symbol, kind, after in requests:
+            if (symbol, kind) in afters:
+                after = min(after, afters[(symbol, kind)])
+            afters[(symbol, kind)] = after
+        if not afters:
+            return
+
+        try:
+            query = (
+                "SELECT c.* FROM unnest(CAST(:symbols AS text[]), CAST(:kinds AS text[]), CAST(:afters AS timestamptz[])) AS r(symbol, kind, after) "
+                f"CROSS JOIN LATERAL (SELECT symbol, kind, {CANDLE_COLUMNS} FROM candle WHERE symbol = r.symbol AND kind = r.kind AND candle.close_datetime > r.after ORDER BY candle.close_datetime ASC) c"
+            )
+            params = {
+                "symbols": [x[0] for x in afters],
+                "kinds": [x[1] for x in afters],
+                "afters": [pd.Timestamp(x).to_pydatetime() for x in afters.values()],
+            }
+            df = self.read(query, params, CANDLE_DTYPES)
+
+            for key in afters:
+                self.candle_cache[key] = df[
+                    (df["symbol"] == key[0]) & (df["kind"] == key[1])
+                ].reset_index(drop=True)
+
+        except Exception as e:
+            logger.error(traceback.format_exc())
+
+    @timed()
+    def prefetch_bars_db(self, requests: typing.Iterable[typing.Tuple[str, int, typing.Any]]):
+        """
+        Fetch new dollar bars for every (symbol, db_value, last_open_time) in one round trip
+        per threshold. Rows are fetched from the oldest last_open_time and then filtered per symbol.
+        The source close_times that come back with them feed the freshness tracker
+        """
+        by_threshold = {}
+        for symbol, db_value, last_open_time in requests:
+            by_threshold.setdefault(db_value, {})[symbol] = last_open_time
+
+        try:
+            for db_value, last_open_times in by_threshold.items():
+                symbols = list(last_open_times)
+                min_open_time = min(last_open_times.values())
+                query = bars_db_query(symbols, db_value, min_open_time)
+                df, sources = self.read_with(read_bars_db, query)
+                self.observe_sources(sources)
+
+                for symbol, last_open_time in last_open_times.items():
+                    self.bars_db_cache[(symbol, db_value)] = df[
+                        (df["symbol"] == symbol) & (df["open_time"] > last_open_time)
+                    ].reset_index(drop=True)
+
+        except Exception as e:
+            logger.error(traceback.format_exc())
+
+    def clear_prefetch(self):
+        self.candle_cache = {}
+        self.bars_db_cache = {}
+
+    @timed()
+    def fetch_latest_candles(self, symbol: str, kind: str, limit: int) -> DataFrame:
+        """
+        The latest `limit` candles, newest first
+        """
+        query = f"SELECT symbol, {CANDLE_COLUMNS} FROM candle WHERE symbol = '{symbol}' AND kind = '{kind}' ORDER BY candle.close_datetime DESC LIMIT {limit}"
+        return self.read(query, dtypes=CANDLE_DTYPES)
+
+    @timed()
+    def fetch_candles_since(self, symbol: str, kind: str, after) -> DataFrame:
+        """
+        Candles that closed after `after` (a high-water mark), oldest first
+        """
+        cached = self.candle_cache.get((symbol, kind))
+        if cached is not None:
+            return cached[cached["close_datetime"] > after].copy()
+
+        query = f"SELECT symbol, {CANDLE_COLUMNS} FROM candle WHERE symbol = :symbol AND kind = :kind AND candle.close_datetime > :after ORDER BY candle.close_datetime ASC"
+        params = {"symbol": symbol, "kind": kind, "after": pd.Timestamp(after).to_pydatetime()}
+        return self.read(query, params, CANDLE_DTYPES)
+
+    @timed()
+    def fetch_new_bars_db(self, symbol: str, db_value: int, last_open_time) -> DataFrame:
+        cached = self.bars_db_cache.get((symbol, db_value))
+        if cached is not None:
+            return cached[cached["open_time"] > last_open_time].copy()
+
+        query = bars_db_query([symbol], db_value, last_open_time)
+        df, sources = self.read_with(read_bars_db, query)
+        self.observe_sources(sources)
+        return df.drop(columns="symbol")
+
+    def observe_sources(self, sources: typing.Dict[str, typing.Any]):
+        for symbol, close_time in sources.items():
+            self.freshness.observe(symbol, SOURCE, close_time)
+
+    @timed()
+    def fetch_source_rows(self, symbol: str, after, limit: int = None) -> DataFrame:
+        """
+        Klines from the symbol's source table that closed after `after` (epoch
+        seconds), oldest first. Used to build dollar bars locally
+        """
+        query = f"SELECT {SOURCE_COLUMNS} FROM {source_table(symbol)} WHERE close_time > :after ORDER BY close_time ASC"
+        if limit is not None:
+            query += f" LIMIT {limit}"
+        df = self.read(query, {"after": after}, SOURCE_DTYPES)
+        if not df.empty:
+            self.freshness.observe(symbol, SOURCE, df["close_time"].iloc[-1])
+        return df
+
+    @timed()
+    def fetch_bars(
+        self, symbol: str, kind: str, requested_data_duration: int, limit: int
+    ) -> typing.Tuple[DataFrame, typing.Optional[pd.Timestamp]]:
+        """
+        format_hour_bars(fetch_latest_candles(symbol, kind, limit)) aggregated in the DB,
+        so only the bars come back. Also returns the close time of the newest candle,
+        None if there are no candles
+        """
+        query = server_bars_query(int(kind[:-1]), requested_data_duration, limit)
+        df = self.read(query, {"symbol": symbol, "kind": kind}, SERVER_BAR_DTYPES)
+        last_close = df["last_close"].iloc[0] if not df.empty else None
+
+        bars = df[df["complete"]].set_index("open_time")[OHLC_COLUMNS]
+        bars.index.rename("Open Time", inplace=True)
+        return bars, last_close
 
     ###### Time Based Bars #######
     
@@ -60,9 +463,6 @@ class DataClient(DataBaseClient):
         self, symbol:str, candle_length_minutes:int, number_of_candles:int
     ) -> DataFrame:
         try:
-            
-            session = self.get_session("research")
-            
             #If you want hourly candles, then we will use the 30m candles from DB to make
             if candle_length_minutes % 30 == 0:
                 limit = (candle_length_minutes // 30) * number_of_candles + (candle_length_minutes // 30)
@@ -70,17 +470,20 @@ class DataClient(DataBaseClient):
             else:
                 limit = candle_length_minutes * number_of_candles + candle_length_minutes
                 db_candle_length = 1
-            
-        
-            query = f"SELECT * FROM candle WHERE symbol = '{symbol}' AND kind = '{db_candle_length}m' ORDER BY close_datetime DESC LIMIT {limit}"
-            df = pd.read_sql(query, session.bind)
 
-            stale_data = self.check_data_staleness(df, db_candle_length)
+            if self.server_side_bars:
+                formatted_df, last_close = self.fetch_bars(symbol, f"{db_candle_length}m", candle_length_minutes, limit)
+                stale_data = last_close is None or self.is_candle_stale(symbol, last_close, db_candle_length)
+            else:
+                df = self.fetch_latest_candles(symbol, f"{db_candle_length}m", limit)
+                stale_data = self.check_data_staleness(df, db_candle_length)
+
             if stale_data:
                 logger.error("Data is stale")
                 return None
 
-            formatted_df = self.format_hour_bars(df, input_data_duration=db_candle_length, requested_data_duration=candle_length_minutes)
+            if not self.server_side_bars:
+                formatted_df = self.format_hour_bars(df, input_data_duration=db_candle_length, requested_data_duration=candle_length_minutes)
 
             if len(formatted_df) >= number_of_candles:
                 logger.info("Successfully Fetched Historical Data")
@@ -94,14 +497,13 @@ class DataClient(DataBaseClient):
 
         except Exception as e:
             logger.error(traceback.format_exc())
-        finally:
-            session.close()
     
     def check_data_staleness(self, df: DataFrame, db_candle_length:int) -> bool:
         """
         If the current time is greater than the last close time + candle_duration + stale_threshold_seconds, then the data is stale    
         """
-        df["close_datetime"] = pd.to_datetime(df["close_datetime"])
+        if not is_datetime64_any_dtype(df["close_datetime"]):
+            df["close_datetime"] = pd.to_datetime(df["close_datetime"])
         df = df.sort_values(by="close_datetime")
         df["open_datetime"] = df["close_datetime"] - datetime.timedelta(minutes=db_candle_length)
 
@@ -110,69 +512,42 @@ class DataClient(DataBaseClient):
             logger.warning(f"Dataframe is Empty")
             return True
 
-        current_time = datetime.datetime.now(tz=datetime.timezone.utc)
         data_time = df["close_datetime"].iloc[-1]
+        return self.is_candle_stale(df["symbol"].iloc[0], data_time, db_candle_length)
 
-        # logger.info(
-        #     f"Current Time: {current_time} | Latest Close Data Point: {data_time}"
-        # )
-        if (
-            current_time - data_time
-        ).total_seconds() > db_candle_length * 60 + self.stale_threshold_seconds:
-            logger.warning(f"Data for {df['symbol'].iloc[0]} is stale.")
+    def is_candle_stale(self, symbol: str, data_time, db_candle_length: int) -> bool:
+        """
+        check_data_staleness from the last close time alone, e.g. a high-water mark,
+        so an empty incremental fetch doesn't need the rows again
+        """
+        source = candle_source(f"{db_candle_length}m")
+        self.freshness.observe(symbol, source, data_time)
+        if self.freshness.is_stale(symbol, source):
+            logger.warning(f"Data for {symbol} is stale.")
             logger.warning(
-                f"{(current_time - data_time).total_seconds()} > {30*60+ self.stale_threshold_seconds}"
+                f"{self.freshness.age(symbol, source)} > {self.freshness.max_age(source)}"
             )
             # send slack message
             return True
 
         return False
 
+    @timed()
     def format_hour_bars(self, df: DataFrame, input_data_duration:int, requested_data_duration:int) -> DataFrame:
-        
-        
-        df["close_datetime"] = pd.to_datetime(df["close_datetime"])
-        df = df.sort_values(by="close_datetime")
-        df["open_datetime"] = df["close_datetime"] - datetime.timedelta(minutes=input_data_duration)
-        df = df.rename(columns={"open_datetime": "Open Time"})
-        df = df.set_index("Open Time")
-
-        # logger.info(f"Raw Data \n {df.to_markdown()}")
-
-        ohlc_dict = {"open": "first", "high": "max", "low": "min", "close": "last"}
-
-        hour_bars = df.resample(f"{requested_data_duration}min").agg(ohlc_dict)
-        hour_bars.index.rename("Open Time", inplace=True)
-        
-
-        if hour_bars.index[0] != df.index[0]:
-            # logger.info(f'Initial Mismatch {hour_bars.index[0]} != {df.index[0]}')
-            hour_bars = hour_bars.drop(hour_bars.index[0])
-
-        # If the last bar is not complete then remove it
         """
-        candle duration = 2hours 
+        Bars of requested_data_duration minutes from candles of input_data_duration,
+        bucketed on epoch integers with NumPy (see ohlc.resample_ohlc) instead of
+        resample. Incomplete first and last bars are dropped:
+
+        candle duration = 2hours
         Lets say this is the last values of the input
         8 2023-01-01 04:00:00      9
         9 2023-01-01 04:30:00     10
 
-        Then we get this result
-        2023-01-01 04:00:00    9
-
-        This candle is not complete because for this candle to be complete 2023-01-01 04:00:00
-        Then the last value in the input should be 2023-01-01 04:00:00 + 1.5 hours
-
-
+        Then the last bar starts at 2023-01-01 04:00:00, and it is not complete because
+        for that the last value in the input should be 2023-01-01 04:00:00 + 1.5 hours
         """
-
-        if (
-            hour_bars.index[-1] + datetime.timedelta(minutes=requested_data_duration - input_data_duration)
-        ) != df.index[-1]:
-            # logger.info("Removed the last bar")
-            hour_bars = hour_bars.drop(hour_bars.index[-1])
-
-        # logger.info(f"Formatted Data \n {hour_bars.to_markdown()}")
-        return hour_bars
+        return resample_ohlc(df, input_data_duration, requested_data_duration)
     
     def update_hour_bars(
         self, symbol: str, df: DataFrame, candle_length_minutes: int, number_of_candles: int
@@ -181,27 +556,27 @@ class DataClient(DataBaseClient):
             stale_data = False
             updated_data = False
 
-            session = self.get_session("research")
-            
-            if candle_length_minutes % 30 == 0:
-                limit = candle_length_minutes // 30
-                db_candle_length = 30
-            else:
-                limit = candle_length_minutes
-                db_candle_length = 1
-            
-            query = f"SELECT * FROM candle WHERE symbol = '{symbol}' AND kind = '{db_candle_length}m' ORDER BY close_datetime DESC LIMIT {limit}"
+            kind, limit = self.candle_update_request(candle_length_minutes)
+            db_candle_length = int(kind[:-1])
 
-            query_df = pd.read_sql(query, session.bind)
+            if self.server_side_bars:
+                formatted_df, last_close = self.fetch_bars(symbol, kind, candle_length_minutes, limit)
+                stale_data = last_close is None or self.is_candle_stale(symbol, last_close, db_candle_length)
+            else:
+                query_df = self.fetch_latest_candles(symbol, kind, limit)
 
-            # check if the data is stale
-            stale_data = self.check_data_staleness(query_df, db_candle_length=db_candle_length)
-            formatted_df = self.format_hour_bars(df=query_df, input_data_duration=db_candle_length, requested_data_duration=candle_length_minutes)
+                # check if the data is stale
+                stale_data = self.check_data_staleness(query_df, db_candle_length=db_candle_length)
+                formatted_df = self.format_hour_bars(df=query_df, input_data_duration=db_candle_length, requested_data_duration=candle_length_minutes)
 
-            is_different = not (df.tail(1).isin(formatted_df).all(axis=1).any())
+            # Completed bars are told apart by their open time, not by comparing values
+            last_open_time = last_value(df)
+            if last_open_time is not None:
+                formatted_df = formatted_df[formatted_df.index > last_open_time]
 
-            if not formatted_df.empty and not stale_data and is_different:
-                df = pd.concat([df, formatted_df])
+            if not formatted_df.empty and not stale_data:
+                # Trims to the most recent number_of_candles however many were added
+                df = append_bars(df, formatted_df, number_of_candles)
                 logger.info("Added hour datapoint")
                 self.last_update_time = datetime.datetime.now(tz=datetime.timezone.utc)
                 updated_data = True
@@ -209,16 +584,10 @@ class DataClient(DataBaseClient):
                 pass
                 logger.info("Didn't add hour datapoint")
 
-            if len(df) > number_of_candles:
-                df = df.drop(df.index[0])
-                logger.info("Data is too long removing one")
-
             return df, stale_data, updated_data
 
         except Exception as e:
             logger.error(traceback.format_exc())
-        finally:
-            session.close()
     
     
     
@@ -324,9 +693,11 @@ class DataClient(DataBaseClient):
             stale_data = self.check_data_staleness(query_df)
             formatted_df = self.format_hour_bars(query_df, bar_duration_hours)
 
-            is_different = not (df.tail(1).isin(formatted_df).all(axis=1).any())
+            # Completed bars are told apart by their open time, not by comparing values
+            if not df.empty:
+                formatted_df = formatted_df[formatted_df.index > df.index[-1]]
 
-            if not formatted_df.empty and not stale_data and is_different:
+            if not formatted_df.empty and not stale_data:
                 df = pd.concat([df, formatted_df])
                 logger.info("Added hour datapoint")
                 self.last_update_time = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -348,43 +719,44 @@ class DataClient(DataBaseClient):
 
     ###### Dollar Bars #######
 
+    def check_source_tables(self, symbols: typing.Iterable[str]) -> typing.List[str]:
+        """
+        Startup check that every symbol has a source table and that it exists.
+        Returns (and logs) what is wrong, those symbols' dollar bars will be stale
+        """
+        problems = []
+        for symbol in symbols:
+            table = SOURCE_TABLES.get(symbol)
+            if table is None:
+                problems.append(f"No source table for {symbol}, add it to SOURCE_TABLES")
+                continue
+            try:
+                found = self.read("SELECT to_regclass(:table) IS NOT NULL AS found", {"table": table})
+                if not found["found"].iloc[0]:
+                    problems.append(f"Source table {table} of {symbol} does not exist")
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                problems.append(f"Couldn't check the source table of {symbol}")
+        for problem in problems:
+            logger.error(problem)
+        return problems
+
     def check_data_staleness_db(self, symbol: str):
         """
         To check dollar bar staleness, we need to look at the source
-        the dollar bars are created on
+        the dollar bars are created on. Its newest close_time comes back with every
+        dollar bar fetch (see bars_db_query), so this is only a lookup
         """
+        return self.freshness.is_stale(symbol, SOURCE)
 
-        session = self.get_session("research")
-
-        if symbol == "BTCUSDT":
-            table_name = "btcusdt_usdm"
-        elif symbol == "ETHUSDT":
-            table_name = "ethusdt_usdm"
-
-        query = text(
-            f"SELECT close_time FROM {table_name} ORDER BY close_time DESC LIMIT 1"
-        )
-        result = session.execute(query).scalar()
-
-        datetime_utc = datetime.datetime.utcfromtimestamp(result)
-        now = datetime.datetime.utcnow()
-        time_difference = now - datetime_utc
-        # logger.info(f'Last {datetime_utc} Now {now} Diff {time_difference}')
-
-        # Check if the given datetime is more than 5 minutes old
-        is_older_than_5_minutes = time_difference > datetime.timedelta(minutes=5)
-
-        return is_older_than_5_minutes
-
+    @timed()
     def get_historical_data_db(
         self, symbol: str, db_value: int, number_of_bars: int
     ) -> DataFrame:
         try:
-            session = self.get_session("research")
-            # Use parameterized query for security and efficiency
             limit = number_of_bars
-            query = f"SELECT * FROM gt_dollarbar WHERE symbol = '{symbol}' AND threshold = '{db_value}' ORDER BY close_time DESC LIMIT {limit}"
-            df = pd.read_sql(query, session.bind)
+            query = f"SELECT {DOLLAR_BAR_COLUMNS} FROM gt_dollarbar WHERE symbol = '{symbol}' AND threshold = '{db_value}' ORDER BY close_time DESC LIMIT {limit}"
+            df = self.read(query, dtypes=DOLLAR_BAR_DTYPES)
 
             df = df.sort_values(by="open_time")
             if len(df) >= number_of_bars:
@@ -396,37 +768,39 @@ class DataClient(DataBaseClient):
             return df
         except Exception as e:
             logger.error(traceback.format_exc())
-        finally:
-            session.close()
 
     def update_bars_db(
         self, df: DataFrame, symbol: str, db_value: int, number_of_bars: int
     ) -> typing.Tuple[DataFrame, bool, bool]:
         # Dollar Bars could come really fast so I just need to fetch the last couple and then add them
         try:
-            stale_data = self.check_data_staleness_db(symbol=symbol)
             updated_data = False
 
-            session = self.get_session("research")
-            last_open_time = df["open_time"].iloc[-1]
-            query = f"SELECT * FROM gt_dollarbar WHERE symbol = '{symbol}' AND threshold = '{db_value}' AND open_time > '{last_open_time}' ORDER BY open_time ASC"
-            query_df = pd.read_sql(query, session.bind)
-
-            if not query_df.empty:
-                df = pd.concat([df, query_df])
-                logger.info("Added DB datapoint")
-                updated_data = True
-            else:
-                pass
-                # logger.info("Didn't add DB datapoint")
-
-            if len(df) > number_of_bars:
-                df = df[-number_of_bars:]
-                logger.info("Data is too long, truncated to the most recent bars")
+            last_open_time = last_value(df, "open_time")
+            query_df = self.fetch_new_bars_db(symbol, db_value, last_open_time)
+            stale_data = self.check_data_staleness_db(symbol=symbol)
 
+            df, updated_data = self.apply_bars_db(df, query_df, number_of_bars)
             return df, stale_data, updated_data
 
         except Exception as e:
             logger.error(traceback.format_exc())
-        finally:
-            session.close()
+            # Keep the bars, nothing new could be checked so they count as stale
+            return df, True, False
+
+    def apply_bars_db(
+        self, df: DataFrame, query_df: DataFrame, number_of_bars: int
+    ) -> typing.Tuple[DataFrame, bool]:
+        """
+        df can be a DataFrame or a BarStore, a BarStore is extended in place and returned
+        """
+        updated_data = False
+        if not query_df.empty:
+            df = append_bars(df, query_df, number_of_bars)
+            logger.info("Added DB datapoint")
+            updated_data = True
+        else:
+            pass
+            # logger.info("Didn't add DB datapoint")
+
+        return df, updated_data
@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+import typing
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """
+    Counters for one engine's connection pool, see InstrumentedQueuePool
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float):
+        with self.lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def increment(self, name: str):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def attach(self, engine):
+        event.listen(engine, "checkout", lambda *args: self.increment("checkouts"))
+        event.listen(engine, "checkin", lambda *args: self.increment("checkins"))
+        event.listen(engine, "connect", lambda *args: self.increment("connects"))
+        event.listen(engine, "invalidate", lambda *args: self.increment("invalidations"))
+
+    def snapshot(self, pool=None) -> typing.Dict[str, float]:
+        with self.lock:
+            stats = {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_mean": self.wait_seconds_total / self.checkouts
+                if self.checkouts
+                else 0.0,
+            }
+        if isinstance(pool, QueuePool):
+            stats["size"] = pool.size()
+            stats["checked_out"] = pool.checkedout()
+            stats["overflow"] = pool.overflow()
+        return stats
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that times how long each checkout waits for a connection (including
+    opening a new one when the pool is empty)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.stats.record_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool, keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db_url: str, **kwargs):
+    """
+    One engine (and so one pool) per db_url for the whole process. Every client
+    built on the same System shares it, however many generators there are.
+    kwargs are only used the first time an engine is created for a db_url
+    """
+    with _engines_lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            engine = create_engine(db_url, poolclass=InstrumentedQueuePool, **kwargs)
+            engine.pool.stats.attach(engine)
+            _engines[db_url] = engine
+            logger.info(f"Created DB engine, {len(_engines)} in this process")
+        return engine
+
+
+def engine_count() -> int:
+    return len(_engines)
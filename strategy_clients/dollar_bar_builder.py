@@ -0,0 +1,154 @@
+import logging
+import typing
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from strategy_clients.bar_store import BarStore
+
+logger = logging.getLogger(__name__)
+
+DOLLAR_BAR_DTYPES = {
+    "open_time": np.float64,
+    "close_time": np.float64,
+    "duration": np.float64,
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "notional": np.float64,
+}
+
+
+class DollarBarBuilder:
+    """
+    Builds dollar bars for one (symbol, threshold) from the exchange klines in the
+    symbol's source table (see data_client.SOURCE_TABLES), instead of reading the
+    precomputed gt_dollarbar rows. Any threshold works and a bar is available as
+    soon as the kline that completes it is.
+
+    A bar is closed by the first kline that takes the cumulative quote volume to the
+    next multiple of threshold; the overshoot counts towards the next bar, so
+    bucketing is a cumsum and a floor over the whole batch. Whatever is left over
+    is carried into the next batch.
+
+    Bars have the gt_dollarbar columns (open_time, close_time, duration, all epoch
+    seconds) plus OHLC and the notional traded, and the last `capacity` of them
+    are kept in a BarStore
+    """
+
+    def __init__(self, symbol: str, threshold: float, capacity: int):
+        self.symbol = symbol
+        self.threshold = float(threshold)
+        self.bars = BarStore(capacity, DOLLAR_BAR_DTYPES, index="open_time")
+        # close_time of the last kline consumed
+        self.high_water_mark = None
+        # The bar being built, None between bars
+        self.partial: typing.Optional[typing.Dict[str, float]] = None
+        # Notional since the last threshold multiple, includes the overshoot of the last bar
+        self.carried = 0.0
+
+    def initialize(
+        self,
+        data_client,
+        number_of_bars: int,
+        lookback_seconds: float = 7 * 24 * 3600,
+        max_lookback_seconds: float = 180 * 24 * 3600,
+    ) -> bool:
+        """
+        Build bars from the klines of the last lookback_seconds, doubling it until
+        there are number_of_bars of them. Returns False if even max_lookback_seconds
+        isn't enough
+        """
+        while True:
+            now = pd.Timestamp.now(tz="UTC").timestamp()
+            self.bars = BarStore(self.bars.capacity, DOLLAR_BAR_DTYPES, index="open_time")
+            self.high_water_mark = now - lookback_seconds
+            self.partial = None
+            self.carried = 0.0
+            self.ingest(data_client.fetch_source_rows(self.symbol, self.high_water_mark))
+
+            if len(self.bars) >= number_of_bars:
+                logger.info(
+                    f"Built {len(self.bars)} {self.threshold:g} dollar bars for {self.symbol}"
+                )
+                return True
+            if lookback_seconds >= max_lookback_seconds:
+                logger.error(
+                    f"Only {len(self.bars)} {self.threshold:g} dollar bars for {self.symbol} in {lookback_seconds / 86400:g} days"
+                )
+                return False
+            lookback_seconds = min(2 * lookback_seconds, max_lookback_seconds)
+
+    def update(self, data_client) -> DataFrame:
+        """
+        Consume the klines that closed since the last call, returns the new bars
+        """
+        return self.ingest(data_client.fetch_source_rows(self.symbol, self.high_water_mark))
+
+    def ingest(self, rows: DataFrame) -> DataFrame:
+        """
+        update() without the fetch, rows are klines oldest first. Several builders
+        (thresholds) for the same symbol can share one fetch
+        """
+        if self.high_water_mark is not None:
+            rows = rows[rows["close_time"] > self.high_water_mark]
+        if rows.empty:
+            return DataFrame(columns=list(DOLLAR_BAR_DTYPES))
+
+        open_times = rows["open_time"].to_numpy(dtype=np.float64)
+        close_times = rows["close_time"].to_numpy(dtype=np.float64)
+        opens = rows["open"].to_numpy(dtype=np.float64)
+        highs = rows["high"].to_numpy(dtype=np.float64)
+        lows = rows["low"].to_numpy(dtype=np.float64)
+        closes = rows["close"].to_numpy(dtype=np.float64)
+        notional = rows["quote_volume"].to_numpy(dtype=np.float64)
+        self.high_water_mark = close_times[-1]
+
+        cumulative = self.carried + np.cumsum(notional)
+        before = cumulative - notional
+        # Bar number of every kline, 0 is the bar carried over from the last batch if any
+        bucket = np.floor(before / self.threshold)
+        closes_bar = cumulative >= (bucket + 1) * self.threshold
+
+        starts = np.flatnonzero(np.diff(bucket, prepend=np.nan) != 0)
+        ends = np.append(starts[1:], len(bucket)) - 1
+
+        bars = DataFrame(
+            {
+                "open_time": open_times[starts],
+                "close_time": close_times[ends],
+                "open": opens[starts],
+                "high": np.maximum.reduceat(highs, starts),
+                "low": np.minimum.reduceat(lows, starts),
+                "close": closes[ends],
+                "notional": np.add.reduceat(notional, starts),
+            }
+        )
+        if self.partial:
+            first = bars.index[0]
+            bars.loc[first, "open_time"] = self.partial["open_time"]
+            bars.loc[first, "open"] = self.partial["open"]
+            bars.loc[first, "high"] = max(bars.loc[first, "high"], self.partial["high"])
+            bars.loc[first, "low"] = min(bars.loc[first, "low"], self.partial["low"])
+            bars.loc[first, "notional"] += self.partial["notional"]
+        bars["duration"] = bars["close_time"] - bars["open_time"]
+
+        complete = closes_bar[ends]
+        if complete[-1]:
+            self.partial = None
+        else:
+            last = bars.iloc[-1]
+            self.partial = {
+                "open_time": last["open_time"],
+                "open": last["open"],
+                "high": last["high"],
+                "low": last["low"],
+                "notional": last["notional"],
+            }
+        self.carried = float(np.mod(cumulative[-1], self.threshold))
+
+        new_bars = bars[complete][list(DOLLAR_BAR_DTYPES)].reset_index(drop=True)
+        self.bars.extend(new_bars)
+        return new_bars
@@ -0,0 +1,94 @@
+import datetime
+import numbers
+import threading
+import time
+import typing
+
+import pandas as pd
+
+# Max age in seconds of the newest data point before a source counts as stale.
+# Candle kinds get their length plus two minutes, e.g. a 30m candle closes every
+# 30 minutes and is then stale once it is more than 32 minutes old
+CANDLE_GRACE_SECONDS = 120
+DEFAULT_MAX_AGE_SECONDS = {
+    # the exchange klines dollar bars are built from
+    "source": 5 * 60,
+}
+
+
+def candle_source(kind: str) -> str:
+    return f"candle_{kind}"
+
+
+def to_epoch_seconds(data_time) -> float:
+    """datetime, pd.Timestamp (naive is UTC), np.datetime64 or epoch seconds"""
+    if isinstance(data_time, numbers.Real):
+        return float(data_time)
+    data_time = pd.Timestamp(data_time)
+    if data_time.tzinfo is None:
+        data_time = data_time.tz_localize("UTC")
+    return data_time.timestamp()
+
+
+class FreshnessTracker:
+    """
+    Time of the newest data point seen per (symbol, source), fed from timestamps
+    the fetches already returned, so checking staleness never needs a query.
+
+    Sources are free form: candle_<kind> for candles (see candle_source), "source"
+    for the exchange klines behind the dollar bars. max_age_seconds overrides the
+    defaults per source. A (symbol, source) that was never observed is stale
+    """
+
+    def __init__(self, max_age_seconds: typing.Dict[str, float] = None):
+        self.max_age_seconds = dict(DEFAULT_MAX_AGE_SECONDS)
+        self.max_age_seconds.update(max_age_seconds or {})
+        self.lock = threading.Lock()
+        self.latest: typing.Dict[typing.Tuple[str, str], float] = {}
+
+    def max_age(self, source: str) -> float:
+        if source in self.max_age_seconds:
+            return self.max_age_seconds[source]
+        if source.startswith("candle_"):
+            length = pd.Timedelta(source[len("candle_"):].replace("m", "min"))
+            return length.total_seconds() + CANDLE_GRACE_SECONDS
+        return DEFAULT_MAX_AGE_SECONDS["source"]
+
+    def observe(self, symbol: str, source: str, data_time):
+        """
+        Record the newest timestamp of a fetch, older ones than already seen are ignored
+        """
+        if data_time is None or pd.isna(data_time):
+            return
+        data_time = to_epoch_seconds(data_time)
+        key = (symbol, source)
+        with self.lock:
+            if data_time > self.latest.get(key, float("-inf")):
+                self.latest[key] = data_time
+
+    def age(self, symbol: str, source: str, now: float = None) -> typing.Optional[float]:
+        latest = self.latest.get((symbol, source))
+        if latest is None:
+            return None
+        return (now or time.time()) - latest
+
+    def is_stale(self, symbol: str, source: str, now: float = None) -> bool:
+        age = self.age(symbol, source, now)
+        return age is None or age > self.max_age(source)
+
+    def metrics(self) -> typing.Dict[typing.Tuple[str, str], typing.Dict[str, typing.Any]]:
+        now = time.time()
+        with self.lock:
+            keys = list(self.latest)
+        metrics = {}
+        for symbol, source in keys:
+            age = self.age(symbol, source, now)
+            metrics[(symbol, source)] = {
+                "latest": datetime.datetime.fromtimestamp(
+                    self.latest[(symbol, source)], tz=datetime.timezone.utc
+                ),
+                "age_seconds": age,
+                "max_age_seconds": self.max_age(source),
+                "stale": age > self.max_age(source),
+            }
+        return metrics
@@ -0,0 +1,611 @@
+"""
+Shared memory market data bus: one ingest process keeps the rolling candle and
+dollar bar buffers of every (symbol, kind) in shared memory, every strategy process
+on the box reads them from there instead of querying the DB.
+
+    python -m strategy_clients.market_data_bus
+
+runs the ingest for the strategies in main.py. Strategy processes use a
+BusDataClient (and a BusListener to wake on updates) in place of a DataClient,
+MARKET_DATA_BUS=true in main.py. DB load is then one set of queries per poll
+whatever the number of consumers, and a consumer starting up attaches to the
+buffers instead of fetching history.
+"""
+import contextlib
+import dataclasses
+import json
+import logging
+import threading
+import time
+import traceback
+import typing
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from pandas import DataFrame
+
+from config import MARKET_DATA_BUS_PREFIX, RESEARCH_PG_URI, STRATEGIES
+from strategy_clients.bar_builder import MultiTimeframeBarBuilder
+from strategy_clients.bar_store import BarStore
+from strategy_clients.data_client import SOURCE, DataClient
+from strategy_clients.metrics import timed
+from strategy_clients.models import BigBendParams, BusChannel, StrategySpec, System
+from strategy_clients.notify_listener import CANDLE_CHANNEL, DOLLAR_BAR_CHANNEL
+from strategy_clients.ohlc import OHLC_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# seq is even when the buffer is consistent, odd while the ingest is writing it.
+# generation is set once the segment is ready, different for every segment created
+# under a name, so consumers can tell the ingest replaced it (0 while it's set up)
+HEADER_DTYPE = np.dtype(
+    [
+        ("seq", np.uint64),
+        ("generation", np.uint64),
+        ("next", np.int64),
+        ("count", np.int64),
+        ("updated", np.float64),
+        ("source_time", np.float64),
+        ("meta_size", np.int64),
+    ]
+)
+HEADER_BYTES = 64
+META_BYTES = 4096
+ALIGN = 64
+
+
+def layout(capacity: int, columns: typing.Dict[str, np.dtype]) -> typing.Tuple[typing.Dict[str, int], int]:
+    """Offset of every column's array in the segment and the segment size"""
+    offsets = {}
+    offset = HEADER_BYTES + META_BYTES
+    for name, dtype in columns.items():
+        offsets[name] = offset
+        size = 2 * capacity * dtype.itemsize
+        offset += (size + ALIGN - 1) // ALIGN * ALIGN
+    return offsets, offset
+
+
+def open_segment(name: str, size: int = 0) -> SharedMemory:
+    """
+    Create the segment if size is given (replacing one left by an ingest that
+    crashed), otherwise attach to it
+    """
+    if size:
+        with contextlib.suppress(FileNotFoundError):
+            stale = SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        return SharedMemory(name=name, create=True, size=size)
+
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        segment = SharedMemory(name=name)
+        # Before Python 3.13 attaching also registers the segment with this process'
+        # resource tracker, which would unlink it when this process exits
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class SharedBarStore(BarStore):
+    """
+    BarStore in one shared memory segment: a header (sequence number, next, count,
+    update time), the column layout as JSON, then the mirrored column arrays. So
+    the same zero-copy views work in every process that attaches.
+
+    One writer (the ingest) wraps its writes in writing(), readers run whatever
+    reads the store in read(), a seqlock: the read is retried if a write started or
+    finished while it ran. Views used inside read() must not be kept after it
+    returns, copy what's needed (snapshot does)
+    """
+
+    def __init__(self, segment: SharedMemory, owner: bool = False):
+        self.segment = segment
+        self.owner = owner
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=segment.buf)
+        meta_size = int(self.header["meta_size"])
+        meta = json.loads(bytes(segment.buf[HEADER_BYTES : HEADER_BYTES + meta_size]))
+        self.capacity = meta["capacity"]
+        self.index = meta["index"]
+        self.tz = meta["tz"]
+        columns = {name: np.dtype(dtype) for name, dtype in meta["columns"]}
+        offsets, _ = layout(self.capacity, columns)
+        self.arrays = {
+            name: np.ndarray(2 * self.capacity, dtype=dtype, buffer=segment.buf, offset=offsets[name])
+            for name, dtype in columns.items()
+        }
+
+    @classmethod
+    def create(
+        cls,
+        name: str,
+        capacity: int,
+        columns: typing.Dict[str, typing.Any],
+        index: str = None,
+        tz: typing.Dict[str, str] = None,
+    ) -> "SharedBarStore":
+        columns = {column: np.dtype(dtype) for column, dtype in columns.items()}
+        meta = json.dumps(
+            {
+                "capacity": capacity,
+                "index": index,
+                "columns": [[column, dtype.str] for column, dtype in columns.items()],
+                "tz": {column: str(zone) for column, zone in (tz or {}).items()},
+            }
+        ).encode()
+        if len(meta) > META_BYTES:
+            raise ValueError(f"Too many columns for a shared bar store ({len(meta)} bytes of layout)")
+
+        _, size = layout(capacity, columns)
+        segment = open_segment(name, size)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=segment.buf)
+        header["meta_size"] = len(meta)
+        header["source_time"] = np.nan
+        segment.buf[HEADER_BYTES : HEADER_BYTES + len(meta)] = meta
+        header["generation"] = time.time_ns()
+        del header
+        return cls(segment, owner=True)
+
+    @classmethod
+    def from_frame(cls, name: str, df: DataFrame, capacity: int, index: str = None) -> "SharedBarStore":
+        """Shared store named name with the columns of df, filled with its last `capacity` rows"""
+        store = BarStore.from_frame(df, capacity, index)
+        shared = cls.create(
+            name,
+            capacity,
+            {column: array.dtype for column, array in store.arrays.items()},
+            index=store.index,
+            tz=store.tz,
+        )
+        with shared.writing():
+            shared.write({column: store.view(column) for column in store.arrays})
+        return shared
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedBarStore":
+        """
+        Attach to the segment named name, FileNotFoundError if there is none or
+        it isn't set up yet
+        """
+        segment = open_segment(name)
+        if not segment_generation(segment):
+            segment.close()
+            raise FileNotFoundError(f"{name} is still being set up")
+        return cls(segment)
+
+    @property
+    def next(self) -> int:
+        return int(self.header["next"])
+
+    @next.setter
+    def next(self, value: int):
+        self.header["next"] = value
+
+    @property
+    def count(self) -> int:
+        return int(self.header["count"])
+
+    @count.setter
+    def count(self, value: int):
+        self.header["count"] = value
+
+    @property
+    def seq(self) -> int:
+        return int(self.header["seq"])
+
+    @property
+    def generation(self) -> int:
+        return int(self.header["generation"])
+
+    @property
+    def updated(self) -> float:
+        return float(self.header["updated"])
+
+    @property
+    def source_time(self) -> float:
+        """Epoch seconds of the newest source kline (dollar bars only), NaN if unknown"""
+        return float(self.header["source_time"])
+
+    @source_time.setter
+    def source_time(self, value: float):
+        self.header["source_time"] = value
+
+    @contextlib.contextmanager
+    def writing(self):
+        self.header["seq"] = self.seq + 1
+        try:
+            yield
+        finally:
+            self.header["updated"] = time.time()
+            self.header["seq"] = self.seq + 1
+
+    def read(self, fn: typing.Callable[["SharedBarStore"], typing.Any], max_attempts: int = 1000):
+        """
+        fn(self) on a consistent state of the buffer
+        """
+        for _ in range(max_attempts):
+            before = self.seq
+            if before % 2:
+                time.sleep(0)
+                continue
+            try:
+                result = fn(self)
+            except Exception:
+                # A torn read can fail in any way, only an error on a consistent one counts
+                if self.seq != before:
+                    continue
+                raise
+            if self.seq == before:
+                return result
+        raise RuntimeError(f"{self.segment.name} changed during {max_attempts} reads in a row")
+
+    def snapshot(self, start: int = 0) -> DataFrame:
+        return self.read(lambda store: store.to_frame(start))
+
+    def wait(self, seq: int, timeout: float, poll_seconds: float = 0.05) -> bool:
+        """
+        Block until the store was written after seq was read, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.seq
+            if current != seq and current % 2 == 0:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_seconds)
+
+    def close(self):
+        # The segment can't be closed while arrays point into it
+        self.arrays = {}
+        self.header = None
+        self.segment.close()
+        if self.owner:
+            self.segment.unlink()
+
+
+def segment_generation(segment: SharedMemory) -> int:
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=segment.buf)
+    generation = int(header["generation"])
+    del header
+    return generation
+
+
+def current_generation(name: str) -> int:
+    """Generation of the segment named name right now, 0 if there is none or it isn't ready"""
+    try:
+        segment = open_segment(name)
+    except FileNotFoundError:
+        return 0
+    try:
+        return segment_generation(segment)
+    finally:
+        segment.close()
+
+
+def segment_name(channel: BusChannel, prefix: str = MARKET_DATA_BUS_PREFIX) -> str:
+    return f"{prefix}{channel.key}"
+
+
+def candle_frame(rows: DataFrame) -> DataFrame:
+    """Candle rows as stored on the bus: oldest first, no symbol"""
+    return rows[["close_datetime"] + OHLC_COLUMNS].sort_values("close_datetime").reset_index(drop=True)
+
+
+def big_bend_channels(spec: StrategySpec) -> typing.List[BusChannel]:
+    params = dataclasses.replace(BigBendParams(), **spec.params)
+    hour_bars = MultiTimeframeBarBuilder(spec.symbol, {4*60: params.bars_4h, 2*60: params.bars_2h})
+    if params.local_dollar_bars:
+        raise ValueError(
+            f"big_bend {spec.symbol}: local_dollar_bars needs the source klines, which aren't on the market data bus"
+        )
+    return [
+        BusChannel(
+            spec.symbol,
+            hour_bars.kind,
+            max(hour_bars.history_limit(minutes) for minutes in hour_bars.timeframes),
+        ),
+        BusChannel(spec.symbol, "db", params.bars_db, params.db_threshold),
+    ]
+
+
+CHANNELS = {
+    "big_bend": big_bend_channels,
+}
+
+
+def channels_for(specs: typing.List[StrategySpec]) -> typing.List[BusChannel]:
+    """
+    Every buffer the specs need, one per key with the largest capacity asked for.
+    ValueError for a spec that needs data the bus doesn't carry, so calling it at
+    startup checks the specs can run on the bus
+    """
+    channels = {}
+    for spec in specs:
+        for channel in CHANNELS[spec.strategy](spec):
+            if channel.key not in channels or channels[channel.key].capacity < channel.capacity:
+                channels[channel.key] = channel
+    return list(channels.values())
+
+
+class MarketDataIngest:
+    """
+    The one process that queries the DB: loads the history of every channel into a
+    SharedBarStore, then every poll_seconds fetches what is new for all of them in
+    one batch (prefetch_candles/prefetch_bars_db) and appends it. Channels that fail
+    to load are retried on every poll
+    """
+
+    def __init__(
+        self,
+        systems: typing.List[System],
+        channels: typing.List[BusChannel],
+        data_client: DataClient = None,
+        poll_seconds: float = 5,
+        prefix: str = MARKET_DATA_BUS_PREFIX,
+    ):
+        self.channels = channels
+        self.data_client = data_client or DataClient(systems=systems)
+        self.poll_seconds = poll_seconds
+        self.prefix = prefix
+        self.stores: typing.Dict[BusChannel, SharedBarStore] = {}
+
+    def load(self, channel: BusChannel) -> SharedBarStore:
+        if channel.threshold is None:
+            rows = self.data_client.fetch_latest_candles(channel.symbol, channel.kind, channel.capacity)
+            frame, index = candle_frame(rows), "close_datetime"
+        else:
+            frame = self.data_client.get_historical_data_db(
+                channel.symbol, channel.threshold, channel.capacity
+            )
+            if frame is None:
+                raise RuntimeError(f"Not enough dollar bars for {channel.key}")
+            index = "open_time"
+        store = SharedBarStore.from_frame(segment_name(channel, self.prefix), frame, channel.capacity, index)
+        logger.info(f"Loaded {len(store)} bars into {store.segment.name}")
+        return store
+
+    def start(self):
+        self.data_client.check_source_tables(sorted({c.symbol for c in self.channels if c.threshold is not None}))
+        self.load_missing()
+
+    def load_missing(self):
+        for channel in self.channels:
+            if channel in self.stores:
+                continue
+            try:
+                self.stores[channel] = self.load(channel)
+            except Exception as e:
+                logger.error(traceback.format_exc())
+
+    def poll(self):
+        self.load_missing()
+        candles = [
+            (c.symbol, c.kind, store.last("close_datetime"))
+            for c, store in self.stores.items()
+            if c.threshold is None
+        ]
+        bars_db = [
+            (c.symbol, c.threshold, store.last("open_time"))
+            for c, store in self.stores.items()
+            if c.threshold is not None
+        ]
+        self.data_client.prefetch_candles(candles)
+        self.data_client.prefetch_bars_db(bars_db)
+        try:
+            for channel, store in self.stores.items():
+                try:
+                    self.update(channel, store)
+                except Exception as e:
+                    logger.error(traceback.format_exc())
+        finally:
+            self.data_client.clear_prefetch()
+
+    def update(self, channel: BusChannel, store: SharedBarStore):
+        if channel.threshold is None:
+            rows = self.data_client.fetch_candles_since(
+                channel.symbol, channel.kind, store.last("close_datetime")
+            )
+            rows = candle_frame(rows)
+        else:
+            rows = self.data_client.fetch_new_bars_db(
+                channel.symbol, channel.threshold, store.last("open_time")
+            )
+            # Readers check the source's staleness against this, no need to wake them for it
+            source_time = self.data_client.freshness.latest.get((channel.symbol, SOURCE))
+            if source_time is not None:
+                store.source_time = source_time
+
+        if not rows.empty:
+            with store.writing():
+                store.extend(rows)
+
+    def run_forever(self):
+        self.start()
+        try:
+            while True:
+                started = time.monotonic()
+                self.poll()
+                time.sleep(max(0.0, self.poll_seconds - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            logger.info("Exiting loop due to user interruption.")
+        finally:
+            for store in self.stores.values():
+                store.close()
+
+
+class BusDataClient(DataClient):
+    """
+    DataClient reading candles and dollar bars from the market data bus instead of
+    the DB, for everything a generator does per tick and at startup. Stores are
+    attached on first use, waiting up to attach_timeout_seconds for the ingest to
+    have loaded them. At most every check_seconds each store's generation is
+    compared with the segment under its name, and a store the ingest replaced (it
+    restarted) is attached again.
+
+    Locally built dollar bars need the source klines, which aren't on the bus,
+    channels_for rejects those specs at startup
+    """
+
+    def __init__(
+        self,
+        systems: typing.List[System] = None,
+        prefix: str = MARKET_DATA_BUS_PREFIX,
+        attach_timeout_seconds: float = 120,
+        check_seconds: float = 5,
+    ):
+        # No DB connections, the systems are only kept for reference
+        super().__init__(systems=[])
+        self.bus_systems = systems or []
+        self.server_side_bars = False
+        self.prefix = prefix
+        self.attach_timeout_seconds = attach_timeout_seconds
+        self.check_seconds = check_seconds
+        self.stores: typing.Dict[typing.Tuple[str, str, typing.Optional[int]], SharedBarStore] = {}
+        # When each store's generation is due to be checked again
+        self.next_check: typing.Dict[typing.Tuple[str, str, typing.Optional[int]], float] = {}
+        self.lock = threading.Lock()
+
+    def store(self, symbol: str, kind: str, threshold: int = None) -> SharedBarStore:
+        key = (symbol, kind, threshold)
+        with self.lock:
+            store = self.stores.get(key)
+            if store is not None and time.monotonic() < self.next_check[key]:
+                return store
+            name = segment_name(BusChannel(symbol, kind, 0, threshold), self.prefix)
+            if store is not None:
+                self.next_check[key] = time.monotonic() + self.check_seconds
+                generation = current_generation(name)
+                # Keep reading the old segment while the ingest sets up a new one
+                if generation in (0, store.generation):
+                    return store
+                try:
+                    replaced = SharedBarStore.attach(name)
+                except FileNotFoundError:
+                    return store
+                # Readers may still be in the old one, it's unmapped once nothing points into it
+                logger.info(f"{name} was replaced by the ingest, attached the new one")
+                self.stores[key] = replaced
+                return replaced
+
+            deadline = time.monotonic() + self.attach_timeout_seconds
+            while True:
+                try:
+                    store = SharedBarStore.attach(name)
+                    break
+                except FileNotFoundError:
+                    if time.monotonic() >= deadline:
+                        raise
+                    logger.info(f"Waiting for the ingest to load {name}")
+                    time.sleep(1)
+            self.stores[key] = store
+            self.next_check[key] = time.monotonic() + self.check_seconds
+            return store
+
+    def check_source_tables(self, symbols):
+        # The ingest checks them, see MarketDataIngest.start
+        return []
+
+    def prefetch_candles(self, requests):
+        # Reads are local, nothing to batch
+        pass
+
+    def prefetch_bars_db(self, requests):
+        pass
+
+    def candle_rows(self, df: DataFrame, symbol: str) -> DataFrame:
+        df = df.reset_index()
+        df.insert(0, "symbol", symbol)
+        return df
+
+    @timed()
+    def fetch_latest_candles(self, symbol: str, kind: str, limit: int) -> DataFrame:
+        """The latest `limit` candles, newest first"""
+        df = self.store(symbol, kind).read(lambda store: store.to_frame(max(0, len(store) - limit)))
+        return self.candle_rows(df, symbol).iloc[::-1].reset_index(drop=True)
+
+    @timed()
+    def fetch_candles_since(self, symbol: str, kind: str, after) -> DataFrame:
+        """Candles that closed after `after`, oldest first"""
+        df = self.store(symbol, kind).read(lambda store: store.to_frame(store.search(after)))
+        return self.candle_rows(df, symbol)
+
+    @timed()
+    def fetch_new_bars_db(self, symbol: str, db_value: int, last_open_time) -> DataFrame:
+        df, source_time = self.store(symbol, "db", db_value).read(
+            lambda store: (store.to_frame(store.search(last_open_time)), store.source_time)
+        )
+        self.freshness.observe(symbol, SOURCE, source_time)
+        return df.reset_index()
+
+    @timed()
+    def get_historical_data_db(self, symbol: str, db_value: int, number_of_bars: int) -> DataFrame:
+        try:
+            df, source_time = self.store(symbol, "db", db_value).read(
+                lambda store: (store.to_frame(max(0, len(store) - number_of_bars)), store.source_time)
+            )
+            self.freshness.observe(symbol, SOURCE, source_time)
+            if len(df) < number_of_bars:
+                logger.error("Failed to fetch enough Historical Data/stale data DB")
+                return None
+            logger.info("Successfully Fetched Historical Data DB")
+            return df.reset_index()
+        except Exception as e:
+            logger.error(traceback.format_exc())
+
+
+class BusListener:
+    """
+    DataNotificationListener for the bus: wait() returns the (channel, symbol, key)
+    of every store the BusDataClient has attached whose sequence number moved or
+    that was attached again after an ingest restart, with the same channel names,
+    so Scheduler runs the generators subscribed to it
+    """
+
+    def __init__(self, data_client: BusDataClient, poll_seconds: float = 0.05):
+        self.data_client = data_client
+        self.poll_seconds = poll_seconds
+        # (generation, seq) of every store when last looked at
+        self.seen: typing.Dict[tuple, typing.Tuple[int, int]] = {}
+        # Scheduler falls back to polling when this is None, the bus has no connection to lose
+        self.connection = True
+
+    def changed(self) -> typing.Set[typing.Tuple[str, str, str]]:
+        events = set()
+        for symbol, kind, threshold in list(self.data_client.stores):
+            key = (symbol, kind, threshold)
+            # Through store() so a replaced segment is picked up without waiting for a tick
+            store = self.data_client.store(symbol, kind, threshold)
+            seq = store.seq
+            if seq % 2 or (store.generation, seq) == self.seen.get(key):
+                continue
+            # The first look at a store only records where it is, its history is already loaded
+            if key in self.seen:
+                if threshold is None:
+                    events.add((CANDLE_CHANNEL, symbol, kind))
+                else:
+                    events.add((DOLLAR_BAR_CHANNEL, symbol, str(threshold)))
+            self.seen[key] = (store.generation, seq)
+        return events
+
+    def wait(self, timeout: float) -> typing.Set[typing.Tuple[str, str, str]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.changed()
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            time.sleep(min(self.poll_seconds, remaining))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(name)s - %(levelname)s - %(message)s")
+    research = System(name="research", db_url=RESEARCH_PG_URI)
+    channels = channels_for([StrategySpec(**spec) for spec in STRATEGIES])
+    logger.info(f"Serving {len(channels)} channels on the market data bus")
+    MarketDataIngest(systems=[research], channels=channels).run_forever()
+
+
+if __name__ == "__main__":
+    main()
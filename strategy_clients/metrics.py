@@ -0,0 +1,252 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cached read to a slow Slack post
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# strategy/symbol of whatever is running, set by the scheduler around each tick so
+# shared clients (DataClient, StrategyClient) don't need to be told
+_labels: contextvars.ContextVar = contextvars.ContextVar("metric_labels", default={})
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_labels(labels: Labels, extra: Labels = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in items) + "}"
+
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count per label set, Prometheus style
+    """
+
+    def __init__(self, name: str, help: str, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series: typing.Dict[Labels, typing.List] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # [per bucket counts (+Inf last), sum, count]
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self.series.items()]
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{render_labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{render_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{render_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.series: typing.Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            series = list(self.series.items())
+        for labels, value in series:
+            lines.append(f"{self.name}{render_labels(labels)} {value}")
+        return lines
+
+
+class Collected:
+    """
+    Values read at scrape time from stats kept elsewhere: collect() returns
+    {labels: value}. kind is the Prometheus type, "gauge" or "counter"
+    """
+
+    def __init__(self, name: str, help: str, kind: str, collect: typing.Callable[[], typing.Dict[Labels, float]]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            series = self.collect()
+        except Exception as e:
+            logger.error(f"Collecting {self.name} failed: {e}")
+            series = {}
+        for labels, value in series.items():
+            lines.append(f"{self.name}{render_labels(labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: typing.Dict[str, typing.Union[Histogram, Counter, Collected]] = {}
+
+    def histogram(self, name: str, help: str) -> Histogram:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, help)
+            return self.metrics[name]
+
+    def counter(self, name: str, help: str) -> Counter:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Counter(name, help)
+            return self.metrics[name]
+
+    def collected(
+        self, name: str, help: str, kind: str, collect: typing.Callable[[], typing.Dict[Labels, float]]
+    ) -> Collected:
+        """
+        Register (or replace) a metric whose values come from collect() on every scrape
+        """
+        with self.lock:
+            self.metrics[name] = Collected(name, help, kind, collect)
+            return self.metrics[name]
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    return _registry
+
+
+SPAN_SECONDS = _registry.histogram(
+    "signal_span_seconds", "Time spent in each step of a tick, by span, strategy and symbol"
+)
+TICKS = _registry.counter(
+    "signal_ticks_total", "Generator ticks by outcome (updated, stale, noop), strategy and symbol"
+)
+
+
+def current_labels(**extra: str) -> Labels:
+    values = dict(_labels.get())
+    values.update(extra)
+    return tuple(sorted(values.items()))
+
+
+@contextlib.contextmanager
+def labels(**values: str):
+    """
+    Label every span and count inside the block, e.g. labels(strategy=..., symbol=...)
+    """
+    token = _labels.set({**_labels.get(), **values})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - start, current_labels(span=name))
+
+
+def timed(name: str = None):
+    """
+    Decorator, records every call of the function (or coroutine) as a span.
+    name defaults to the function's name
+    """
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count_tick(outcome: str):
+    TICKS.inc(current_labels(outcome=outcome))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes every few seconds would flood the log
+        pass
+
+
+def start_http_server(port: int, address: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve /metrics in the Prometheus text format from a daemon thread
+    """
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{address}:{port}/metrics")
+    return server
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 import typing
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 
@@ -29,3 +29,73 @@ class System:
     db_url:str = None
     trading_url:str = None
     accounts:typing.List[str] = None
+
+
+@dataclass
+class StrategySpec:
+    """
+    One generator to run: which strategy, on which symbol, how often and with what params
+    """
+    strategy: str
+    symbol: str
+    name: str = None
+    interval_seconds: float = 10
+    params: typing.Dict[str, typing.Any] = field(default_factory=dict)
+
+
+@dataclass
+class TradeSignal:
+    """A signal a strategy wants sent to a trading system"""
+    system: System
+    trade_type: str
+
+
+@dataclass
+class Notification:
+    """A Slack message a strategy wants sent"""
+    msg: str
+
+
+@dataclass(frozen=True)
+class BigBendParams:
+    """
+    Everything tunable in the big bend rules, defaults are the live values
+    """
+    db_threshold: int = 90_000_000
+    db_ema_window: int = 50
+    db_sma_window: int = 200
+    fast_sma_window: int = 20
+    slow_sma_window: int = 50
+    atr_window: int = 6
+    atr_gate: float = 0.008
+    # Build the dollar bars from the source klines (DollarBarBuilder) instead of gt_dollarbar
+    local_dollar_bars: bool = False
+
+    @property
+    def bars_4h(self) -> int:
+        """4h bars to hold, one more than the slow SMA so it has a previous value"""
+        return self.slow_sma_window + 1
+
+    @property
+    def bars_2h(self) -> int:
+        return self.atr_window + 1
+
+    @property
+    def bars_db(self) -> int:
+        return max(self.db_sma_window, self.db_ema_window) + 1
+
+
+@dataclass(frozen=True)
+class BusChannel:
+    """
+    One rolling buffer on the market data bus: the last `capacity` candles of a kind
+    ("30m") or, with kind "db", dollar bars of threshold
+    """
+    symbol: str
+    kind: str
+    capacity: int
+    threshold: int = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.symbol}_{self.kind}" if self.threshold is None else f"{self.symbol}_db{self.threshold}"
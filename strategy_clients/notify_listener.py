@@ -0,0 +1,106 @@
+import logging
+import select
+import traceback
+import typing
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+
+CANDLE_CHANNEL = "candle_insert"
+DOLLAR_BAR_CHANNEL = "gt_dollarbar_insert"
+
+# Run once against the research DB (DataNotificationListener.install_triggers).
+# Payload is "<symbol>|<kind>" for candles and "<symbol>|<threshold>" for dollar bars.
+# Postgres folds identical notifications in one transaction, so a bulk insert of
+# 30m candles only wakes each listener once per symbol.
+NOTIFY_TRIGGERS_SQL = f"""
+CREATE OR REPLACE FUNCTION notify_candle_insert() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{CANDLE_CHANNEL}', NEW.symbol || '|' || NEW.kind);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS candle_insert_notify ON candle;
+CREATE TRIGGER candle_insert_notify AFTER INSERT ON candle
+    FOR EACH ROW EXECUTE FUNCTION notify_candle_insert();
+
+CREATE OR REPLACE FUNCTION notify_gt_dollarbar_insert() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{DOLLAR_BAR_CHANNEL}', NEW.symbol || '|' || NEW.threshold::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS gt_dollarbar_insert_notify ON gt_dollarbar;
+CREATE TRIGGER gt_dollarbar_insert_notify AFTER INSERT ON gt_dollarbar
+    FOR EACH ROW EXECUTE FUNCTION notify_gt_dollarbar_insert();
+"""
+
+
+class DataNotificationListener:
+    """
+    Holds one dedicated connection LISTENing for candle and dollar bar inserts.
+
+    wait() blocks until a notification arrives or the timeout passes and returns
+    the set of (channel, symbol, key) that changed. If the connection drops it
+    returns an empty set and reconnects on the next call, so the caller just
+    carries on polling until the listener is back.
+    """
+
+    channels = (CANDLE_CHANNEL, DOLLAR_BAR_CHANNEL)
+
+    def __init__(self, db_url: str):
+        self.db_url = db_url
+        self.connection = None
+
+    def connect(self):
+        self.connection = psycopg2.connect(self.db_url)
+        self.connection.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+        )
+        with self.connection.cursor() as cursor:
+            for channel in self.channels:
+                cursor.execute(f"LISTEN {channel};")
+        logger.info(f"Listening for {', '.join(self.channels)}")
+
+    def install_triggers(self):
+        if self.connection is None:
+            self.connect()
+        with self.connection.cursor() as cursor:
+            cursor.execute(NOTIFY_TRIGGERS_SQL)
+        logger.info("Installed insert notification triggers")
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception as e:
+                pass
+            self.connection = None
+
+    def wait(self, timeout: float) -> typing.Set[typing.Tuple[str, str, str]]:
+        try:
+            if self.connection is None:
+                self.connect()
+
+            readable, _, _ = select.select([self.connection], [], [], max(0.0, timeout))
+            if not readable:
+                return set()
+
+            self.connection.poll()
+            events = set()
+            while self.connection.notifies:
+                notify = self.connection.notifies.pop(0)
+                symbol, _, key = notify.payload.partition("|")
+                events.add((notify.channel, symbol, key))
+            return events
+
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            logger.error("Lost notification connection, falling back to polling")
+            self.close()
+            return set()
@@ -0,0 +1,482 @@
+import asyncio
+import heapq
+import logging
+import time
+import traceback
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from config import BOOTSTRAP_WORKERS, SLACK_CHANNEL
+from strategy_clients.big_bend_client import SignalGeneratorBigBend
+from strategy_clients import metrics
+from strategy_clients.data_client import DataClient
+from strategy_clients.models import StrategySpec, System
+from strategy_clients.notify_listener import DataNotificationListener
+from strategy_clients.signal_dispatcher import get_dispatcher
+from strategy_clients.slack_notifier import get_notifier
+from strategy_clients.strategy_client import StrategyClient
+
+logger = logging.getLogger(__name__)
+
+
+STRATEGIES = {
+    "big_bend": SignalGeneratorBigBend,
+}
+
+
+def spec_name(spec: StrategySpec) -> str:
+    return spec.name or f"{spec.strategy} {spec.symbol}"
+
+
+@dataclass
+class TickStats:
+    ticks: int = 0
+    errors: int = 0
+    skipped: int = 0
+    last_duration: float = 0.0
+    max_duration: float = 0.0
+    total_duration: float = 0.0
+    last_lateness: float = 0.0
+    max_lateness: float = 0.0
+
+    def record(self, duration: float, lateness: float):
+        self.ticks += 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    @property
+    def mean_duration(self) -> float:
+        return self.total_duration / self.ticks if self.ticks else 0.0
+
+
+class Job:
+    def __init__(self, spec: StrategySpec, generator, next_run: float):
+        self.spec = spec
+        self.generator = generator
+        self.next_run = next_run
+        self.stats = TickStats()
+
+    @property
+    def name(self) -> str:
+        return self.generator.strategy_name
+
+    def __lt__(self, other: "Job"):
+        return self.next_run < other.next_run
+
+
+class Scheduler:
+    """
+    Runs a set of (strategy, symbol, params) generators on one shared DataClient and
+    StrategyClient, each on its own cadence.
+
+    Runs are scheduled on a fixed grid (start + k * interval) so a slow tick doesn't
+    push every later tick back. If a job is more than a whole interval late the
+    missed slots are skipped and counted rather than run back to back.
+
+    With a DataNotificationListener, generators are also run as soon as an insert
+    they subscribe to arrives, and the cadence becomes the fallback poll.
+
+    Generators whose history can't be loaded at start are reported and left out,
+    and building them is retried every report interval.
+    """
+
+    def __init__(
+        self,
+        systems: typing.List[System],
+        specs: typing.List[StrategySpec],
+        data_client: DataClient = None,
+        strategy_client: StrategyClient = None,
+        report_interval_seconds: float = 300,
+        listener: DataNotificationListener = None,
+    ):
+        self.systems = systems
+        self.specs = specs
+        self.data_client = data_client or DataClient(systems=systems)
+        self.strategy_client = strategy_client or StrategyClient(systems=systems)
+        self.report_interval_seconds = report_interval_seconds
+        self.listener = listener
+        self.jobs: typing.List[Job] = []
+        self.queue: typing.List[Job] = []
+        # Specs whose generator couldn't be built, retried in report intervals
+        self.failed: typing.List[StrategySpec] = []
+        self.next_report = None
+
+    def build_generator(self, spec: StrategySpec, initialize: bool = True):
+        strategy_class = STRATEGIES[spec.strategy]
+        return strategy_class(
+            systems=self.systems,
+            strategy_name=spec_name(spec),
+            data_client=self.data_client,
+            symbol=spec.symbol,
+            initialize=initialize,
+            **spec.params,
+        )
+
+    def build_generators(self, specs: typing.List[StrategySpec], notify: bool = True) -> list:
+        """
+        Build the generators for specs with their history loaded concurrently. Every
+        generator's history_tasks (one per data source) go on one pool of
+        BOOTSTRAP_WORKERS threads, so a cold start takes about as long as the
+        slowest queries rather than all of them back to back.
+
+        Returns [(spec, generator)] of the ones that are ready, the rest are logged,
+        added to self.failed and, if notify, posted to Slack
+        """
+        built = []
+        for spec in specs:
+            try:
+                built.append((spec, self.build_generator(spec, initialize=False)))
+            except Exception as e:
+                self.spec_failed(spec, e, notify)
+
+        ready = []
+        with ThreadPoolExecutor(max_workers=BOOTSTRAP_WORKERS, thread_name_prefix="bootstrap") as pool:
+            loading = [
+                (spec, generator, [pool.submit(self.load_history, spec, task) for task in generator.history_tasks()])
+                for spec, generator in built
+            ]
+            for spec, generator, futures in loading:
+                try:
+                    stale_cache = [future.result() for future in futures]
+                    generator.finish_initialize(any(stale_cache))
+                except Exception as e:
+                    self.spec_failed(spec, e, notify)
+                    continue
+                ready.append((spec, generator))
+
+        logger.info(f"Loaded the history of {len(ready)} of {len(specs)} generators")
+        return ready
+
+    def load_history(self, spec: StrategySpec, task: typing.Callable[[], bool]) -> bool:
+        # Pool threads don't inherit the caller's metric labels
+        with metrics.labels(strategy=spec_name(spec), symbol=spec.symbol):
+            with metrics.span("bootstrap"):
+                return task()
+
+    def spec_failed(self, spec: StrategySpec, e: Exception, notify: bool = True):
+        logger.error(traceback.format_exc())
+        self.failed.append(spec)
+        if notify:
+            # Straight to the notifier, AsyncStrategyClient.send_message is a coroutine
+            self.strategy_client.notifier.post(
+                SLACK_CHANNEL,
+                f"General Error: Couldn't start {spec_name(spec)}: {e}. Retrying every {self.report_interval_seconds:g}s",
+            )
+
+    def add_job(self, spec: StrategySpec, generator) -> Job:
+        job = Job(spec=spec, generator=generator, next_run=time.monotonic())
+        self.jobs.append(job)
+        heapq.heappush(self.queue, job)
+        return job
+
+    def register_metrics(self):
+        """
+        The data client's freshness and pool stats on /metrics, read on every scrape
+        """
+        registry = metrics.get_registry()
+
+        def freshness(field: str):
+            return lambda: {
+                (("source", source), ("symbol", symbol)): float(values[field])
+                for (symbol, source), values in self.data_client.freshness.metrics().items()
+            }
+
+        registry.collected("data_freshness_age_seconds", "Age of the newest data point by symbol and source", "gauge", freshness("age_seconds"))
+        registry.collected("data_freshness_max_age_seconds", "Age at which a source counts as stale", "gauge", freshness("max_age_seconds"))
+        registry.collected("data_freshness_stale", "1 if the source is stale", "gauge", freshness("stale"))
+
+        def pool(field: str):
+            return lambda: {
+                (("system", name),): float(stats[field])
+                for name, stats in self.data_client.pool_stats().items()
+                if field in stats
+            }
+
+        for field, kind, help in [
+            ("size", "gauge", "Connections kept open by the pool"),
+            ("checked_out", "gauge", "Connections in use"),
+            ("overflow", "gauge", "Connections open beyond the pool size"),
+            ("checkouts", "counter", "Connection checkouts"),
+            ("connects", "counter", "New DB connections opened"),
+            ("invalidations", "counter", "Connections dropped after an error"),
+            ("wait_seconds_total", "counter", "Time spent waiting for a connection"),
+            ("wait_seconds_max", "gauge", "Longest wait for a connection"),
+        ]:
+            registry.collected(f"db_pool_{field}", f"{help}, by system", kind, pool(field))
+
+    def start(self):
+        self.register_metrics()
+        problems = self.data_client.check_source_tables(sorted({spec.symbol for spec in self.specs}))
+        if problems:
+            self.strategy_client.notifier.post(SLACK_CHANNEL, "Scheduler: " + "\n".join(problems))
+        for spec, generator in self.build_generators(self.specs):
+            self.add_job(spec, generator)
+        self.next_report = time.monotonic() + self.report_interval_seconds
+        logger.info(f"Scheduler started with {len(self.jobs)} generators, {len(self.failed)} failed")
+
+    def retry_failed(self) -> typing.List[Job]:
+        """
+        Try building the generators that failed again, returns the new jobs. Only
+        the first failure of each is posted to Slack
+        """
+        if not self.failed:
+            return []
+        specs, self.failed = self.failed, []
+        return [
+            self.add_job(spec, generator)
+            for spec, generator in self.build_generators(specs, notify=False)
+        ]
+
+    def run_job(self, job: Job, now: float, due: float = None):
+        """
+        due is when the job should have run, by default its slot on the grid.
+        Jobs woken by a notification are passed the time it arrived and keep their grid
+        """
+        scheduled = due is None
+        lateness = now - (job.next_run if scheduled else due)
+        try:
+            with metrics.labels(strategy=job.name, symbol=job.spec.symbol), metrics.span("tick"):
+                job.generator.generate_signal()
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            self.strategy_client.send_message(
+                "General Error", self.job_failed(job, e), SLACK_CHANNEL
+            )
+        self.job_finished(job, now, lateness, scheduled)
+
+    def job_failed(self, job: Job, e: Exception) -> str:
+        job.stats.errors += 1
+        logger.error(traceback.format_exc())
+        return f"Error in {job.name}: {e}"
+
+    def job_finished(self, job: Job, now: float, lateness: float, scheduled: bool):
+        """
+        Record the tick and move the job to its next slot on the grid
+        """
+        duration = time.monotonic() - now
+        job.stats.record(duration, lateness)
+
+        interval = job.spec.interval_seconds
+        if duration > interval:
+            logger.warning(
+                f"{job.name} tick took {duration:.3f}s, longer than its {interval}s interval"
+            )
+
+        if not scheduled:
+            return
+
+        job.next_run += interval
+        finished = time.monotonic()
+        if job.next_run < finished:
+            missed = int((finished - job.next_run) // interval) + 1
+            job.next_run += missed * interval
+            job.stats.skipped += missed
+            logger.warning(
+                f"{job.name} is {lateness:.3f}s behind, skipped {missed} tick(s)"
+            )
+
+    def prefetch(self, jobs: typing.List[Job]):
+        """
+        Fetch the data for every due generator in bulk, so the number of queries per
+        tick doesn't grow with the number of symbols
+        """
+        candles = []
+        bars_db = []
+        for job in jobs:
+            if not hasattr(job.generator, "data_requirements"):
+                continue
+            try:
+                requirements = job.generator.data_requirements()
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                continue
+            candles.extend(requirements.get("candles", []))
+            bars_db.extend(requirements.get("bars_db", []))
+
+        self.data_client.prefetch_candles(candles)
+        self.data_client.prefetch_bars_db(bars_db)
+
+    def run_batch(self, jobs: typing.List[Job], due: float = None):
+        with metrics.span("prefetch"):
+            self.prefetch(jobs)
+        try:
+            for job in jobs:
+                self.run_job(job, time.monotonic(), due=due)
+        finally:
+            self.data_client.clear_prefetch()
+
+    def run_pending(self) -> float:
+        """
+        Run every job that is due and return the time the next one is due
+        """
+        while self.queue and self.queue[0].next_run <= time.monotonic():
+            due = []
+            while self.queue and self.queue[0].next_run <= time.monotonic():
+                due.append(heapq.heappop(self.queue))
+
+            try:
+                self.run_batch(due)
+            finally:
+                for job in due:
+                    heapq.heappush(self.queue, job)
+
+        if time.monotonic() >= self.next_report:
+            self.report()
+            self.retry_failed()
+            self.next_report += self.report_interval_seconds
+
+        if not self.queue:
+            return self.next_report
+        return min(self.queue[0].next_run, self.next_report)
+
+    def report(self):
+        for name, stats in self.data_client.pool_stats().items():
+            logger.info(
+                f"DB pool {name} | size {stats.get('size')} checked out {stats.get('checked_out')} overflow {stats.get('overflow')} | "
+                f"checkouts {stats['checkouts']} connects {stats['connects']} invalidations {stats['invalidations']} | "
+                f"wait mean {stats['wait_seconds_mean'] * 1000:.2f}ms max {stats['wait_seconds_max'] * 1000:.2f}ms"
+            )
+        for (symbol, source), freshness in self.data_client.freshness.metrics().items():
+            logger.info(
+                f"Freshness {symbol} {source} | latest {freshness['latest']} age {freshness['age_seconds']:.0f}s "
+                f"max {freshness['max_age_seconds']:.0f}s stale {freshness['stale']}"
+            )
+        for url, endpoint in get_dispatcher().endpoint_stats().items():
+            logger.info(
+                f"Endpoint {url} | sent {endpoint.sent} errors {endpoint.errors} | "
+                f"latency last {endpoint.last_latency * 1000:.1f}ms mean {endpoint.mean_latency * 1000:.1f}ms "
+                f"max {endpoint.max_latency * 1000:.1f}ms"
+            )
+        for job in self.jobs:
+            s = job.stats
+            logger.info(
+                f"{job.name} | ticks {s.ticks} errors {s.errors} skipped {s.skipped} | "
+                f"duration last {s.last_duration:.3f}s mean {s.mean_duration:.3f}s max {s.max_duration:.3f}s | "
+                f"lateness last {s.last_lateness:.3f}s max {s.max_lateness:.3f}s"
+            )
+
+    def run_notified(self, events: typing.Set[typing.Tuple[str, str, str]], received: float):
+        """
+        Run the generators subscribed to any of the notifications that just arrived
+        """
+        woken = []
+        for job in self.jobs:
+            if not hasattr(job.generator, "data_subscriptions"):
+                continue
+            if job.generator.data_subscriptions() & events:
+                woken.append(job)
+
+        if woken:
+            self.run_batch(woken, due=received)
+
+    def wait(self, until: float):
+        timeout = max(0.0, until - time.monotonic())
+        if self.listener is None:
+            time.sleep(timeout)
+            return
+
+        events = self.listener.wait(timeout)
+        if events:
+            self.run_notified(events, time.monotonic())
+        elif self.listener.connection is None:
+            # Listener is down, poll on the normal cadence until it reconnects
+            time.sleep(max(0.0, until - time.monotonic()))
+
+    def run_forever(self):
+        if not self.jobs:
+            self.start()
+
+        try:
+            while True:
+                try:
+                    next_run = self.run_pending()
+                    self.wait(next_run)
+                except KeyboardInterrupt:
+                    print("Exiting loop due to user interruption.")
+                    break
+        finally:
+            # Messages still queued on the notifier thread die with the process
+            get_notifier().flush()
+
+
+class AsyncScheduler(Scheduler):
+    """
+    Scheduler that runs every generator as its own task on one event loop, over an
+    AsyncDataClient and AsyncStrategyClient. A generator waiting on the DB, a
+    trading endpoint or Slack doesn't hold up the others.
+
+    Generators are still built (and their history loaded) synchronously at start.
+    """
+
+    def __init__(
+        self,
+        systems: typing.List[System],
+        specs: typing.List[StrategySpec],
+        data_client=None,
+        strategy_client=None,
+        report_interval_seconds: float = 300,
+    ):
+        # Imported here so the sync path doesn't need asyncpg installed
+        from strategy_clients.async_clients import AsyncDataClient, AsyncStrategyClient
+
+        super().__init__(
+            systems=systems,
+            specs=specs,
+            data_client=data_client or AsyncDataClient(systems=systems),
+            strategy_client=strategy_client or AsyncStrategyClient(systems=systems),
+            report_interval_seconds=report_interval_seconds,
+        )
+        # Loops of the generators recovered by retry_failed, the event loop only keeps weak references
+        self.tasks: typing.Set[asyncio.Task] = set()
+
+    async def arun_job(self, job: Job):
+        now = time.monotonic()
+        lateness = now - job.next_run
+        try:
+            with metrics.labels(strategy=job.name, symbol=job.spec.symbol), metrics.span("tick"):
+                await job.generator.agenerate_signal(self.data_client, self.strategy_client)
+        except Exception as e:
+            await self.strategy_client.send_message(
+                "General Error", self.job_failed(job, e), SLACK_CHANNEL
+            )
+        self.job_finished(job, now, lateness, scheduled=True)
+
+    async def job_loop(self, job: Job):
+        while True:
+            await asyncio.sleep(max(0.0, job.next_run - time.monotonic()))
+            await self.arun_job(job)
+
+    async def report_loop(self):
+        while True:
+            await asyncio.sleep(max(0.0, self.next_report - time.monotonic()))
+            self.report()
+            # Loading history is blocking, the other generators keep running meanwhile
+            for job in await asyncio.to_thread(self.retry_failed):
+                task = asyncio.create_task(self.job_loop(job))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            self.next_report += self.report_interval_seconds
+
+    async def arun(self):
+        if not self.jobs:
+            self.start()
+
+        try:
+            await asyncio.gather(
+                self.report_loop(), *[self.job_loop(job) for job in self.jobs]
+            )
+        finally:
+            await self.data_client.aclose()
+
+    def run_forever(self):
+        try:
+            asyncio.run(self.arun())
+        except KeyboardInterrupt:
+            print("Exiting loop due to user interruption.")
+        finally:
+            get_notifier().flush()
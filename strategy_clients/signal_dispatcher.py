@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+import traceback
+import typing
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from strategy_clients.metrics import get_registry
+from strategy_clients.models import System
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EndpointStats:
+    sent: int = 0
+    errors: int = 0
+    last_latency: float = 0.0
+    max_latency: float = 0.0
+    total_latency: float = 0.0
+
+    def record(self, latency: float, ok: bool):
+        self.sent += 1
+        if not ok:
+            self.errors += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.sent if self.sent else 0.0
+
+
+class SignalDispatcher:
+    """
+    Sends signal payloads to trading systems over one pooled keep-alive session,
+    in parallel when a signal goes to several systems.
+
+    Retries are bounded and only cover failures where the trading system can't
+    have acted on the signal: failing to connect, or a 503 (not accepting
+    requests). A read timeout, 502 or 504 is not retried, the POST may have gone
+    through before the gateway gave up and a second one could double a trade.
+    """
+
+    def __init__(
+        self,
+        timeout_seconds: float = 5,
+        retries: int = 2,
+        backoff_factor: float = 0.2,
+        max_workers: int = 8,
+    ):
+        self.timeout_seconds = timeout_seconds
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            status_forcelist=(503,),
+            allowed_methods=None,  # POST included, see above for which failures
+            backoff_factor=backoff_factor,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="signal-dispatch"
+        )
+        self.stats: typing.Dict[str, EndpointStats] = {}
+        self.lock = threading.Lock()
+
+    def record(self, url: str, latency: float, ok: bool):
+        with self.lock:
+            self.stats.setdefault(url, EndpointStats()).record(latency, ok)
+
+    def endpoint_stats(self) -> typing.Dict[str, EndpointStats]:
+        """Copy of the stats per trading_url"""
+        with self.lock:
+            return {url: dataclasses.replace(stats) for url, stats in self.stats.items()}
+
+    def register_metrics(self):
+        """
+        Endpoint stats on /metrics, read from this dispatcher on every scrape
+        """
+        registry = get_registry()
+        for name, kind, help, value in [
+            ("signal_endpoint_sent_total", "counter", "Signals sent per trading endpoint", lambda s: s.sent),
+            ("signal_endpoint_errors_total", "counter", "Signals that failed per trading endpoint", lambda s: s.errors),
+            ("signal_endpoint_latency_seconds_sum", "counter", "Total send latency per trading endpoint", lambda s: s.total_latency),
+            ("signal_endpoint_latency_seconds_max", "gauge", "Slowest send per trading endpoint", lambda s: s.max_latency),
+            ("signal_endpoint_latency_seconds_last", "gauge", "Latest send per trading endpoint", lambda s: s.last_latency),
+        ]:
+            registry.collected(
+                name,
+                help,
+                kind,
+                lambda value=value: {
+                    (("endpoint", url),): value(stats) for url, stats in self.endpoint_stats().items()
+                },
+            )
+
+    def send(self, system: System, payload: dict) -> typing.Optional[requests.Response]:
+        url = system.trading_url
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.session.post(url, json=payload, timeout=self.timeout_seconds)
+            return response
+        except Exception as e:
+            logger.error(f"Signal to {system.name} failed")
+            logger.error(traceback.format_exc())
+        finally:
+            latency = time.perf_counter() - start
+            ok = response is not None and response.ok
+            self.record(url, latency, ok)
+            logger.info(f"Signal to {system.name} took {latency * 1000:.1f}ms ok={ok}")
+
+    def send_all(
+        self, systems: typing.List[System], payloads: typing.List[dict]
+    ) -> typing.Dict[str, typing.Optional[requests.Response]]:
+        """
+        Send payloads[i] to systems[i], all at once. Returns {system name: response}
+        """
+        if len(systems) == 1:
+            return {systems[0].name: self.send(systems[0], payloads[0])}
+
+        futures = {
+            system.name: self.executor.submit(self.send, system, payload)
+            for system, payload in zip(systems, payloads)
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> SignalDispatcher:
+    """
+    One dispatcher per process, so every generator shares the same connection pool
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = SignalDispatcher()
+            _dispatcher.register_metrics()
+        return _dispatcher
@@ -0,0 +1,165 @@
+import logging
+import queue
+import threading
+import time
+import traceback
+import typing
+
+import slack_sdk
+from slack_sdk.errors import SlackApiError
+
+from config import SLACK_TOKEN
+
+logger = logging.getLogger(__name__)
+
+
+class SlackNotifier:
+    """
+    Posts Slack messages from a background thread so signal generation never
+    waits on Slack.
+
+    Channel IDs are looked up (and the channel joined) once and cached. Messages
+    that arrive within batch_window_seconds of each other are merged into one
+    post per channel. On a 429 the worker sleeps for Retry-After and tries the
+    same call again. If the channel can't be resolved the message is posted by
+    channel name, and the lookup isn't tried again for miss_ttl_seconds, so a
+    misspelled or archived channel doesn't page through conversations_list on
+    every batch.
+    """
+
+    def __init__(
+        self,
+        token: str = SLACK_TOKEN,
+        batch_window_seconds: float = 1.0,
+        max_batch: int = 20,
+        max_attempts: int = 5,
+        miss_ttl_seconds: float = 600,
+    ):
+        self.slack_client = slack_sdk.WebClient(token=token)
+        self.batch_window_seconds = batch_window_seconds
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.queue = queue.Queue()
+        self.miss_ttl_seconds = miss_ttl_seconds
+        self.channel_ids: typing.Dict[str, str] = {}
+        # Channels that couldn't be resolved, until when not to look them up again
+        self.misses: typing.Dict[str, float] = {}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def post(self, channel: str, text: str):
+        """
+        Queue a message, returns straight away
+        """
+        self.start()
+        self.queue.put((channel, text))
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="slack-notifier", daemon=True
+                )
+                self.thread.start()
+
+    def flush(self, timeout: float = 10):
+        """
+        Wait for everything queued so far to be posted, e.g. before exiting
+        """
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_window_seconds
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(
+                        self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+
+            try:
+                by_channel: typing.Dict[str, typing.List[str]] = {}
+                for channel, text in batch:
+                    by_channel.setdefault(channel, []).append(text)
+                for channel, texts in by_channel.items():
+                    self.send(channel, "\n".join(texts))
+            except Exception as e:
+                logger.error(traceback.format_exc())
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def call(self, method: str, **kwargs):
+        """
+        Slack API call that sleeps for Retry-After and tries again on a 429, at most
+        max_attempts times. Other errors are raised
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                return getattr(self.slack_client, method)(**kwargs)
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt == self.max_attempts - 1:
+                    raise
+                retry_after = int(e.response.headers.get("Retry-After", 1))
+                logger.warning(f"Slack rate limited on {method}, retrying in {retry_after}s")
+                time.sleep(retry_after)
+
+    def send(self, channel: str, text: str):
+        # Slack also takes the channel name, the ID only saves it a lookup
+        channel_id = self.resolve_channel(channel) or channel
+        try:
+            self.call("chat_postMessage", channel=channel_id, text=text)
+        except Exception as e:
+            logger.error(f"Failed posting to {channel}")
+            logger.error(traceback.format_exc())
+
+    def resolve_channel(self, channel: str) -> typing.Optional[str]:
+        if channel in self.channel_ids:
+            return self.channel_ids[channel]
+        if time.monotonic() < self.misses.get(channel, 0.0):
+            return None
+
+        try:
+            cursor = None
+            while True:
+                res = self.call(
+                    "conversations_list", types="public_channel", cursor=cursor, limit=1000
+                )
+                dd = [x for x in res["channels"] if x["name"] == channel]
+                if dd:
+                    break
+                cursor = res.get("response_metadata", {}).get("next_cursor")
+                if not cursor:
+                    logger.error(f"Channel {channel} does not exist.")
+                    self.misses[channel] = time.monotonic() + self.miss_ttl_seconds
+                    return None
+
+            channel_id = dd[0]["id"]
+            self.call("conversations_join", channel=channel_id)
+            self.channel_ids[channel] = channel_id
+            return channel_id
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            self.misses[channel] = time.monotonic() + self.miss_ttl_seconds
+            return None
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier() -> SlackNotifier:
+    """
+    One notifier per process, so the channel lookup and the batching are shared
+    by every generator
+    """
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = SlackNotifier()
+        return _notifier
@@ -4,13 +4,13 @@ import typing
 import uuid
 from collections import defaultdict
 
-import requests
-import slack_sdk
-from config import SLACK_TOKEN
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from strategy_clients.data_client import DataBaseClient
+from strategy_clients.metrics import timed
 from strategy_clients.models import System
+from strategy_clients.signal_dispatcher import get_dispatcher
+from strategy_clients.slack_notifier import get_notifier
 # from trading_app_helpers.crud import crud_get_alloc
 
 
@@ -37,12 +37,30 @@ class YosemiteSignalSchema(BaseModel):
 logger = logging.getLogger(__name__)
 
 
+def signal_payload(
+    strategy_name: str, trade_type: str, perc_equity: float = None
+) -> dict:
+    signal = YosemiteSignalSchema(
+        strategy=strategy_name,
+        type=trade_type,
+        slippage=0.1,
+        interval=str(uuid.uuid4()),  # not sure if this is needed
+        perc_equity=perc_equity,
+        ignore_two_min_interval=True,
+    )
+
+    return signal.dict(exclude_none=True)
+
+
 class StrategyClient(DataBaseClient):
     def __init__(self, systems: dict):
         super().__init__(systems=systems)
         self.systems = systems
-        self.slack_client = slack_sdk.WebClient(token=SLACK_TOKEN)
+        self.notifier = get_notifier()
+        self.slack_client = self.notifier.slack_client
+        self.dispatcher = get_dispatcher()
 
+    @timed()
     def send_signal(
         self,
         system: System,
@@ -53,24 +71,34 @@ class StrategyClient(DataBaseClient):
         """
         trade_type will be Entry Long, Entry Short, Exit Position
         """
-
-        url = system.trading_url
         try:
-            signal = YosemiteSignalSchema(
-                strategy=strategy_name,
-                type=trade_type,
-                slippage=0.1,
-                interval=str(uuid.uuid4()),  # not sure if this is needed
-                perc_equity=perc_equity,
-                ignore_two_min_interval=True,
-            )
-
-            signal_dict = signal.dict(exclude_none=True)
-            response = requests.post(url, json=signal_dict)
+            signal_dict = signal_payload(strategy_name, trade_type, perc_equity)
+            response = self.dispatcher.send(system, signal_dict)
             return response
         except:
             logger.error(traceback.format_exc())
 
+    @timed()
+    def send_signals(
+        self,
+        systems: typing.List[System],
+        strategy_name: str,
+        trade_type: str,
+        perc_equity: float = None,
+    ):
+        """
+        send_signal to every system in parallel, so the last system doesn't wait on the
+        ones before it
+        """
+        try:
+            payloads = [
+                signal_payload(strategy_name, trade_type, perc_equity) for _ in systems
+            ]
+            return self.dispatcher.send_all(systems, payloads)
+        except:
+            logger.error(traceback.format_exc())
+
+    @timed()
     def send_message(
         self,
         strategy: str,
@@ -80,23 +108,12 @@ class StrategyClient(DataBaseClient):
         """
         :innocent_cat:
         :grimacing_cat:
+
+        Queued on the process wide SlackNotifier, this doesn't wait for Slack
         """
-        internal_channel = channel
         msg = strategy + ": " + msg
         try:
-            res = self.slack_client.conversations_list(types="public_channel")
-            channels = res["channels"]
-            dd = [x for x in channels if x["name"] == internal_channel]
-            if len(dd) == 0:
-                logger.error(f"Channel {internal_channel} does not exist.")
-                return
-
-            channel_id = dd[0]["id"]
-            res = self.slack_client.conversations_join(channel=channel_id)
-        except Exception as e:
-            logger.error(traceback.format_exc())
-        try:
-            self.slack_client.chat_postMessage(channel=internal_channel, text=msg)
+            self.notifier.post(channel, msg)
         except Exception as e:
             logger.error(traceback.format_exc())
 
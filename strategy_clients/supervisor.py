@@ -0,0 +1,426 @@
+import dataclasses
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import traceback
+import typing
+
+from config import MARKET_DATA_BUS, SLACK_CHANNEL
+from strategy_clients.models import StrategySpec, System
+from strategy_clients.scheduler import Scheduler, spec_name
+from strategy_clients.slack_notifier import get_notifier
+
+logger = logging.getLogger(__name__)
+
+
+def shard(
+    specs: typing.List[StrategySpec],
+    workers: int,
+    weights: typing.Dict[str, float] = None,
+) -> typing.List[typing.List[StrategySpec]]:
+    """
+    Split specs across workers so each gets about the same load. Heaviest first onto
+    the least loaded worker. weights is the load per spec_name, e.g. the share of
+    its interval a tick takes, unknown specs count as the mean of the known ones (1
+    if none are known)
+    """
+    weights = weights or {}
+    default = sum(weights.values()) / len(weights) if weights else 1.0
+    shards = [[] for _ in range(workers)]
+    loads = [0.0] * workers
+    for spec in sorted(specs, key=lambda s: weights.get(spec_name(s), default), reverse=True):
+        i = loads.index(min(loads))
+        shards[i].append(spec)
+        loads[i] += weights.get(spec_name(spec), default)
+    return shards
+
+
+class WorkerScheduler(Scheduler):
+    """
+    Scheduler run by a supervisor worker. Every stats interval it puts the tick
+    stats of its jobs on the supervisor's queue, between batches, so a worker stuck
+    in a tick goes quiet. Reports and retries of failed generators keep the report
+    interval
+    """
+
+    def __init__(
+        self,
+        worker_id: int,
+        stats_queue,
+        stats_interval_seconds: float = 30,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.worker_id = worker_id
+        self.stats_queue = stats_queue
+        self.stats_interval_seconds = stats_interval_seconds
+        self.next_stats = None
+
+    def health(self) -> dict:
+        jobs = {}
+        for job in self.jobs:
+            stats = dataclasses.asdict(job.stats)
+            stats["mean_duration"] = job.stats.mean_duration
+            stats["interval_seconds"] = job.spec.interval_seconds
+            jobs[job.name] = stats
+        return {
+            "worker": self.worker_id,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "jobs": jobs,
+            "failed": [spec_name(spec) for spec in self.failed],
+        }
+
+    def send_stats(self):
+        try:
+            self.stats_queue.put_nowait(self.health())
+        except Exception as e:
+            logger.error(traceback.format_exc())
+
+    def start(self):
+        super().start()
+        self.send_stats()
+        self.next_stats = time.monotonic() + self.stats_interval_seconds
+
+    def run_pending(self) -> float:
+        next_run = super().run_pending()
+        if time.monotonic() >= self.next_stats:
+            self.send_stats()
+            self.next_stats += self.stats_interval_seconds
+        return min(next_run, self.next_stats)
+
+
+def raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_worker(
+    worker_id: int,
+    systems: typing.List[System],
+    specs: typing.List[StrategySpec],
+    stats_queue,
+    stats_interval_seconds: float,
+    metrics_port: int = 0,
+    notifications_url: str = None,
+):
+    """
+    Worker process entry point. Engines, the Slack notifier, HTTP sessions, the
+    notification listener and the metrics server are all created here, after the
+    process started, nothing with a connection or a thread is inherited from the
+    supervisor
+    """
+    # stop_worker terminates workers, exit through the scheduler's shutdown so it
+    # flushes the Slack messages still queued
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.INFO, format="%(processName)s - %(name)s - %(levelname)s - %(message)s"
+        )
+    if metrics_port:
+        from strategy_clients.metrics import start_http_server
+
+        start_http_server(metrics_port)
+
+    clients = {}
+    if MARKET_DATA_BUS:
+        from strategy_clients.market_data_bus import BusDataClient, BusListener
+
+        data_client = BusDataClient(systems=systems)
+        clients = {"data_client": data_client, "listener": BusListener(data_client)}
+    elif notifications_url:
+        from strategy_clients.notify_listener import DataNotificationListener
+
+        # One LISTEN connection per worker, it wakes only this worker's generators
+        clients = {"listener": DataNotificationListener(notifications_url)}
+
+    scheduler = WorkerScheduler(
+        worker_id=worker_id,
+        stats_queue=stats_queue,
+        systems=systems,
+        specs=specs,
+        stats_interval_seconds=stats_interval_seconds,
+        **clients,
+    )
+    scheduler.run_forever()
+
+
+@dataclasses.dataclass
+class WorkerState:
+    specs: typing.List[StrategySpec]
+    process: typing.Any = None
+    # Stats from the process, a new one per process so a killed worker can't leave it half written
+    stats_queue: typing.Any = None
+    started: float = 0.0
+    restarts: int = 0
+    restart_delay: float = 0.0
+    restart_at: float = None
+    # Latest WorkerScheduler.health() of the running process, and the one before
+    health: dict = None
+    previous: dict = None
+
+
+class Supervisor:
+    """
+    Runs the specs in `workers` processes, each a Scheduler over its own shard, so
+    the pandas work of the generators isn't all on one core.
+
+    Workers that die are restarted, after restart_delay_seconds doubling up to
+    max_restart_delay_seconds while they keep dying within min_uptime_seconds.
+    Each worker sends its tick stats every stats_interval_seconds. One that sent
+    none for hang_intervals stats intervals (startup_timeout_seconds after it
+    started, while it loads history) is hung, it is killed and restarted the same
+    way. A worker is behind when it skipped ticks since its last stats or its ticks
+    take more than max_utilization of the time available (sum of mean duration /
+    interval). Then, at most every rebalance_interval_seconds, the specs are
+    resharded by their measured load and the workers whose shard changed are
+    restarted.
+
+    With notifications_url (DATA_NOTIFICATIONS) every worker listens for insert
+    notifications on that DB, see notify_listener. Workers always run the sync
+    Scheduler, main.py rejects ASYNC_MODE with SUPERVISOR_WORKERS.
+
+    Processes are started with "spawn" by default, so no DB connection, thread or
+    socket of the supervisor ends up shared with a worker
+    """
+
+    def __init__(
+        self,
+        systems: typing.List[System],
+        specs: typing.List[StrategySpec],
+        workers: int,
+        stats_interval_seconds: float = 30,
+        rebalance_interval_seconds: float = 600,
+        max_utilization: float = 0.8,
+        restart_delay_seconds: float = 1,
+        max_restart_delay_seconds: float = 300,
+        min_uptime_seconds: float = 60,
+        hang_intervals: float = 5,
+        startup_timeout_seconds: float = 600,
+        metrics_port: int = 0,
+        notifications_url: str = None,
+        start_method: str = "spawn",
+    ):
+        self.systems = systems
+        self.specs = specs
+        self.workers = min(workers, len(specs)) or 1
+        self.stats_interval_seconds = stats_interval_seconds
+        self.rebalance_interval_seconds = rebalance_interval_seconds
+        self.max_utilization = max_utilization
+        self.restart_delay_seconds = restart_delay_seconds
+        self.max_restart_delay_seconds = max_restart_delay_seconds
+        self.min_uptime_seconds = min_uptime_seconds
+        self.hang_intervals = hang_intervals
+        self.startup_timeout_seconds = startup_timeout_seconds
+        self.metrics_port = metrics_port
+        self.notifications_url = notifications_url
+        self.context = multiprocessing.get_context(start_method)
+        self.states: typing.List[WorkerState] = []
+        self.last_rebalance = time.monotonic()
+        # Share of its interval each spec's tick takes, by spec_name, from the latest stats
+        self.load: typing.Dict[str, float] = {}
+
+    def notify(self, msg: str):
+        logger.error(msg)
+        try:
+            get_notifier().post(SLACK_CHANNEL, f"Supervisor: {msg}")
+        except Exception as e:
+            logger.error(traceback.format_exc())
+
+    def start(self):
+        self.states = [WorkerState(specs=specs) for specs in shard(self.specs, self.workers)]
+        for i in range(len(self.states)):
+            self.start_worker(i)
+        logger.info(f"Supervisor started {len(self.specs)} generators on {len(self.states)} workers")
+
+    def start_worker(self, i: int):
+        state = self.states[i]
+        state.stats_queue = self.context.Queue()
+        state.process = self.context.Process(
+            target=run_worker,
+            args=(
+                i,
+                self.systems,
+                state.specs,
+                state.stats_queue,
+                self.stats_interval_seconds,
+                self.metrics_port + 1 + i if self.metrics_port else 0,
+                self.notifications_url,
+            ),
+            name=f"signal-worker-{i}",
+            daemon=True,
+        )
+        state.process.start()
+        state.started = time.monotonic()
+        state.restart_at = None
+        state.health = state.previous = None
+        logger.info(
+            f"Worker {i} (pid {state.process.pid}) started with {len(state.specs)} generators: "
+            + ", ".join(spec_name(spec) for spec in state.specs)
+        )
+
+    def stop_worker(self, i: int, timeout: float = 10):
+        process = self.states[i].process
+        if process is None:
+            return
+        process.terminate()
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        self.states[i].process = None
+        self.states[i].stats_queue = None
+
+    def collect(self):
+        """
+        Take in every stats message the workers sent since the last call
+        """
+        for state in self.states:
+            while state.stats_queue is not None:
+                try:
+                    health = state.stats_queue.get_nowait()
+                except queue.Empty:
+                    break
+                state.previous, state.health = state.health, health
+                for name, stats in health["jobs"].items():
+                    self.load[name] = stats["mean_duration"] / stats["interval_seconds"]
+
+    def is_hung(self, i: int) -> bool:
+        """
+        Alive but no stats for hang_intervals stats intervals, or none at all
+        startup_timeout_seconds after it started
+        """
+        state = self.states[i]
+        if state.health is None:
+            return time.monotonic() - state.started > self.startup_timeout_seconds
+        return time.time() - state.health["time"] > self.hang_intervals * self.stats_interval_seconds
+
+    def schedule_restart(self, i: int, reason: str):
+        state = self.states[i]
+        now = time.monotonic()
+        state.restarts += 1
+        if now - state.started < self.min_uptime_seconds:
+            state.restart_delay = min(
+                max(2 * state.restart_delay, self.restart_delay_seconds),
+                self.max_restart_delay_seconds,
+            )
+        else:
+            state.restart_delay = self.restart_delay_seconds
+        state.restart_at = now + state.restart_delay
+        self.notify(
+            f"Worker {i} {reason} after {now - state.started:.0f}s, "
+            f"restarting in {state.restart_delay:g}s (restart {state.restarts})"
+        )
+
+    def check_workers(self):
+        """
+        Schedule a restart for every worker that died or hung, start the ones that are due
+        """
+        for i, state in enumerate(self.states):
+            if state.process is not None and not state.process.is_alive():
+                exitcode = state.process.exitcode
+                state.process = None
+                self.schedule_restart(i, f"exited with code {exitcode}")
+            elif state.process is not None and self.is_hung(i):
+                if state.health is None:
+                    reason = "never sent stats, killed it"
+                else:
+                    reason = f"sent no stats for {time.time() - state.health['time']:.0f}s, killed it"
+                self.stop_worker(i)
+                self.schedule_restart(i, reason)
+            if state.process is None and state.restart_at is not None and time.monotonic() >= state.restart_at:
+                self.start_worker(i)
+
+    def utilization(self, i: int) -> float:
+        health = self.states[i].health
+        if health is None:
+            return 0.0
+        return sum(
+            stats["mean_duration"] / stats["interval_seconds"] for stats in health["jobs"].values()
+        )
+
+    def is_behind(self, i: int) -> bool:
+        state = self.states[i]
+        if state.health is None:
+            return False
+        if self.utilization(i) > self.max_utilization:
+            return True
+        if state.previous is None:
+            return False
+        return any(
+            stats["skipped"] > state.previous["jobs"].get(name, {}).get("skipped", 0)
+            for name, stats in state.health["jobs"].items()
+        )
+
+    def rebalance(self):
+        """
+        Reshard by measured load and restart the workers whose shard changed
+        """
+        self.last_rebalance = time.monotonic()
+        shards = shard(self.specs, len(self.states), self.load)
+        # Keep each new shard on the worker that already has most of it, fewer restarts
+        shards.sort(key=lambda s: -len(s))
+        assigned = {}
+        for new in shards:
+            names = {spec_name(spec) for spec in new}
+            free = [i for i in range(len(self.states)) if i not in assigned]
+            best = max(
+                free,
+                key=lambda i: len(names & {spec_name(spec) for spec in self.states[i].specs}),
+            )
+            assigned[best] = new
+
+        changed = [
+            i for i, new in assigned.items()
+            if {spec_name(s) for s in new} != {spec_name(s) for s in self.states[i].specs}
+        ]
+        if not changed:
+            logger.warning("Workers are behind but resharding wouldn't change anything, add workers")
+            return
+
+        logger.warning(f"Rebalancing workers {changed}")
+        for i in changed:
+            self.stop_worker(i)
+            self.states[i].specs = assigned[i]
+            self.start_worker(i)
+
+    def report(self):
+        for i, state in enumerate(self.states):
+            pid = state.process.pid if state.process is not None else None
+            failed = len(state.health["failed"]) if state.health else 0
+            logger.info(
+                f"Worker {i} pid {pid} | generators {len(state.specs)} failed {failed} | "
+                f"utilization {self.utilization(i):.2f} behind {self.is_behind(i)} restarts {state.restarts}"
+            )
+
+    def run_forever(self, duration_seconds: float = None):
+        """
+        duration_seconds stops the workers and returns after that long, for test runs
+        """
+        self.start()
+        started = time.monotonic()
+        next_report = started + self.stats_interval_seconds
+        try:
+            while duration_seconds is None or time.monotonic() - started < duration_seconds:
+                time.sleep(1)
+                self.collect()
+                self.check_workers()
+
+                now = time.monotonic()
+                if now >= next_report:
+                    self.report()
+                    next_report += self.stats_interval_seconds
+                    if (
+                        len(self.states) > 1
+                        and now - self.last_rebalance >= self.rebalance_interval_seconds
+                        and any(self.is_behind(i) for i in range(len(self.states)))
+                    ):
+                        self.rebalance()
+        except KeyboardInterrupt:
+            logger.info("Exiting loop due to user interruption.")
+        finally:
+            for i in range(len(self.states)):
+                self.stop_worker(i)
+            get_notifier().flush()
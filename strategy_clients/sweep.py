@@ -0,0 +1,228 @@
+"""
+Big Bend parameter sweep over historical data, one process per core.
+
+    python -m strategy_clients.sweep BTCUSDT 2023-01-01 2024-01-01 --out results.csv
+
+History is pulled from Postgres once and written to .npy files, each worker
+memory-maps them (so the OS shares the pages between processes), builds the
+4h/2h bars once and then runs backtest_bars for its share of the grid.
+"""
+import argparse
+import dataclasses
+import datetime
+import itertools
+import logging
+import os
+import tempfile
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from config import RESEARCH_PG_URI
+from strategy_clients.backtest import (
+    as_utc,
+    backtest_bars,
+    complete_bars,
+    load_candles,
+    load_dollar_bars,
+    utc_timestamp,
+)
+from strategy_clients.models import BigBendParams, System
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRID = {
+    "db_threshold": [90_000_000],
+    "db_ema_window": [30, 50, 80],
+    "db_sma_window": [150, 200, 300],
+    "fast_sma_window": [10, 20, 30],
+    "slow_sma_window": [50, 100],
+    "atr_window": [6, 12],
+    "atr_gate": [0.006, 0.008, 0.01],
+}
+
+CANDLE_ARRAYS = ["close_datetime", "open", "high", "low", "close"]
+DOLLAR_BAR_ARRAYS = ["open_time", "close_time", "duration"]
+POSITIONS = {"Entry Long": 1.0, "Entry Short": -1.0, "Exit Position": 0.0}
+
+
+def param_grid(**values: typing.List[typing.Any]) -> typing.List[BigBendParams]:
+    """
+    Every combination of the given values, e.g. param_grid(atr_gate=[0.006, 0.008]).
+    Fields not given keep their defaults
+    """
+    names = list(values)
+    return [
+        BigBendParams(**dict(zip(names, combination)))
+        for combination in itertools.product(*values.values())
+    ]
+
+
+def export_history(
+    directory: str, candles: DataFrame, dollar_bars: typing.Dict[int, DataFrame]
+):
+    """
+    Write candles and the dollar bars of each threshold as one .npy per column,
+    times as epoch nanoseconds
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {
+        "candles_close_datetime": pd.DatetimeIndex(
+            pd.to_datetime(candles["close_datetime"], utc=True)
+        ).asi8
+    }
+    for name in CANDLE_ARRAYS[1:]:
+        arrays[f"candles_{name}"] = candles[name].to_numpy(dtype=np.float64)
+
+    for threshold, df in dollar_bars.items():
+        df = df.sort_values("open_time")
+        arrays[f"db_{threshold}_open_time"] = as_utc(df["open_time"]).asi8
+        arrays[f"db_{threshold}_close_time"] = as_utc(df["close_time"]).asi8
+        arrays[f"db_{threshold}_duration"] = df["duration"].to_numpy(dtype=np.float64)
+
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), values)
+
+
+# Set in each worker by load_data
+_directory = None
+_bars = None
+_candles = None
+_dollar_bars = {}
+_start = None
+
+
+def load_array(name: str) -> np.ndarray:
+    return np.load(os.path.join(_directory, f"{name}.npy"), mmap_mode="r")
+
+
+def load_data(directory: str, start=None):
+    """
+    Worker initializer, runs once per process
+    """
+    global _directory, _bars, _candles, _start
+    _directory = directory
+    _start = start
+    candles = DataFrame(
+        {
+            "close_datetime": pd.to_datetime(load_array("candles_close_datetime"), utc=True),
+            **{name: load_array(f"candles_{name}") for name in CANDLE_ARRAYS[1:]},
+        }
+    )
+    _candles = (
+        candles["close_datetime"].to_numpy(dtype=np.int64),
+        candles["close"].to_numpy(),
+    )
+    _bars = (complete_bars(candles, 4 * 60), complete_bars(candles, 2 * 60))
+
+
+def dollar_bars(threshold: int) -> DataFrame:
+    if threshold not in _dollar_bars:
+        _dollar_bars[threshold] = DataFrame(
+            {
+                "open_time": pd.to_datetime(load_array(f"db_{threshold}_open_time"), utc=True),
+                "close_time": pd.to_datetime(load_array(f"db_{threshold}_close_time"), utc=True),
+                "duration": load_array(f"db_{threshold}_duration"),
+            }
+        )
+    return _dollar_bars[threshold]
+
+
+def score(events: DataFrame, candle_times: np.ndarray, closes: np.ndarray) -> dict:
+    """
+    Close to close mark of the positions the signals imply (long 1, short -1,
+    flat after an exit), no fees or slippage. Good enough to rank parameters
+    """
+    signals = events[events["event"].isin(list(POSITIONS))]
+    if signals.empty:
+        return {"total_return": 0.0, "max_drawdown": 0.0, "trades": 0, "events": len(events)}
+
+    positions = signals["event"].map(POSITIONS).to_numpy()
+    times = pd.DatetimeIndex(signals["time"]).asi8
+    idx = np.searchsorted(candle_times, times, side="right") - 1
+    prices = np.append(closes[np.maximum(idx, 0)], closes[-1])
+
+    returns = positions * (prices[1:] / prices[:-1] - 1)
+    equity = np.cumprod(1 + returns)
+    drawdown = 1 - equity / np.maximum.accumulate(equity)
+    trades = int(np.count_nonzero(np.diff(np.concatenate([[0.0], positions]))))
+    return {
+        "total_return": float(equity[-1] - 1),
+        "max_drawdown": float(drawdown.max()),
+        "trades": trades,
+        "events": len(events),
+    }
+
+
+def run_params(params: BigBendParams) -> dict:
+    bars_4h, bars_2h = _bars
+    events = backtest_bars(bars_4h, bars_2h, dollar_bars(params.db_threshold), params, _start)
+    return {**dataclasses.asdict(params), **score(events, *_candles)}
+
+
+def sweep(
+    directory: str,
+    grid: typing.List[BigBendParams],
+    start=None,
+    max_workers: int = None,
+) -> DataFrame:
+    """
+    Run every params in grid over the history in directory (see export_history)
+    and rank them by total_return. Pass start so every param set is scored over
+    the same span, otherwise each starts once its own windows are full
+    """
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, len(grid) // (max_workers * 4))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=load_data, initargs=(directory, start)
+    ) as executor:
+        rows = list(executor.map(run_params, grid, chunksize=chunksize))
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Swept {len(grid)} param sets on {max_workers} workers in {elapsed:.1f}s ({len(grid) / elapsed:.1f}/s)"
+    )
+    results = DataFrame(rows).sort_values("total_return", ascending=False)
+    return results.reset_index(drop=True)
+
+
+def main():
+    from strategy_clients.data_client import DataClient
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("symbol")
+    parser.add_argument("start")
+    parser.add_argument("end")
+    parser.add_argument("--warmup-days", type=int, default=60, help="history loaded before start")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--directory", default=None, help="where to keep the .npy files")
+    parser.add_argument("--out", default=None, help="write the ranked results as CSV")
+    args = parser.parse_args()
+
+    grid = param_grid(**DEFAULT_GRID)
+    history_start = utc_timestamp(args.start) - datetime.timedelta(days=args.warmup_days)
+    # Not from main.py, importing it sets up the app's logging and log file
+    data_client = DataClient(systems=[System(name="research", db_url=RESEARCH_PG_URI)])
+    # The candles are the same for every threshold, only the dollar bars differ
+    candles = load_candles(data_client, args.symbol, history_start, args.end)
+    bars_db = {
+        threshold: load_dollar_bars(data_client, args.symbol, history_start, args.end, db_value=threshold)
+        for threshold in DEFAULT_GRID["db_threshold"]
+    }
+
+    directory = args.directory or tempfile.mkdtemp(prefix=f"sweep_{args.symbol}_")
+    export_history(directory, candles, bars_db)
+
+    results = sweep(directory, grid, start=args.start, max_workers=args.workers)
+    print(results.head(20).to_string())
+    if args.out:
+        results.to_csv(args.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
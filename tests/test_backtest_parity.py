@@ -0,0 +1,161 @@
+"""
+backtest() against the live generator replayed tick by tick over the same history,
+through a DataClient that only shows what had closed by the simulated time
+"""
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("sqlalchemy")
+
+import numpy as np
+import pandas as pd
+
+from strategy_clients import big_bend_client
+from strategy_clients.backtest import backtest
+from strategy_clients.big_bend_client import SignalGeneratorBigBend
+from strategy_clients.data_client import DataClient
+from strategy_clients.models import BigBendParams, Notification, System, TradeSignal
+
+SYMBOL = "BTCUSDT"
+START = pd.Timestamp("2024-01-01", tz="UTC")
+# The generator starts with this much history, the rest is replayed
+WARMUP = pd.Timedelta(days=20)
+DAYS = 90
+
+
+def synthetic_candles(rng: np.random.Generator) -> pd.DataFrame:
+    """30m candles trending up and down in turns, so the 4h SMAs cross"""
+    n = DAYS * 48
+    drift = np.repeat(rng.choice([-0.0008, 0.0008], n // 240 + 1), 240)[:n]
+    close = 30000 * np.exp(np.cumsum(drift + rng.normal(0, 0.0015, n)))
+    open_ = np.concatenate([[30000.0], close[:-1]])
+    spread = rng.uniform(0.0005, 0.003, n)
+    return pd.DataFrame(
+        {
+            "symbol": SYMBOL,
+            "close_datetime": pd.date_range(START + pd.Timedelta(minutes=30), periods=n, freq="30min"),
+            "open": open_,
+            "high": np.maximum(open_, close) * (1 + spread / 2),
+            "low": np.minimum(open_, close) * (1 - spread / 2),
+            "close": close,
+        }
+    )
+
+
+def synthetic_dollar_bars(rng: np.random.Generator) -> pd.DataFrame:
+    """Dollar bars (epoch seconds) slow and fast in turns, so EMA50 and SMA200 cross"""
+    durations = []
+    total = 0
+    while total < DAYS * 86400:
+        mean = rng.choice([1200, 6000])
+        for _ in range(int(rng.integers(100, 300))):
+            durations.append(int(rng.exponential(mean)) + 1)
+        total = sum(durations)
+    close_time = START.timestamp() + np.cumsum(durations)
+    keep = close_time <= (START + pd.Timedelta(days=DAYS)).timestamp()
+    close_time = close_time[keep].astype(np.int64)
+    durations = np.asarray(durations)[keep]
+    return pd.DataFrame(
+        {
+            "open_time": close_time - durations,
+            "close_time": close_time,
+            "duration": durations.astype(np.float64),
+        }
+    )
+
+
+class ReplayDataClient(DataClient):
+    """
+    DataClient over in-memory candles and dollar bars, nothing closed after `now`
+    is visible. Data is never stale
+    """
+
+    def __init__(self, candles: pd.DataFrame, dollar_bars: pd.DataFrame):
+        super().__init__(systems=[])
+        self.server_side_bars = False
+        self.candles = candles
+        self.dollar_bars = dollar_bars
+        self.now = None
+
+    def visible_candles(self) -> pd.DataFrame:
+        return self.candles[self.candles["close_datetime"] <= self.now]
+
+    def visible_bars_db(self) -> pd.DataFrame:
+        return self.dollar_bars[self.dollar_bars["close_time"] <= self.now.timestamp()]
+
+    def fetch_latest_candles(self, symbol, kind, limit):
+        return self.visible_candles().iloc[::-1].head(limit).reset_index(drop=True)
+
+    def fetch_candles_since(self, symbol, kind, after):
+        candles = self.visible_candles()
+        return candles[candles["close_datetime"] > after].reset_index(drop=True)
+
+    def get_historical_data_db(self, symbol, db_value, number_of_bars):
+        return self.visible_bars_db().tail(number_of_bars).reset_index(drop=True)
+
+    def fetch_new_bars_db(self, symbol, db_value, last_open_time):
+        bars = self.visible_bars_db()
+        return bars[bars["open_time"] > last_open_time].reset_index(drop=True)
+
+    def check_data_staleness(self, df, db_candle_length):
+        return False
+
+    def is_candle_stale(self, symbol, data_time, db_candle_length):
+        return False
+
+    def check_data_staleness_db(self, symbol):
+        return False
+
+
+def live_events(generator: SignalGeneratorBigBend, data_client: ReplayDataClient, ticks) -> list:
+    """(time, event) for every signal and vol period message generate_signal sent"""
+    events = []
+
+    def record(actions):
+        for action in actions:
+            if isinstance(action, TradeSignal):
+                events.append((data_client.now, action.trade_type))
+            elif isinstance(action, Notification) and action.msg in (
+                "Entering Low Vol Period",
+                "Entering High Vol Period",
+            ):
+                events.append((data_client.now, action.msg))
+
+    generator.dispatch = record
+    for now in ticks:
+        data_client.now = now
+        generator.generate_signal()
+    return events
+
+
+def test_backtest_matches_tick_by_tick_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(big_bend_client, "BAR_CACHE_DIR", "")
+    rng = np.random.default_rng(7)
+    candles = synthetic_candles(rng)
+    dollar_bars = synthetic_dollar_bars(rng)
+    params = BigBendParams()
+
+    data_client = ReplayDataClient(candles, dollar_bars)
+    data_client.now = START + WARMUP
+    systems = [
+        System(name="research", db_url=f"sqlite:///{tmp_path}/research.db"),
+        System(name="trader", db_url=f"sqlite:///{tmp_path}/trader.db", trading_url="http://localhost/signal"),
+    ]
+    generator = SignalGeneratorBigBend(systems, "Big Bend parity", data_client, SYMBOL, params)
+
+    # The generator evaluates when a 4h bar or a dollar bar closes, tick on every one of those
+    end = START + pd.Timedelta(days=DAYS)
+    closes_4h = pd.date_range(START + WARMUP + pd.Timedelta(hours=4), end, freq="4h")
+    closes_db = pd.to_datetime(dollar_bars["close_time"], unit="s", utc=True)
+    closes_db = closes_db[closes_db > START + WARMUP]
+    ticks = sorted(set(closes_4h) | set(closes_db))
+    live = live_events(generator, data_client, ticks)
+
+    # Same dollar bars the generator started from, so both seed the EMA at the same bar
+    first_db = len(dollar_bars[dollar_bars["close_time"] <= (START + WARMUP).timestamp()]) - params.bars_db
+    expected = backtest(candles, dollar_bars.iloc[first_db:], params, start=START + WARMUP)
+    expected = list(zip(expected["time"], expected["event"]))
+
+    assert len(live) > 10, live
+    assert {event for _, event in live} >= {"Entering Low Vol Period", "Exit Position", "Entry Long", "Entry Short"}
+    assert live == expected
@@ -0,0 +1,147 @@
+"""
+A restart starts from the bars the last run cached and only fetches what closed
+since, and keeps the cached bars (flagged stale) when the DB is unreachable
+"""
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("sqlalchemy")
+
+import numpy as np
+import pandas as pd
+
+from strategy_clients import big_bend_client
+from strategy_clients.big_bend_client import SignalGeneratorBigBend
+from strategy_clients.data_client import DataClient
+from strategy_clients.models import BigBendParams, System
+
+SYMBOL = "BTCUSDT"
+END = pd.Timestamp.now(tz="UTC").floor("30min")
+DAYS = 40
+# The first run is this long before the restart
+DOWNTIME = pd.Timedelta(hours=6)
+
+
+def candles(rng: np.random.Generator) -> pd.DataFrame:
+    n = DAYS * 48
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    return pd.DataFrame(
+        {
+            "symbol": SYMBOL,
+            "close_datetime": pd.date_range(end=END, periods=n, freq="30min"),
+            "open": close * 0.999,
+            "high": close * 1.002,
+            "low": close * 0.997,
+            "close": close,
+        }
+    )
+
+
+def dollar_bars(rng: np.random.Generator) -> pd.DataFrame:
+    close_time = END.timestamp() - 600 * np.arange(1000)[::-1]
+    durations = rng.uniform(300, 900, len(close_time))
+    return pd.DataFrame(
+        {
+            "open_time": (close_time - 600).astype(np.int64),
+            "close_time": close_time.astype(np.int64),
+            "duration": durations,
+        }
+    )
+
+
+class RecordingDataClient(DataClient):
+    """
+    In-memory candles and dollar bars up to `now`, records every fetch. With
+    down=True every fetch fails like an unreachable DB
+    """
+
+    def __init__(self, candles: pd.DataFrame, dollar_bars: pd.DataFrame, now: pd.Timestamp, down: bool = False):
+        super().__init__(systems=[])
+        self.server_side_bars = False
+        self.candles = candles[candles["close_datetime"] <= now]
+        self.dollar_bars = dollar_bars[dollar_bars["close_time"] <= now.timestamp()]
+        self.down = down
+        self.calls = []
+
+    def record(self, *call):
+        self.calls.append(call)
+        if self.down:
+            raise ConnectionError("could not connect to server")
+
+    def fetch_latest_candles(self, symbol, kind, limit):
+        self.record("fetch_latest_candles", limit)
+        return self.candles.iloc[::-1].head(limit).reset_index(drop=True)
+
+    def fetch_candles_since(self, symbol, kind, after):
+        self.record("fetch_candles_since", after)
+        return self.candles[self.candles["close_datetime"] > after].reset_index(drop=True)
+
+    def get_historical_data_db(self, symbol, db_value, number_of_bars):
+        self.record("get_historical_data_db", number_of_bars)
+        return self.dollar_bars.tail(number_of_bars).reset_index(drop=True)
+
+    def fetch_new_bars_db(self, symbol, db_value, last_open_time):
+        self.record("fetch_new_bars_db", last_open_time)
+        return self.dollar_bars[self.dollar_bars["open_time"] > last_open_time].reset_index(drop=True)
+
+    def check_data_staleness(self, df, db_candle_length):
+        return False
+
+    def is_candle_stale(self, symbol, data_time, db_candle_length):
+        return False
+
+    def check_data_staleness_db(self, symbol):
+        return False
+
+
+@pytest.fixture
+def generator_for(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "bar_cache")
+    messages = []
+    monkeypatch.setattr(SignalGeneratorBigBend, "send_message", lambda self, strategy, msg, channel: messages.append(msg))
+    systems = [System(name="research", db_url=f"sqlite:///{tmp_path}/research.db")]
+
+    def build(data_client: RecordingDataClient, cache: bool = True) -> SignalGeneratorBigBend:
+        monkeypatch.setattr(big_bend_client, "BAR_CACHE_DIR", cache_dir if cache else "")
+        generator = SignalGeneratorBigBend(systems, "Big Bend cache", data_client, SYMBOL, BigBendParams())
+        if cache:
+            generator.bar_cache.flush()
+        generator.messages = messages
+        return generator
+
+    return build
+
+
+def test_restart_only_backfills_the_gap(generator_for):
+    rng = np.random.default_rng(0)
+    all_candles, all_bars = candles(rng), dollar_bars(rng)
+
+    first_client = RecordingDataClient(all_candles, all_bars, END - DOWNTIME)
+    first = generator_for(first_client)
+    assert {call[0] for call in first_client.calls} == {"fetch_latest_candles", "get_historical_data_db"}
+
+    client = RecordingDataClient(all_candles, all_bars, END)
+    restarted = generator_for(client)
+    assert [call[0] for call in client.calls] == ["fetch_candles_since", "fetch_new_bars_db"]
+    assert client.calls[0][1] == END - DOWNTIME
+    assert client.calls[1][1] == first.bars_db.last("open_time")
+    assert not restarted.stale_data
+
+    # Same bars as a cold start at the same time
+    cold = generator_for(RecordingDataClient(all_candles, all_bars, END), cache=False)
+    pd.testing.assert_frame_equal(restarted.df_4h, cold.df_4h)
+    pd.testing.assert_frame_equal(restarted.df_2h, cold.df_2h)
+    pd.testing.assert_frame_equal(restarted.df_db, cold.df_db)
+
+
+def test_unreachable_db_keeps_the_cached_bars_flagged_stale(generator_for):
+    rng = np.random.default_rng(1)
+    all_candles, all_bars = candles(rng), dollar_bars(rng)
+    first = generator_for(RecordingDataClient(all_candles, all_bars, END - DOWNTIME))
+
+    client = RecordingDataClient(all_candles, all_bars, END, down=True)
+    restarted = generator_for(client)
+    assert restarted.stale_data
+    assert any("stale" in msg for msg in restarted.messages)
+    pd.testing.assert_frame_equal(restarted.df_4h, first.df_4h)
+    pd.testing.assert_frame_equal(restarted.df_db, first.df_db)
@@ -0,0 +1,73 @@
+"""
+The incremental indicators against the pandas expressions they replaced:
+rolling().mean() for SMA and ATR, ewm(adjust=False) for the EMA, seeded on part of
+the series then updated bar by bar, with NaN gaps for the rolling ones
+"""
+import pytest
+
+pytest.importorskip("pandas")
+
+import numpy as np
+import pandas as pd
+
+from strategy_clients.indicators import AverageTrueRange, ExponentialMovingAverage, SimpleMovingAverage
+
+# SimpleMovingAverage docstring: within ~1e-12 relative
+RTOL = 1e-12
+
+
+def series_with_gaps(rng: np.random.Generator, n: int) -> np.ndarray:
+    values = 30000 + np.cumsum(rng.normal(0, 20, n))
+    values[rng.choice(n, 5, replace=False)] = np.nan
+    values[100:103] = np.nan
+    return values
+
+
+@pytest.mark.parametrize("window", [1, 6, 20, 50, 200])
+def test_sma_matches_rolling_mean(window):
+    values = series_with_gaps(np.random.default_rng(window), 1000)
+    expected = pd.Series(values).rolling(window).mean().to_numpy()
+
+    sma = SimpleMovingAverage(window)
+    sma.seed(values[:300])
+    result = [sma.value] + [sma.update(x) for x in values[300:]]
+    np.testing.assert_allclose(result, expected[299:], rtol=RTOL)
+    assert sma.previous == pytest.approx(expected[-2], rel=RTOL, nan_ok=True)
+
+
+def test_atr_matches_rolling_mean():
+    rng = np.random.default_rng(0)
+    close = series_with_gaps(rng, 600)
+    df = pd.DataFrame({"open": close + rng.normal(0, 5, 600), "high": close + 30, "low": close - 30})
+    expected = ((df["high"] - df["low"]) / df["open"]).rolling(6).mean().to_numpy()
+
+    atr = AverageTrueRange(6)
+    atr.seed(df["open"][:51], df["high"][:51], df["low"][:51])
+    result = [atr.value] + [atr.update(o, h, l) for o, h, l in df.to_numpy()[51:]]
+    np.testing.assert_allclose(result, expected[50:], rtol=RTOL)
+
+
+@pytest.mark.parametrize("window", [5, 50])
+def test_ema_matches_ewm(window):
+    durations = np.random.default_rng(window).uniform(300, 900, 1000)
+    expected = pd.Series(durations).ewm(span=window, adjust=False).mean().to_numpy()
+
+    ema = ExponentialMovingAverage(window)
+    ema.seed(durations[:201])
+    result = [ema.value] + [ema.update(x) for x in durations[201:]]
+    np.testing.assert_allclose(result, expected[200:], rtol=RTOL)
+
+
+def test_ema_within_bound_of_ewm_over_held_window():
+    """
+    The generator holds the last 201 bars, pandas over those is seeded at their
+    first bar, the running EMA at the start of the history
+    """
+    durations = np.random.default_rng(1).uniform(300, 900, 2000)
+    ema = ExponentialMovingAverage(50)
+    ema.seed(durations)
+    held = durations[-201:]
+    expected = pd.Series(held).ewm(span=50, adjust=False).mean().iloc[-1]
+    bound = (1 - ema.alpha) ** 200 * (held.max() - held.min())
+    assert abs(ema.value - expected) <= bound
+    assert bound < 4e-4 * (held.max() - held.min())
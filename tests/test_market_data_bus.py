@@ -0,0 +1,90 @@
+"""
+Consumers pick up the segments of a restarted ingest, and specs the bus can't
+serve are rejected at startup
+"""
+import os
+import types
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("sqlalchemy")
+
+import numpy as np
+import pandas as pd
+
+from strategy_clients import market_data_bus
+from strategy_clients.market_data_bus import (
+    BusDataClient,
+    BusListener,
+    SharedBarStore,
+    candle_frame,
+    channels_for,
+    segment_name,
+)
+from strategy_clients.models import BusChannel, StrategySpec
+from strategy_clients.notify_listener import CANDLE_CHANNEL
+
+CHANNEL = BusChannel("BTCUSDT", "30m", 10)
+
+
+def candles(start: str, rows: int) -> pd.DataFrame:
+    close = np.linspace(30000, 30100, rows)
+    return candle_frame(
+        pd.DataFrame(
+            {
+                "close_datetime": pd.date_range(start, periods=rows, freq="30min", tz="UTC"),
+                "open": close,
+                "high": close + 10,
+                "low": close - 10,
+                "close": close,
+            }
+        )
+    )
+
+
+@pytest.fixture
+def prefix(monkeypatch):
+    # Ingest and consumers share this process' resource tracker here, a consumer
+    # unregistering its attachment would drop the ingest's registration too
+    monkeypatch.setattr(market_data_bus, "resource_tracker", types.SimpleNamespace(unregister=lambda name, rtype: None))
+    prefix = f"mdbus_test_{os.getpid()}_"
+    yield prefix
+    name = segment_name(CHANNEL, prefix)
+    if os.path.exists(f"/dev/shm/{name}"):
+        os.unlink(f"/dev/shm/{name}")
+
+
+def test_consumer_reattaches_after_ingest_restart(prefix):
+    name = segment_name(CHANNEL, prefix)
+    ingest = SharedBarStore.from_frame(name, candles("2024-01-01", 10), CHANNEL.capacity, "close_datetime")
+    data_client = BusDataClient(prefix=prefix, check_seconds=0)
+    listener = BusListener(data_client)
+    first = data_client.fetch_latest_candles("BTCUSDT", "30m", 1)
+    assert listener.changed() == set()
+
+    # The ingest restarts: its segment is replaced by one with other history
+    ingest.close()
+    ingest = SharedBarStore.from_frame(name, candles("2024-02-01", 10), CHANNEL.capacity, "close_datetime")
+    try:
+        assert listener.changed() == {(CANDLE_CHANNEL, "BTCUSDT", "30m")}
+        latest = data_client.fetch_latest_candles("BTCUSDT", "30m", 1)
+        assert latest["close_datetime"].iloc[0] > first["close_datetime"].iloc[0]
+        assert data_client.store("BTCUSDT", "30m").generation == ingest.generation
+    finally:
+        ingest.close()
+
+
+def test_consumer_keeps_the_old_segment_while_the_ingest_is_down(prefix):
+    name = segment_name(CHANNEL, prefix)
+    ingest = SharedBarStore.from_frame(name, candles("2024-01-01", 10), CHANNEL.capacity, "close_datetime")
+    data_client = BusDataClient(prefix=prefix, check_seconds=0)
+    first = data_client.fetch_latest_candles("BTCUSDT", "30m", 1)
+    ingest.close()
+    assert data_client.fetch_latest_candles("BTCUSDT", "30m", 1).equals(first)
+
+
+def test_local_dollar_bars_are_rejected():
+    with pytest.raises(ValueError, match="local_dollar_bars"):
+        channels_for([StrategySpec(strategy="big_bend", symbol="BTCUSDT", params={"local_dollar_bars": True})])
+    assert len(channels_for([StrategySpec(strategy="big_bend", symbol="BTCUSDT")])) == 2
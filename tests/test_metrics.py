@@ -0,0 +1,36 @@
+"""
+The scheduler's data client freshness and pool stats on /metrics
+"""
+import time
+import urllib.request
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("sqlalchemy")
+
+from strategy_clients.metrics import start_http_server
+from strategy_clients.models import System
+from strategy_clients.scheduler import Scheduler
+
+
+def test_freshness_and_pool_stats_are_served(tmp_path):
+    systems = [System(name="research", db_url=f"sqlite:///{tmp_path}/research.db")]
+    scheduler = Scheduler(systems=systems, specs=[])
+    scheduler.register_metrics()
+    scheduler.data_client.freshness.observe("BTCUSDT", "candle_30m", time.time() - 60)
+    scheduler.data_client.freshness.observe("BTCUSDT", "source", time.time() - 3600)
+    scheduler.data_client.read("SELECT 1 AS one")
+
+    server = start_http_server(0, "127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+
+    lines = dict(line.rsplit(" ", 1) for line in body.splitlines() if not line.startswith("#"))
+    assert float(lines['data_freshness_age_seconds{source="candle_30m",symbol="BTCUSDT"}']) >= 60
+    assert lines['data_freshness_stale{source="candle_30m",symbol="BTCUSDT"}'] == "0.0"
+    assert lines['data_freshness_stale{source="source",symbol="BTCUSDT"}'] == "1.0"
+    assert float(lines['db_pool_checkouts{system="research"}']) >= 1
@@ -0,0 +1,117 @@
+"""
+SignalDispatcher and the async fan-out against a local HTTP stub: which failures
+are retried, that slow endpoints are sent to in parallel, latency per endpoint
+"""
+import asyncio
+import collections
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from strategy_clients.metrics import get_registry
+from strategy_clients.models import System
+from strategy_clients.signal_dispatcher import SignalDispatcher
+
+SLOW_SECONDS = 0.5
+
+
+class StubTradingEndpoint(BaseHTTPRequestHandler):
+    """/status/<code> answers code, /slow answers 200 after SLOW_SECONDS"""
+
+    hits = collections.Counter()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.lock:
+            self.hits[self.path] += 1
+        if self.path.startswith("/slow"):
+            time.sleep(SLOW_SECONDS)
+            status = 200
+        else:
+            status = int(self.path.rsplit("/", 1)[-1])
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubTradingEndpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def dispatcher():
+    StubTradingEndpoint.hits.clear()
+    dispatcher = SignalDispatcher(retries=2, backoff_factor=0)
+    yield dispatcher
+    dispatcher.close()
+
+
+def system(base_url: str, path: str) -> System:
+    return System(name=path, db_url="sqlite://", trading_url=f"{base_url}{path}")
+
+
+@pytest.mark.parametrize("status", [502, 504])
+def test_gateway_errors_are_not_retried(base_url, dispatcher, status):
+    response = dispatcher.send(system(base_url, f"/status/{status}"), {"type": "Exit Position"})
+    assert response.status_code == status
+    assert StubTradingEndpoint.hits[f"/status/{status}"] == 1
+
+
+def test_503_is_retried_up_to_the_bound(base_url, dispatcher):
+    response = dispatcher.send(system(base_url, "/status/503"), {"type": "Exit Position"})
+    assert response.status_code == 503
+    # The first try and 2 retries
+    assert StubTradingEndpoint.hits["/status/503"] == 3
+    stats = dispatcher.endpoint_stats()[f"{base_url}/status/503"]
+    assert stats.sent == 1 and stats.errors == 1
+
+
+def test_slow_endpoints_are_sent_to_in_parallel(base_url, dispatcher):
+    systems = [system(base_url, f"/slow/{i}") for i in range(3)]
+    started = time.perf_counter()
+    responses = dispatcher.send_all(systems, [{"type": "Exit Position"}] * 3)
+    elapsed = time.perf_counter() - started
+    assert all(response.ok for response in responses.values())
+    assert elapsed < 2 * SLOW_SECONDS
+    for s in systems:
+        assert dispatcher.endpoint_stats()[s.trading_url].last_latency >= SLOW_SECONDS
+
+
+def test_endpoint_stats_on_metrics(base_url, dispatcher):
+    dispatcher.send(system(base_url, "/status/200"), {"type": "Exit Position"})
+    dispatcher.register_metrics()
+    rendered = get_registry().render()
+    assert f'signal_endpoint_sent_total{{endpoint="{base_url}/status/200"}} 1' in rendered
+
+
+def test_async_fan_out_uses_the_dispatcher(base_url, dispatcher):
+    # async_clients needs SQLAlchemy's asyncio extension
+    pytest.importorskip("greenlet")
+    from strategy_clients.async_clients import AsyncStrategyClient
+
+    client = AsyncStrategyClient(systems=[])
+    client.dispatcher = dispatcher
+    systems = [system(base_url, "/status/503"), system(base_url, "/status/502")] + [
+        system(base_url, f"/slow/{i}") for i in range(3)
+    ]
+
+    started = time.perf_counter()
+    responses = asyncio.run(client.send_signals(systems, "Big Bend", "Exit Position"))
+    elapsed = time.perf_counter() - started
+    assert responses["/status/503"].status_code == 503
+    assert StubTradingEndpoint.hits["/status/503"] == 3
+    assert StubTradingEndpoint.hits["/status/502"] == 1
+    assert elapsed < 2 * SLOW_SECONDS
+    assert set(dispatcher.endpoint_stats()) == {s.trading_url for s in systems}
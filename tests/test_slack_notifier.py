@@ -0,0 +1,59 @@
+"""
+SlackNotifier channel lookups, against a fake WebClient
+"""
+import pytest
+
+pytest.importorskip("slack_sdk")
+
+from strategy_clients.slack_notifier import SlackNotifier
+
+
+class FakeWebClient:
+    def __init__(self, channels):
+        self.channels = channels
+        self.calls = []
+
+    def conversations_list(self, **kwargs):
+        self.calls.append("conversations_list")
+        return {"channels": self.channels, "response_metadata": {"next_cursor": ""}}
+
+    def conversations_join(self, channel):
+        self.calls.append("conversations_join")
+
+    def chat_postMessage(self, channel, text):
+        self.calls.append(("chat_postMessage", channel))
+
+
+def notifier_with(channels) -> SlackNotifier:
+    notifier = SlackNotifier(token="xoxb-test")
+    notifier.slack_client = FakeWebClient(channels)
+    return notifier
+
+
+def test_resolved_channel_is_looked_up_once():
+    notifier = notifier_with([{"name": "signals", "id": "C1"}])
+    notifier.send("signals", "one")
+    notifier.send("signals", "two")
+    assert notifier.slack_client.calls == [
+        "conversations_list",
+        "conversations_join",
+        ("chat_postMessage", "C1"),
+        ("chat_postMessage", "C1"),
+    ]
+
+
+def test_missing_channel_is_posted_by_name_and_not_looked_up_again():
+    notifier = notifier_with([])
+    notifier.send("signalz", "one")
+    notifier.send("signalz", "two")
+    assert notifier.slack_client.calls == [
+        "conversations_list",
+        ("chat_postMessage", "signalz"),
+        ("chat_postMessage", "signalz"),
+    ]
+
+    # Looked up again once the miss expires, e.g. the channel was created meanwhile
+    notifier.misses["signalz"] = 0.0
+    notifier.slack_client.channels = [{"name": "signalz", "id": "C2"}]
+    notifier.send("signalz", "three")
+    assert notifier.slack_client.calls[-1] == ("chat_postMessage", "C2")
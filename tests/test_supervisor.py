@@ -0,0 +1,126 @@
+"""
+Supervisor restarts workers that hang, and WorkerScheduler sends stats on its own
+cadence, apart from the report/retry interval
+"""
+import queue
+import time
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("sqlalchemy")
+
+from strategy_clients.data_client import DataClient
+from strategy_clients.models import StrategySpec
+from strategy_clients import supervisor as supervisor_module
+from strategy_clients.supervisor import Supervisor, WorkerScheduler, WorkerState, run_worker
+
+
+class StuckProcess:
+    """Alive until terminated, like a worker stuck in a tick"""
+
+    pid = 1234
+    exitcode = None
+
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive = False
+
+    def kill(self):
+        self.alive = False
+
+    def join(self, timeout=None):
+        pass
+
+
+def supervisor_with(health) -> Supervisor:
+    supervisor = Supervisor(systems=[], specs=[StrategySpec(strategy="big_bend", symbol="BTCUSDT")], workers=1)
+    supervisor.notify = lambda msg: None
+    state = WorkerState(specs=supervisor.specs, process=StuckProcess(), started=time.monotonic() - 3600)
+    state.health = health
+    supervisor.states = [state]
+    return supervisor
+
+
+def test_hung_worker_is_killed_and_restarted():
+    # Last stats an hour ago, well past hang_intervals stats intervals
+    supervisor = supervisor_with({"time": time.time() - 3600, "jobs": {}, "failed": []})
+    process = supervisor.states[0].process
+    supervisor.check_workers()
+    state = supervisor.states[0]
+    assert not process.alive
+    assert state.process is None
+    assert state.restarts == 1
+    assert state.restart_at is not None
+
+
+def test_reporting_worker_is_left_alone():
+    supervisor = supervisor_with({"time": time.time(), "jobs": {}, "failed": []})
+    supervisor.check_workers()
+    assert supervisor.states[0].process.alive
+    assert supervisor.states[0].restarts == 0
+
+
+def test_worker_that_never_reported_gets_the_startup_timeout():
+    supervisor = supervisor_with(None)
+    supervisor.states[0].started = time.monotonic()
+    supervisor.check_workers()
+    assert supervisor.states[0].process.alive
+
+    supervisor.states[0].started = time.monotonic() - supervisor.startup_timeout_seconds - 1
+    supervisor.check_workers()
+    assert supervisor.states[0].process is None
+
+
+def test_worker_stats_have_their_own_interval():
+    stats_queue = queue.Queue()
+    scheduler = WorkerScheduler(
+        worker_id=0,
+        stats_queue=stats_queue,
+        stats_interval_seconds=0.01,
+        systems=[],
+        specs=[],
+        data_client=DataClient(systems=[]),
+    )
+    scheduler.data_client.check_source_tables = lambda symbols: []
+    scheduler.start()
+    retried = []
+    scheduler.retry_failed = lambda: retried.append(True) or []
+
+    for _ in range(3):
+        time.sleep(0.02)
+        scheduler.run_pending()
+    # One at start, one per stats interval, no retries before the 300s report interval
+    assert stats_queue.qsize() == 4
+    assert not retried
+
+
+def test_workers_get_a_notification_listener(monkeypatch):
+    pytest.importorskip("psycopg2")
+    from strategy_clients.notify_listener import DataNotificationListener
+
+    built = {}
+
+    class CapturingScheduler:
+        def __init__(self, **kwargs):
+            built.update(kwargs)
+
+        def run_forever(self):
+            pass
+
+    monkeypatch.setattr(supervisor_module, "WorkerScheduler", CapturingScheduler)
+    monkeypatch.setattr(supervisor_module, "MARKET_DATA_BUS", False)
+    monkeypatch.setattr(supervisor_module.signal, "signal", lambda *args: None)
+
+    run_worker(0, [], [], queue.Queue(), 30, notifications_url="postgresql://localhost/research")
+    assert isinstance(built["listener"], DataNotificationListener)
+    assert built["listener"].db_url == "postgresql://localhost/research"
+
+    built.clear()
+    run_worker(0, [], [], queue.Queue(), 30)
+    assert "listener" not in built
@@ -0,0 +1,68 @@
+"""
+The sweep over memory-mapped history in worker processes gives the same ranked
+results as backtest() run in process on the original frames
+"""
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("sqlalchemy")
+
+import numpy as np
+import pandas as pd
+
+from strategy_clients.backtest import backtest
+from strategy_clients.sweep import export_history, param_grid, score, sweep
+
+START = pd.Timestamp("2024-01-01", tz="UTC")
+DAYS = 120
+THRESHOLD = 90_000_000
+
+
+def synthetic_history(rng: np.random.Generator):
+    n = DAYS * 48
+    drift = np.repeat(rng.choice([-0.0008, 0.0008], n // 240 + 1), 240)[:n]
+    close = 30000 * np.exp(np.cumsum(drift + rng.normal(0, 0.0015, n)))
+    open_ = np.concatenate([[30000.0], close[:-1]])
+    candles = pd.DataFrame(
+        {
+            "close_datetime": pd.date_range(START + pd.Timedelta(minutes=30), periods=n, freq="30min"),
+            "open": open_,
+            "high": np.maximum(open_, close) * 1.001,
+            "low": np.minimum(open_, close) * 0.999,
+            "close": close,
+        }
+    )
+    durations = np.repeat(rng.choice([1200, 6000], DAYS), 60)
+    durations = rng.exponential(durations).astype(np.int64) + 1
+    close_time = START.timestamp() + np.cumsum(durations)
+    keep = close_time <= (START + pd.Timedelta(days=DAYS)).timestamp()
+    dollar_bars = pd.DataFrame(
+        {
+            "open_time": (close_time - durations)[keep].astype(np.int64),
+            "close_time": close_time[keep].astype(np.int64),
+            "duration": durations[keep].astype(np.float64),
+        }
+    )
+    return candles, dollar_bars
+
+
+def test_sweep_matches_backtest(tmp_path):
+    candles, dollar_bars = synthetic_history(np.random.default_rng(3))
+    export_history(str(tmp_path), candles, {THRESHOLD: dollar_bars})
+    grid = param_grid(db_threshold=[THRESHOLD], fast_sma_window=[10, 20], atr_gate=[0.006, 0.01])
+    start = START + pd.Timedelta(days=40)
+
+    results = sweep(str(tmp_path), grid, start=start, max_workers=2)
+
+    assert len(results) == len(grid)
+    assert results["total_return"].is_monotonic_decreasing
+    assert results["events"].sum() > 0
+    candle_times = pd.DatetimeIndex(candles["close_datetime"]).asi8
+    closes = candles["close"].to_numpy()
+    for params in grid:
+        row = results[
+            (results["fast_sma_window"] == params.fast_sma_window) & (results["atr_gate"] == params.atr_gate)
+        ].iloc[0]
+        expected = score(backtest(candles, dollar_bars, params, start=start), candle_times, closes)
+        for name, value in expected.items():
+            assert row[name] == pytest.approx(value), (params, name)